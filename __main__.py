@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Entry point for running the plugin's algorithms without QGIS, e.g.
+``python -m fast_density_analysis run jobs.json``. See batch.py.
+"""
+import sys
+
+from .batch import main
+
+sys.exit(main())
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Headless command line and Python batch runner. Runs KDV, STKDV and NKDV
+ jobs without a QGIS instance:
+
+    python -m fast_density_analysis kdv points.csv heatmap.tif --bandwidth 500
+    python -m fast_density_analysis run jobs.json --processes 4
+
+A job manifest is a JSON list of jobs, or an object with a "jobs" list and
+optional "defaults" merged into every job. Each job is a dict such as
+
+    {"type": "KDV", "input": "points.parquet", "output": "heatmap.tif",
+     "lon": "lon", "lat": "lat", "bandwidth": 1000, "width": 800, "height": 640}
+
+An optional "extent" of [lon_min, lat_min, lon_max, lat_max] restricts KDV
+and STKDV to a study area; only points within one bandwidth of it are read.
+A KDV "mask" names a polygon file: only pixels inside it are computed and
+the rest are written as nodata.
+
+Input may be CSV, Parquet or any vector format geopandas can read
+(GeoPackage, Shapefile, ...). KDV writes GeoTIFF or GeoPackage rasters by
+output extension, STKDV writes one GeoTIFF per time slice into the output
+folder and NKDV writes a GeoPackage (or Shapefile) of lixels.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+JOB_DEFAULTS = {
+    'lon': 'lon',
+    'lat': 'lat',
+    'time': 't',
+    'layer': None,
+    'width': 800,
+    'height': 640,
+    'time_axis': 8,
+    'bandwidth': 1000,
+    'bandwidth_t': 6,
+    'extent': None,
+    'mask': None,
+    'start': None,
+    'end': None,
+    'lixel_length': 20,
+    'bandwidths': None,
+    'snap_processes': 1,
+    'kernel_processes': 1,
+    'prune_beyond_bandwidth': False,
+    'network_type': None,
+    'custom_filter': None,
+    'cluster_gap': None,
+    'cluster_workers': 1,
+    'simplify': False,
+    'cache_folder': None,
+    'network_cache': None,
+    'overpass_endpoint': None,
+    'osm_extract': None,
+    'network': None,
+    'threads': 8,
+}
+
+
+class ConsoleFeedback:
+    """Stand-in for QgsProcessingFeedback that logs to stderr."""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    def pushInfo(self, info):
+        print(self.prefix + info, file=sys.stderr)
+
+    def setProgress(self, progress):
+        pass
+
+    def isCanceled(self):
+        return False
+
+
+def read_points(path, lon_field='lon', lat_field='lat', time_field=None, layer=None, bbox=None):
+    """
+    Read points from CSV, Parquet or a vector file into a DataFrame with
+    'lon', 'lat' and, when time_field is given, 't' (epoch seconds) columns.
+    For vector files without the coordinate fields the point geometry,
+    reprojected to EPSG:4326, is used instead. A (lon_min, lat_min, lon_max,
+    lat_max) bbox is pushed down to the Parquet reader as row filters and to
+    the vector driver's spatial index where possible.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.csv', '.txt'):
+        data = pd.read_csv(path)
+    elif ext in ('.parquet', '.pq'):
+        filters = None
+        if bbox is not None:
+            filters = [(lon_field, '>=', bbox[0]), (lon_field, '<=', bbox[2]),
+                       (lat_field, '>=', bbox[1]), (lat_field, '<=', bbox[3])]
+        data = pd.read_parquet(path, filters=filters)
+    else:
+        import geopandas as gpd
+        data = gpd.read_file(path, layer=layer, bbox=_layer_bbox(path, layer, bbox))
+        if lon_field not in data or lat_field not in data:
+            geometry = data.geometry.to_crs('epsg:4326')
+            data[lon_field] = geometry.x
+            data[lat_field] = geometry.y
+    columns = {lon_field: 'lon', lat_field: 'lat'}
+    if time_field is not None:
+        columns[time_field] = 't'
+    data = data.loc[:, list(columns)].rename(columns=columns)
+    if 't' in data and not pd.api.types.is_numeric_dtype(data['t']):
+        data['t'] = pd.to_datetime(data['t']).astype('int64') // 10 ** 9
+    if bbox is not None:
+        data = data[data['lon'].between(bbox[0], bbox[2]) & data['lat'].between(bbox[1], bbox[3])]
+    return data.dropna()
+
+
+def _layer_bbox(path, layer, bbox):
+    """
+    A (lon_min, lat_min, lon_max, lat_max) bbox in the CRS of a vector
+    layer, as drivers filter by a bbox in the layer's own CRS.
+    """
+    if bbox is None:
+        return None
+    import geopandas as gpd
+    from pyproj import Transformer
+
+    crs = gpd.read_file(path, layer=layer, rows=0).crs
+    if crs is None or crs.equals('epsg:4326'):
+        return tuple(bbox)
+    # Densified, so the edges of the box still cover it once curved
+    return Transformer.from_crs('epsg:4326', crs, always_xy=True).transform_bounds(*bbox, densify_pts=21)
+
+
+def _timestamp(value):
+    """Epoch seconds of a time bound, parsed like the data's times: naive times are UTC."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return pd.Timestamp(value).timestamp()
+
+
+def read_mask(path):
+    """Union of the polygons in a vector file, in EPSG:4326."""
+    import geopandas as gpd
+
+    return gpd.read_file(path).to_crs('epsg:4326').geometry.unary_union
+
+
+def _read_bbox(job, bound=None):
+    """Area to read points from: the job's extent (or bound) grown by its bandwidth."""
+    from .bounds import expandBound
+
+    bound = job['extent'] or bound
+    if bound is None:
+        return None
+    return expandBound(bound, job['bandwidth'])
+
+
+def run_kdv_job(job, feedback):
+    from .heatmap import computeKDV, computeMaskedKDV, writeRaster
+
+    mask = read_mask(job['mask']) if job['mask'] else None
+    bbox = _read_bbox(job, mask.bounds if mask is not None else None)
+    data = read_points(job['input'], job['lon'], job['lat'], layer=job['layer'], bbox=bbox)
+    feedback.pushInfo('Read {} points'.format(len(data)))
+    if mask is not None:
+        result = computeMaskedKDV(data, job['width'], job['height'], job['bandwidth'], mask, job['threads'],
+                                  job['extent'])
+    else:
+        result = computeKDV(data, job['width'], job['height'], job['bandwidth'], job['threads'], job['extent'],
+                            sparse=True)
+    return [writeRaster(result, job['output'])]
+
+
+def run_stkdv_job(job, feedback):
+    from .heatmap import computeSTKDV, iterSTRasters
+
+    data = read_points(job['input'], job['lon'], job['lat'], job['time'], job['layer'], _read_bbox(job))
+    st = _timestamp(job['start'])
+    et = _timestamp(job['end'])
+    if st is not None:
+        data = data[data['t'] >= st]
+    if et is not None:
+        data = data[data['t'] <= et]
+    if data.empty:
+        feedback.pushInfo('No points in the time period')
+        return []
+    feedback.pushInfo('Read {} points'.format(len(data)))
+    result = computeSTKDV(data, job['width'], job['height'], job['time_axis'], job['bandwidth'],
+                          job['bandwidth_t'], job['threads'])
+    os.makedirs(job['output'], exist_ok=True)
+    return [path for dt, path in iterSTRasters(result, job['output'])]
+
+
+def run_nkdv_job(job, feedback):
+    from .nkdv_pipeline import run_nkdv
+
+    data = read_points(job['input'], job['lon'], job['lat'], layer=job['layer'])
+    feedback.pushInfo('Read {} points'.format(len(data)))
+    network = None
+    if job['network']:
+        import geopandas as gpd
+
+        network = gpd.read_file(job['network']).geometry
+    folder_path = job['cache_folder'] or tempfile.mkdtemp(prefix='nkdv_')
+    os.makedirs(folder_path, exist_ok=True)
+    run_nkdv(data[['lon', 'lat']].values.tolist(), folder_path, job['output'], feedback,
+             bandwidth=job['bandwidths'] or job['bandwidth'], lixel_length=job['lixel_length'],
+             processes=job['snap_processes'], network_cache=job['network_cache'],
+             endpoint=job['overpass_endpoint'], extract=job['osm_extract'], network=network,
+             kernel_processes=job['kernel_processes'], prune_beyond_bandwidth=job['prune_beyond_bandwidth'],
+             network_type=job['network_type'], custom_filter=job['custom_filter'], cluster_gap=job['cluster_gap'],
+             cluster_workers=job['cluster_workers'], simplify=job['simplify'])
+    return [job['output']]
+
+
+JOB_RUNNERS = {
+    'KDV': run_kdv_job,
+    'STKDV': run_stkdv_job,
+    'NKDV': run_nkdv_job,
+}
+
+
+def run_job(job):
+    """
+    Run a single job dict and return a result dict with the job's outputs,
+    or the error that stopped it. Never raises, so one bad job does not take
+    down a whole manifest.
+    """
+    job = dict(JOB_DEFAULTS, **job)
+    job_type = str(job.get('type', '')).upper()
+    feedback = ConsoleFeedback('[{} {}] '.format(job_type, job.get('output')))
+    start = time.time()
+    try:
+        if job_type not in JOB_RUNNERS:
+            raise ValueError('Unknown job type {!r}, expected one of {}'.format(job.get('type'),
+                                                                             ', '.join(JOB_RUNNERS)))
+        outputs = JOB_RUNNERS[job_type](job, feedback)
+        error = None
+    except Exception as e:
+        outputs = []
+        error = '{}: {}'.format(type(e).__name__, e)
+        feedback.pushInfo(traceback.format_exc())
+    duration = time.time() - start
+    feedback.pushInfo('Finished, duration:{}s'.format(duration))
+    return {'type': job_type, 'outputs': outputs, 'error': error, 'duration': duration}
+
+
+def _load_engines():
+    """
+    Pool initializer: load the native engines once per worker process so
+    every job the worker runs reuses them.
+    """
+    from . import libkdv  # noqa: F401
+    try:
+        from . import nkdv  # noqa: F401
+    except Exception:
+        # NKDV jobs will report the failure themselves
+        pass
+
+
+def run_jobs(jobs, processes=1):
+    """
+    Run a list of job dicts, sequentially or on a pool of worker processes
+    that each load the engines once, and return their result dicts in order.
+    """
+    if processes <= 1 or len(jobs) <= 1:
+        _load_engines()
+        return [run_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_load_engines) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def load_manifest(path):
+    """Read a job manifest and return its jobs with defaults applied."""
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        return manifest
+    defaults = manifest.get('defaults', {})
+    return [dict(defaults, **job) for job in manifest['jobs']]
+
+
+def _add_common_arguments(parser):
+    parser.add_argument('input', help='CSV, Parquet or vector file of points')
+    parser.add_argument('output', help='output file (or folder for STKDV)')
+    parser.add_argument('--lon', default=JOB_DEFAULTS['lon'], help='longitude field')
+    parser.add_argument('--lat', default=JOB_DEFAULTS['lat'], help='latitude field')
+    parser.add_argument('--layer', default=None, help='layer name for multi-layer inputs')
+    parser.add_argument('--bandwidth', type=float, default=JOB_DEFAULTS['bandwidth'],
+                        help='spatial bandwidth (meters)')
+
+
+def _add_grid_arguments(parser):
+    parser.add_argument('--width', type=int, default=JOB_DEFAULTS['width'])
+    parser.add_argument('--height', type=int, default=JOB_DEFAULTS['height'])
+    parser.add_argument('--threads', type=int, default=JOB_DEFAULTS['threads'])
+    parser.add_argument('--extent', type=float, nargs=4, default=None,
+                        metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'), help='study area')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='fast_density_analysis',
+                                     description='Run fast density analysis without QGIS.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    kdv_parser = subparsers.add_parser('kdv', help='kernel density visualization')
+    _add_common_arguments(kdv_parser)
+    _add_grid_arguments(kdv_parser)
+    kdv_parser.add_argument('--mask', default=None, help='polygon file of the study area')
+
+    stkdv_parser = subparsers.add_parser('stkdv', help='spatiotemporal KDV')
+    _add_common_arguments(stkdv_parser)
+    _add_grid_arguments(stkdv_parser)
+    stkdv_parser.add_argument('--time', default=JOB_DEFAULTS['time'], help='time field')
+    stkdv_parser.add_argument('--time-axis', dest='time_axis', type=int, default=JOB_DEFAULTS['time_axis'])
+    stkdv_parser.add_argument('--bandwidth-t', dest='bandwidth_t', type=float,
+                              default=JOB_DEFAULTS['bandwidth_t'], help='temporal bandwidth (days)')
+    stkdv_parser.add_argument('--start', default=None, help="'yyyy-mm-dd hh:mm:ss'")
+    stkdv_parser.add_argument('--end', default=None, help="'yyyy-mm-dd hh:mm:ss'")
+
+    nkdv_parser = subparsers.add_parser('nkdv', help='network KDV')
+    _add_common_arguments(nkdv_parser)
+    nkdv_parser.add_argument('--lixel-length', dest='lixel_length', type=float,
+                             default=JOB_DEFAULTS['lixel_length'], help='lixel size (meters)')
+    nkdv_parser.add_argument('--bandwidths', type=float, nargs='+', default=None,
+                             help='several bandwidths computed in one pass, one value_<bandwidth> column each')
+    nkdv_parser.add_argument('--cache-folder', dest='cache_folder', default=None,
+                             help='folder of the prepared network, projected points and lixels reused by re-runs')
+    nkdv_parser.add_argument('--network-cache', dest='network_cache', default=None,
+                             help='folder of road networks kept between runs')
+    nkdv_parser.add_argument('--overpass-endpoint', dest='overpass_endpoint', default=None,
+                             help='Overpass interpreter URL')
+    nkdv_parser.add_argument('--osm-extract', dest='osm_extract', default=None,
+                             help='local .osm, .osm.bz2 or .osm.pbf extract to read the network from')
+    nkdv_parser.add_argument('--network-type', dest='network_type', default=None,
+                             help='roads downloaded from Overpass: drive, drive_service, walk, bike, all or '
+                                  'all_private (default: every highway)')
+    nkdv_parser.add_argument('--custom-filter', dest='custom_filter', default=None,
+                             help='Overpass way filter used instead, e.g. \'["highway"~"primary|secondary"]\'')
+    nkdv_parser.add_argument('--network', default=None,
+                             help='road centreline file to build the network from instead of OpenStreetMap')
+    nkdv_parser.add_argument('--snap-processes', dest='snap_processes', type=int,
+                             default=JOB_DEFAULTS['snap_processes'],
+                             help='worker processes for snapping points onto the network')
+    nkdv_parser.add_argument('--kernel-processes', dest='kernel_processes', type=int,
+                             default=JOB_DEFAULTS['kernel_processes'],
+                             help='network regions computed in parallel worker processes')
+    nkdv_parser.add_argument('--cluster-gap', dest='cluster_gap', type=float, default=None,
+                             help='give clusters of points further apart than this (meters) their own networks')
+    nkdv_parser.add_argument('--cluster-workers', dest='cluster_workers', type=int,
+                             default=JOB_DEFAULTS['cluster_workers'], help='clusters computed at the same time')
+    nkdv_parser.add_argument('--simplify', action='store_true',
+                             help='merge the nodes along OpenStreetMap roads before building the network')
+    nkdv_parser.add_argument('--prune-beyond-bandwidth', dest='prune_beyond_bandwidth', action='store_true',
+                             help='drop roads beyond one bandwidth of network distance from every point')
+
+    run_parser = subparsers.add_parser('run', help='run a JSON job manifest')
+    run_parser.add_argument('manifest')
+    run_parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'run':
+        results = run_jobs(load_manifest(args.manifest), args.processes)
+    else:
+        job = {k: v for k, v in vars(args).items() if k != 'command'}
+        job['type'] = args.command
+        results = [run_job(job)]
+    failed = [r for r in results if r['error']]
+    for result in failed:
+        print('{} job failed: {}'.format(result['type'], result['error']), file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    return 1 if failed else 0
@@ -0,0 +1,6 @@
+"""
+Timing scripts for the plugin's processing stages. Run them as modules
+from the folder containing the plugin, e.g.
+
+    python -m fast_density_analysis.benchmarks.graph_output
+"""
@@ -0,0 +1,89 @@
+"""
+Benchmark consolidating intersections: clustering nodes by buffering them
+and dissolving the buffers against the KD-tree and connected components
+clustering, on a synthetic projected street grid where some intersections
+are split into several nearby nodes. Checks that both rebuild the same graph.
+
+    python -m fast_density_analysis.benchmarks.consolidation --size 300
+"""
+import argparse
+import time
+import networkx as nx
+import numpy as np
+from shapely.geometry import LineString
+from ..utils.osmnx import simplification
+
+
+def synthetic_grid(size, spacing=50.0, split=0.2, tolerance=0.5, seed=0):
+    """
+    Projected MultiDiGraph of a size x size street grid. A share split of the
+    intersections are made of up to 4 nodes within tolerance of each other,
+    chained by short links, as divided roads are.
+    """
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs='epsg:32650')
+    node = 0
+    corner = {}
+    for i in range(size):
+        for j in range(size):
+            count = rng.integers(2, 5) if rng.random() < split else 1
+            offsets = rng.uniform(-tolerance / 2, tolerance / 2, (count, 2)) if count > 1 else np.zeros((1, 2))
+            ids = list(range(node, node + count))
+            for k, (dx, dy) in zip(ids, offsets):
+                G.add_node(k, x=i * spacing + dx, y=j * spacing + dy, street_count=4)
+            for a, b in zip(ids[:-1], ids[1:]):
+                _add_edge(G, a, b)
+            corner[i, j] = ids
+            node += count
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size:
+                _add_edge(G, corner[i, j][-1], corner[i + 1, j][0])
+            if j + 1 < size:
+                _add_edge(G, corner[i, j][0], corner[i, j + 1][-1])
+    return G
+
+
+def _add_edge(G, u, v):
+    line = LineString([(G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y'])])
+    G.add_edge(u, v, length=line.length, geometry=line)
+    G.add_edge(v, u, length=line.length, geometry=line.reverse())
+
+
+def same_graph(a, b, tolerance=1e-3):
+    """Whether two rebuilt graphs have the same nodes, edges and (up to tolerance) coordinates."""
+    if list(a.nodes) != list(b.nodes) or list(a.edges(keys=True)) != list(b.edges(keys=True)):
+        return False
+    for n in a.nodes:
+        if a.nodes[n]['osmid_original'] != b.nodes[n]['osmid_original']:
+            return False
+        if abs(a.nodes[n]['x'] - b.nodes[n]['x']) > tolerance or abs(a.nodes[n]['y'] - b.nodes[n]['y']) > tolerance:
+            return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=150, help='intersections per side of the grid')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--skip-buffer', action='store_true', help='only time the KD-tree clustering')
+    args = parser.parse_args(argv)
+
+    G = synthetic_grid(args.size, tolerance=args.tolerance)
+    print('{} nodes, {} edges'.format(G.number_of_nodes(), G.number_of_edges()))
+    start = time.time()
+    kdtree = simplification.consolidate_intersections(G, args.tolerance, dead_ends=True, method='kdtree')
+    kdtree_time = time.time() - start
+    print('kdtree: {:.2f}s, {} nodes'.format(kdtree_time, kdtree.number_of_nodes()))
+    if args.skip_buffer:
+        return
+    start = time.time()
+    buffer = simplification.consolidate_intersections(G, args.tolerance, dead_ends=True, method='buffer')
+    buffer_time = time.time() - start
+    print('buffer: {:.2f}s, {} nodes ({:.1f}x)'.format(buffer_time, buffer.number_of_nodes(),
+                                                      buffer_time / kdtree_time))
+    print('identical output: {}'.format(same_graph(buffer, kdtree)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark writing the NKDV graph_output file: the original row-by-row
+merge against the sorted-array merge, on a synthetic network. Checks that
+both write the same file.
+
+    python -m fast_density_analysis.benchmarks.graph_output --edges 500000 --points 2000000
+"""
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from ..nkdv_pipeline import merge
+# merge imports the NKDV package lazily; load it here so that is not timed
+from ..nkdv import nkdv  # noqa: F401
+
+
+def merge_rows(edges_df, dis_df, nodes_num, folder_path):
+    """The original merge: a Python loop over the merged rows and one write per value."""
+    merge_df = pd.merge(edges_df, dis_df, on=['u_id', 'v_id'], how='left')
+    merge_df = merge_df.sort_values(by=['u_id', 'v_id'], ascending=[True, True])
+    merge_df = merge_df.reset_index()
+    merge_np = merge_df.to_numpy()
+    if np.isnan(merge_np[0][4]):
+        row = [merge_np[0][1], merge_np[0][2], merge_np[0][3], 0]
+    else:
+        row = [merge_np[0][1], merge_np[0][2], merge_np[0][3], 1, merge_np[0][4]]
+    res = []
+    for i in range(1, merge_np.shape[0]):
+        if merge_np[i][1] == merge_np[i - 1][1] and merge_np[i][2] == merge_np[i - 1][2]:
+            row[3] = row[3] + 1
+            row.append(merge_np[i][4])
+        elif np.isnan(merge_np[i][4]):
+            res.append(row)
+            row = [merge_np[i][1], merge_np[i][2], merge_np[i][3], 0]
+        else:
+            res.append(row)
+            row = [merge_np[i][1], merge_np[i][2], merge_np[i][3], 1, merge_np[i][4]]
+    res.append(row)
+    with open(folder_path + '/graph_output', 'w') as fp:
+        fp.write("%s " % str(nodes_num))
+        fp.write("%s\n" % str(edges_df.shape[0]))
+        for list_in in res:
+            fp.write("%s " % str(int(list_in[0])))
+            fp.write("%s" % str(int(list_in[1])))
+            for i in range(2, len(list_in)):
+                fp.write(" %s" % str(list_in[i]))
+            fp.write("\n")
+
+
+def synthetic_network(num_edges, num_points, seed=0):
+    """Edge and point distance frames of a random network with about num_edges / 2 nodes."""
+    rng = np.random.default_rng(seed)
+    nodes_num = max(num_edges // 2, 2)
+    u = rng.integers(0, nodes_num - 1, num_edges)
+    v = u + 1 + rng.integers(0, nodes_num - 1 - u)
+    edges_df = pd.DataFrame({'u_id': u, 'v_id': v}).drop_duplicates(ignore_index=True)
+    edges_df['length'] = rng.uniform(1, 500, len(edges_df))
+    edge = rng.integers(0, len(edges_df), num_points)
+    dis_df = pd.DataFrame({'u_id': edges_df['u_id'].values[edge], 'v_id': edges_df['v_id'].values[edge],
+                           'distance': rng.uniform(0, 1, num_points) * edges_df['length'].values[edge]})
+    dis_df = dis_df.sort_values(by=['u_id', 'v_id', 'distance'], ignore_index=True)
+    return edges_df, dis_df, nodes_num
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--edges', type=int, default=100000)
+    parser.add_argument('--points', type=int, default=400000)
+    args = parser.parse_args(argv)
+
+    edges_df, dis_df, nodes_num = synthetic_network(args.edges, args.points)
+    print('{} edges, {} points'.format(len(edges_df), len(dis_df)))
+    with tempfile.TemporaryDirectory() as rows_dir, tempfile.TemporaryDirectory() as array_dir:
+        start = time.time()
+        merge_rows(edges_df, dis_df, nodes_num, rows_dir)
+        rows_time = time.time() - start
+        start = time.time()
+        merge(edges_df, dis_df, nodes_num, array_dir)
+        array_time = time.time() - start
+        same = filecmp.cmp(os.path.join(rows_dir, 'graph_output'), os.path.join(array_dir, 'graph_output'),
+                           shallow=False)
+    print('row loop: {:.2f}s'.format(rows_time))
+    print('arrays:   {:.2f}s ({:.1f}x)'.format(array_time, rows_time / array_time))
+    print('identical output: {}'.format(same))
+
+
+if __name__ == '__main__':
+    main()
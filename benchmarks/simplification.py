@@ -0,0 +1,104 @@
+"""
+Benchmark NKDV on an OpenStreetMap network with and without simplification,
+on a synthetic extract of a street grid whose roads bend through shape
+nodes between intersections. Reports the node and edge counts of the
+prepared networks, the time of every run and whether both carry the same
+roads and density.
+
+    python -m fast_density_analysis.benchmarks.simplification --size 60
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from ..nkdv_pipeline import read_network, run_nkdv
+
+
+def synthetic_extract(path, size, spacing=0.002, shape_nodes=4, lat=22.3, lon=114.15, seed=0):
+    """
+    Write an OSM XML extract of a size x size street grid with spacing
+    degrees between intersections, every block bending through shape_nodes
+    nodes. A third of the east-west streets are one-way.
+    """
+    rng = np.random.default_rng(seed)
+    step = spacing / (shape_nodes + 1)
+    nodes = []
+
+    def add_node(node_lat, node_lon):
+        nodes.append('<node id="{}" lat="{:.7f}" lon="{:.7f}"/>'.format(len(nodes) + 1, node_lat, node_lon))
+        return len(nodes)
+
+    corner = {(i, j): add_node(lat + i * spacing, lon + j * spacing) for i in range(size) for j in range(size)}
+    ways = []
+    for i in range(size):
+        for east in (True, False):
+            refs = []
+            for j in range(size):
+                refs.append(corner[(i, j) if east else (j, i)])
+                if j + 1 == size:
+                    break
+                for k in range(1, shape_nodes + 1):
+                    bend = rng.uniform(-step / 4, step / 4)
+                    if east:
+                        refs.append(add_node(lat + i * spacing + bend, lon + j * spacing + k * step))
+                    else:
+                        refs.append(add_node(lat + j * spacing + k * step, lon + i * spacing + bend))
+            tags = '<tag k="highway" v="residential"/>'
+            if east and i % 3 == 0:
+                tags += '<tag k="oneway" v="yes"/>'
+            ways.append('<way id="{}">{}{}</way>'.format(len(ways) + 1,
+                                                       ''.join('<nd ref="{}"/>'.format(r) for r in refs), tags))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        f.write('\n'.join(nodes + ways))
+        f.write('\n</osm>\n')
+    return lat, lon, lat + (size - 1) * spacing, lon + (size - 1) * spacing
+
+
+class _Quiet:
+    def pushInfo(self, message):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=60, help='intersections per side of the grid')
+    parser.add_argument('--shape-nodes', dest='shape_nodes', type=int, default=4,
+                        help='shape nodes along every block')
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--bandwidth', type=float, default=500)
+    parser.add_argument('--lixel-length', dest='lixel_length', type=float, default=20)
+    args = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp(prefix='nkdv_simplification_')
+    extract = os.path.join(folder, 'grid.osm')
+    lat_min, lon_min, lat_max, lon_max = synthetic_extract(extract, args.size, shape_nodes=args.shape_nodes)
+    rng = np.random.default_rng(0)
+    coords = np.column_stack((rng.uniform(lon_min, lon_max, args.points), rng.uniform(lat_min, lat_max, args.points)))
+
+    results = {}
+    for simplify in (False, True):
+        name = 'simplified' if simplify else 'unsimplified'
+        start = time.time()
+        road = read_network(extract, lat_min, lon_min, lat_max, lon_max, simplify)
+        prepare_time = time.time() - start
+        start = time.time()
+        lixels = run_nkdv(coords.tolist(), os.path.join(folder, name), os.path.join(folder, name + '.gpkg'), _Quiet(),
+                          args.bandwidth, args.lixel_length, extract=extract, reuse_stages=False, simplify=simplify)
+        total_time = time.time() - start
+        # Density integrated along the roads, independent of where the lixels fall
+        mass = float((lixels['value'] * lixels.geometry.length).sum())
+        results[simplify] = road.length.sum(), mass, total_time
+        print('{}: {} nodes, {} edges, network {:.2f}s, NKDV {:.2f}s, {} lixels'.format(
+            name, road.num_nodes, road.num_edges, prepare_time, total_time, len(lixels)))
+
+    (length, mass, plain_time), (simple_length, simple_mass, simple_time) = results[False], results[True]
+    print('speedup: {:.1f}x'.format(plain_time / simple_time))
+    print('same road length: {}'.format(np.isclose(length, simple_length)))
+    print('density integral: {:.6g} vs {:.6g} ({:.2%} apart)'.format(mass, simple_mass,
+                                                                      abs(mass - simple_mass) / mass))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Bounds in GPS coordinates. Imports neither GDAL, QGIS nor the native
+ libkdv library, so headless NKDV runs without them.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+from math import cos, pi, radians
+
+# Earth radius in meters, as in libkdv.utils
+EARTH_RADIUS = 6371000
+
+# Meters per degree of latitude, as libkdv converts GPS coordinates
+METERS_PER_DEGREE = EARTH_RADIUS * pi / 180
+
+
+def expandBound(bound, meters, lat=None):
+    """
+    Grow a (lon_min, lat_min, lon_max, lat_max) bound by meters on every side,
+    so points just outside it still contribute to its edge pixels. Longitude
+    degrees are sized at lat, by default the bound's latitude furthest from
+    the equator, which never under-expands.
+    """
+    lon_min, lat_min, lon_max, lat_max = bound
+    if lat is None:
+        lat = max(abs(lat_min), abs(lat_max))
+    dy = meters / METERS_PER_DEGREE
+    dx = dy / cos(radians(min(abs(lat), 89.0)))
+    return lon_min - dx, lat_min - dy, lon_max + dx, lat_max + dy
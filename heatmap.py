@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ KDV/STKDV computation and GeoTIFF writing shared by the processing
+ algorithms and the headless batch runner. Nothing in here imports QGIS,
+ and GDAL only once a raster is written.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+from math import cos, radians
+import numpy as np
+import pandas as pd
+from .libkdv import kdv
+from .bounds import METERS_PER_DEGREE, expandBound
+
+# GDAL output driver by file extension
+RASTER_DRIVERS = {
+    '.tif': 'GTiff',
+    '.tiff': 'GTiff',
+    '.gpkg': 'GPKG',
+}
+
+# Value written for pixels outside a mask
+NODATA = -9999.0
+
+# Block size of sparse GeoTIFFs
+SPARSE_BLOCK_SIZE = 256
+
+
+class SparseRaster:
+    """
+    Heatmap kept as its non-zero pixels only (COO layout): the grid it lies
+    on, given by the (lon_min, lat_min, lon_max, lat_max) pixel centres at its
+    corners and its width and height in pixels, plus the column (from the
+    west), row (from the north) and value of every non-zero pixel. Pixels
+    not listed read as fill: 0, or NaN (nodata) outside a mask, when every
+    pixel inside it is listed.
+    """
+
+    def __init__(self, bound, width, height, cols, rows, values, fill=0.0):
+        self.bound = tuple(bound)
+        self.width = width
+        self.height = height
+        self.cols = np.asarray(cols, dtype=np.int32)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.fill = fill
+
+    @classmethod
+    def fromResult(cls, result, bound, width, height):
+        """Sparse raster of a lon/lat/val kernel result computed on the grid spanning bound."""
+        lon_min, lat_min, lon_max, lat_max = bound
+        result = result[result['val'] != 0]
+        cols = np.rint((result['lon'].values - lon_min) / (lon_max - lon_min) * (width - 1))
+        rows = np.rint((lat_max - result['lat'].values) / (lat_max - lat_min) * (height - 1))
+        return cls(bound, width, height, cols, rows, result['val'].values)
+
+    @property
+    def geoTransform(self):
+        """GDAL geotransform of the grid (pixel edges, north up)."""
+        lon_min, lat_min, lon_max, lat_max = self.bound
+        dx = (lon_max - lon_min) / (self.width - 1)
+        dy = (lat_max - lat_min) / (self.height - 1)
+        return lon_min - dx / 2, dx, 0.0, lat_max + dy / 2, 0.0, -dy
+
+    def toDense(self):
+        """(height, width) array of the raster, north row first."""
+        dense = np.full((self.height, self.width), self.fill, dtype=np.float32)
+        dense[self.rows, self.cols] = self.values
+        return dense
+
+    def toFrame(self, everyPixel=False):
+        """
+        lon/lat/val DataFrame of the listed pixels, as returned by the kernel,
+        or with everyPixel of the whole grid.
+        """
+        lon_min, lat_min, lon_max, lat_max = self.bound
+        if everyPixel:
+            rows, cols = np.indices((self.height, self.width)).reshape(2, -1)
+            values = self.toDense().ravel()
+        else:
+            rows, cols, values = self.rows, self.cols, self.values
+        return pd.DataFrame({
+            'lon': lon_min + cols * (lon_max - lon_min) / (self.width - 1),
+            'lat': lat_max - rows * (lat_max - lat_min) / (self.height - 1),
+            'val': values,
+        })
+
+
+def _boundedKDV(data, bound, row_pixels, col_pixels, bandwidth_s, num_threads, middle_lat):
+    """
+    Run KDV over the grid spanning bound, projecting with middle_lat. Returns
+    None when no point lies within one bandwidth of the bound.
+    """
+    lon_min, lat_min, lon_max, lat_max = bound
+    # Points further than one bandwidth outside the bound contribute nothing
+    # to it, and the native kernel does not accept them, so drop them using
+    # the same projection kdv applies
+    x_min, y_min, x_max, y_max = expandBound(bound, bandwidth_s, middle_lat)
+    data = data[(data['lon'] > x_min) & (data['lon'] < x_max) & (data['lat'] > y_min) & (data['lat'] < y_max)]
+    if data.empty:
+        return None
+    kdv_data = kdv(data, GPS=True, KDV_type='KDV', middle_lat=middle_lat, bandwidth=bandwidth_s,
+                   row_pixels=row_pixels, col_pixels=col_pixels, num_threads=num_threads)
+    # kdv.set_bound takes the latitude range first for GPS data
+    kdv_data.set_bound([lat_min, lat_max, lon_min, lon_max])
+    return kdv_data.compute()
+
+
+def computeKDV(data, row_pixels, col_pixels, bandwidth_s, num_threads=8, bound=None, sparse=False):
+    """
+    Run KDV on a DataFrame with 'lon' and 'lat' columns and return the
+    lon/lat/val result of the kernel, or a SparseRaster of it when sparse is
+    set. The output grid spans the data unless a (lon_min, lat_min, lon_max,
+    lat_max) bound is given.
+    """
+    if bound is None:
+        kdv_data = kdv(data, GPS=True, KDV_type='KDV', bandwidth=bandwidth_s, row_pixels=row_pixels,
+                       col_pixels=col_pixels, num_threads=num_threads)
+        result = kdv_data.compute()
+        bound = (data['lon'].min(), data['lat'].min(), data['lon'].max(), data['lat'].max())
+    else:
+        result = _boundedKDV(data, bound, row_pixels, col_pixels, bandwidth_s, num_threads,
+                             (bound[1] + bound[3]) / 2)
+        if result is None:
+            raise ValueError('No points within the bandwidth of the bound')
+    if sparse:
+        return SparseRaster.fromResult(result, bound, row_pixels, col_pixels)
+    return result
+
+
+def _epanechnikov(data, lon, lat, bandwidth_s, sx, sy):
+    """Unnormalized Epanechnikov density of the points at one location, sx/sy meters per degree."""
+    d2 = ((data['lon'].values - lon) * sx) ** 2 + ((data['lat'].values - lat) * sy) ** 2
+    u = d2[d2 < bandwidth_s ** 2] / bandwidth_s ** 2
+    return (1 - u).sum()
+
+
+def _stripScale(result, data, bandwidth_s, sx, sy):
+    """
+    Factor bringing a strip's kernel result, which the native kernel scales
+    to its own maximum, back to raw density sums: the raw density at its
+    peak over the kernel's value there. None when the strip is all zero.
+    A second pixel is checked against the same factor, so a kernel whose
+    type or scaling no longer matches _epanechnikov fails loudly instead
+    of stitching strips on different scales.
+    """
+    values = result['val'].values
+    if not len(values) or values.max() <= 0:
+        return None
+    peak = values.argmax()
+    lons, lats = result['lon'].values, result['lat'].values
+    scale = _epanechnikov(data, lons[peak], lats[peak], bandwidth_s, sx, sy) / values[peak]
+    check = np.abs(values - values[peak] / 2).argmin()
+    if values[check] > 0:
+        expected = _epanechnikov(data, lons[check], lats[check], bandwidth_s, sx, sy)
+        if not np.isclose(values[check] * scale, expected, rtol=1e-4):
+            raise RuntimeError('The native KDV kernel no longer matches the Epanechnikov kernel used '
+                               'to stitch masked strips')
+    return scale
+
+
+def _span(indexes, size):
+    """First and last of the sorted indexes, widened to the two pixels the native grid needs."""
+    first, last = indexes[0], indexes[-1]
+    if first == last:
+        if last + 1 < size:
+            last += 1
+        else:
+            first -= 1
+    return first, last
+
+
+def computeMaskedKDV(data, row_pixels, col_pixels, bandwidth_s, mask, num_threads=8, bound=None,
+                     strip_pixels=16):
+    """
+    Run KDV only over the pixels inside mask, a shapely (multi)polygon in
+    EPSG:4326, on the grid spanning bound (the mask's bounds by default).
+    Returns a SparseRaster of the pixels inside the mask, scaled to a
+    maximum of 1, which reads as NaN outside it.
+
+    The native kernel evaluates whole rectangles, so the grid is cut into
+    strips of strip_pixels latitude rows, and each strip is computed over
+    just the span of columns it has inside the mask. Points further than one
+    bandwidth from the mask are dropped up front. The kernel scales each
+    call's output to its own maximum, so every strip is brought back to raw
+    density sums (see _stripScale) before they are joined. Only one strip of
+    the grid is rasterized at a time.
+    """
+    import shapely
+
+    if bound is None:
+        bound = mask.bounds
+    lon_min, lat_min, lon_max, lat_max = bound
+    middle_lat = (lat_min + lat_max) / 2
+
+    # Distances in the plane kdv projects GPS coordinates onto
+    sx = METERS_PER_DEGREE * cos(radians(middle_lat))
+    sy = METERS_PER_DEGREE
+    mask_xy = shapely.transform(mask, lambda c: c * (sx, sy))
+    points_xy = shapely.points(data['lon'].values * sx, data['lat'].values * sy)
+    data = data[shapely.dwithin(mask_xy, points_xy, bandwidth_s)]
+    shapely.prepare(mask)
+
+    lons = np.linspace(lon_min, lon_max, row_pixels)
+    lats = np.linspace(lat_min, lat_max, col_pixels)
+    dx = (lon_max - lon_min) / (row_pixels - 1)
+    dy = (lat_max - lat_min) / (col_pixels - 1)
+    cols, rows, values = [], [], []
+    for r0 in range(0, col_pixels, strip_pixels):
+        strip_lats = lats[r0:r0 + strip_pixels]
+        xx, yy = np.meshgrid(lons, strip_lats, indexing='ij')
+        strip = shapely.intersects_xy(mask, xx, yy)
+        i, j = np.nonzero(strip)
+        if not len(i):
+            continue
+        val = np.zeros(len(i))
+        if not data.empty:
+            c0, c1 = _span(np.unique(i), row_pixels)
+            s0, s1 = _span(r0 + np.unique(j), col_pixels)
+            result = _boundedKDV(data, (lons[c0], lats[s0], lons[c1], lats[s1]), c1 - c0 + 1, s1 - s0 + 1,
+                                 bandwidth_s, num_threads, middle_lat)
+            scale = None if result is None else _stripScale(result, data, bandwidth_s, sx, sy)
+            if scale is not None:
+                # The strip shares the full grid's pixel spacing, so its
+                # pixels map straight back onto the full grid
+                grid = np.zeros((row_pixels, len(strip_lats)))
+                ri = np.rint((result['lon'].values - lon_min) / dx).astype(int)
+                rj = np.rint((result['lat'].values - lat_min) / dy).astype(int) - r0
+                # A one-row strip is computed with a row of the next one
+                keep = (rj >= 0) & (rj < len(strip_lats))
+                grid[ri[keep], rj[keep]] = result['val'].values[keep] * scale
+                val = grid[i, j]
+        cols.append(i)
+        rows.append(col_pixels - 1 - (r0 + j))
+        values.append(val)
+    if not cols:
+        raise ValueError('The mask does not cover any pixel of the bound')
+    values = np.concatenate(values)
+    if values.max() > 0:
+        values /= values.max()
+    return SparseRaster(bound, row_pixels, col_pixels, np.concatenate(cols), np.concatenate(rows), values,
+                        fill=np.nan)
+
+
+def computeSTKDV(data, row_pixels, col_pixels, t_pixels, bandwidth_s, bandwidth_t, num_threads=8):
+    """
+    Run STKDV on a DataFrame with 'lon', 'lat' and 't' (epoch seconds) columns
+    and return the lon/lat/val/t result of the kernel.
+    """
+    kdv_data = kdv(data, GPS=True, KDV_type='STKDV', bandwidth=bandwidth_s, bandwidth_t=bandwidth_t,
+                   row_pixels=row_pixels, col_pixels=col_pixels, t_pixels=t_pixels, num_threads=num_threads)
+    return kdv_data.compute()
+
+
+def writeSparseTiff(raster, path):
+    """
+    Write a SparseRaster to a tiled GeoTIFF in EPSG:4326 that only stores the
+    blocks holding listed pixels; the others are left unallocated and read
+    back as 0, or as NODATA for a NaN fill. Returns the path.
+    """
+    from osgeo import gdal
+
+    block = SPARSE_BLOCK_SIZE
+    fill = NODATA if np.isnan(raster.fill) else raster.fill
+    ds = gdal.GetDriverByName('GTiff').Create(
+        path, raster.width, raster.height, 1, gdal.GDT_Float32,
+        options=['TILED=YES', 'SPARSE_OK=TRUE', 'COMPRESS=DEFLATE',
+                 'BLOCKXSIZE={}'.format(block), 'BLOCKYSIZE={}'.format(block)])
+    ds.SetGeoTransform(raster.geoTransform)
+    ds.SetProjection('EPSG:4326')
+    band = ds.GetRasterBand(1)
+    if fill != 0:
+        band.SetNoDataValue(fill)
+    block_ids = (raster.rows // block) * ((raster.width + block - 1) // block) + raster.cols // block
+    order = np.argsort(block_ids, kind='stable')
+    ids, starts = np.unique(block_ids[order], return_index=True)
+    for start, end in zip(starts, np.append(starts[1:], len(order))):
+        pixels = order[start:end]
+        rows, cols = raster.rows[pixels], raster.cols[pixels]
+        yoff, xoff = rows[0] // block * block, cols[0] // block * block
+        tile = np.full((min(block, raster.height - yoff), min(block, raster.width - xoff)), fill, dtype=np.float32)
+        tile[rows - yoff, cols - xoff] = raster.values[pixels]
+        band.WriteArray(tile, int(xoff), int(yoff))
+    band.FlushCache()
+    ds = None
+    return path
+
+
+def writeRaster(result, path, scale_params=None):
+    """
+    Write a lon/lat/val result to a raster at path (GeoTIFF or GeoPackage,
+    chosen by extension) in EPSG:4326 and return the path. NaN values are
+    written as NODATA. A SparseRaster is written as a sparse GeoTIFF when
+    possible.
+    """
+    from osgeo import gdal
+
+    if isinstance(result, SparseRaster):
+        if scale_params is None and RASTER_DRIVERS.get(os.path.splitext(path)[1].lower(), 'GTiff') == 'GTiff':
+            return writeSparseTiff(result, path)
+        # Outside a mask every pixel is written, so it gets NODATA
+        result = result.toFrame(everyPixel=bool(np.isnan(result.fill)))
+    result = result.rename(columns={"lon": "x", "lat": "y", "val": "value"})
+    no_data = None
+    if result['value'].isna().any():
+        result['value'] = result['value'].fillna(NODATA)
+        no_data = NODATA
+    # Sorted according to first y minus then x increasing (from top left corner, top to bottom left to right)
+    result = result.sort_values(by=["y", "x"], ascending=[False, True])
+    base, ext = os.path.splitext(path)
+    xyz_path = base + ".xyz"
+    result[["x", "y", "value"]].to_csv(xyz_path, index=False, header=False, sep=" ")
+    opts = gdal.TranslateOptions(
+        format=RASTER_DRIVERS.get(ext.lower(), 'GTiff'),
+        outputSRS="EPSG:4326",
+        scaleParams=scale_params,
+        noData=no_data
+    )
+    temp = gdal.Translate(path, xyz_path, options=opts)
+    temp = None
+    os.remove(xyz_path)
+    return path
+
+
+def iterSTRasters(result, savePath, prefix="STHeatmap "):
+    """
+    Write one GeoTIFF per time slice of a STKDV result into savePath, all
+    scaled to the value range of the whole result. Yields (datetime, path)
+    in time order, so callers can report progress or stop between slices.
+    """
+    result = result.copy()
+    # Convert time column to datetime type
+    result['t'] = pd.to_datetime(result['t'], unit='s')
+    # Get value range for scaling
+    scale_params = [[result['val'].min(), result['val'].max()]]
+    for dt, group in result.groupby('t'):
+        path = os.path.join(savePath, prefix + dt.strftime("%Y-%m-%d %H-%M-%S") + ".tif")
+        # Delete Time Column
+        writeRaster(group.drop('t', axis=1), path, scale_params)
+        yield dt, path
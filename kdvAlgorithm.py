@@ -29,6 +29,11 @@ from qgis.core import (
     QgsProcessingParameterDefinition,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterField,
+    QgsProcessingParameterExtent,
+    QgsProcessingParameterFeatureSource,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsRectangle,
     QgsMessageLog,
     Qgis,
     QgsProject,
@@ -36,10 +41,9 @@ from qgis.core import (
     QgsStyle
 )
 from qgis.PyQt.QtGui import QIcon
-from .libkdv import kdv
+from .heatmap import computeKDV, computeMaskedKDV, expandBound, writeRaster
 from .rasterstyle import applyPseudocolor
-import pandas as pd
-from osgeo import gdal
+from .layerdata import featureRequest, layerToDataFrame, sourceGeometry
 from datetime import datetime
 import time
 
@@ -53,6 +57,8 @@ class KDVAlgorithm(QgsProcessingAlgorithm):
     WIDTH = 'WIDTH'
     HEIGHT = 'HEIGHT'
     SPATIALBANDWIDTH = 'SPATIALBANDWIDTH'
+    EXTENT = 'EXTENT'
+    MASK = 'MASK'
     RAMPNAME = 'RAMPNAME'
     INVERT = 'INVERT'
     INTERPOLATION = 'INTERPOLATION'
@@ -112,6 +118,21 @@ class KDVAlgorithm(QgsProcessingAlgorithm):
                 optional=False
             )
         )
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                'Study area extent',
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.MASK,
+                'Study area mask',
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
         if Qgis.QGIS_VERSION_INT >= 32200:
             param = QgsProcessingParameterString(
                 self.RAMPNAME,
@@ -196,6 +217,14 @@ class KDVAlgorithm(QgsProcessingAlgorithm):
         row_pixels = self.parameterAsInt(parameters, self.WIDTH, context)
         col_pixels = self.parameterAsInt(parameters, self.HEIGHT, context)
         bandwidth_s = self.parameterAsDouble(parameters, self.SPATIALBANDWIDTH, context)
+        extent = None
+        if parameters.get(self.EXTENT):
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context,
+                                            QgsCoordinateReferenceSystem('EPSG:4326'))
+        mask = None
+        source = self.parameterAsSource(parameters, self.MASK, context)
+        if source is not None:
+            mask = sourceGeometry(source, QgsCoordinateReferenceSystem('EPSG:4326'))
 
         if Qgis.QGIS_VERSION_INT >= 32200:
             ramp_name = self.parameterAsString(parameters, self.RAMPNAME, context)
@@ -206,7 +235,7 @@ class KDVAlgorithm(QgsProcessingAlgorithm):
         mode = self.parameterAsInt(parameters, self.MODE, context)
         num_classes = self.parameterAsInt(parameters, self.CLASSES, context)
         rlayer = processKDV(lyr, fldLon, fldLat, row_pixels, col_pixels, bandwidth_s, ramp_name, invert, interp, mode,
-                            num_classes, feedback)
+                            num_classes, feedback, extent, mask)
 
         return {self.OUTPUT: rlayer}
 
@@ -244,7 +273,7 @@ class KDVAlgorithm(QgsProcessingAlgorithm):
 
 
 def processKDV(lyr, fldLon, fldLat, row_pixels, col_pixels, bandwidth_s, ramp_name, invert, interp, mode, num_classes,
-               feedback):
+               feedback, extent=None, mask=None):
     # Get currentTime
     currentTime =datetime.now()
     # toString
@@ -264,9 +293,22 @@ def processKDV(lyr, fldLon, fldLat, row_pixels, col_pixels, bandwidth_s, ramp_na
     # Start aggregate features
     feedback.pushInfo('Start aggregate features')
     start = time.time()
-    data = pd.DataFrame([feat.attributes() for feat in lyr.getFeatures()], columns=[field.name() for field in lyr.fields()])
-    data = data.loc[:, [fldLat, fldLon]]
-    data.rename(columns={fldLat: 'lat', fldLon: 'lon'}, inplace=True)
+    # With a study area, only read the features within the bandwidth of it
+    # (through the provider's spatial index) and only compute its pixels
+    bound = None
+    rect = None
+    if extent is not None:
+        bound = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+    elif mask is not None:
+        bound = mask.bounds
+    if bound is not None:
+        transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem('EPSG:4326'), lyr.crs(), QgsProject.instance())
+        rect = transform.transformBoundingBox(QgsRectangle(*expandBound(bound, bandwidth_s)))
+    request = featureRequest(lyr, [fldLat, fldLon], extent=rect)
+    data = layerToDataFrame(lyr, [fldLat, fldLon], ['lat', 'lon'], request)
+    if data.empty:
+        feedback.pushInfo('No points in the study area')
+        return {}
     end = time.time()
     duration = end - start
     feedback.setProgress(40)
@@ -278,8 +320,10 @@ def processKDV(lyr, fldLon, fldLat, row_pixels, col_pixels, bandwidth_s, ramp_na
     # Start KDV
     feedback.pushInfo('Start KDV')
     start = time.time()
-    kdv_data = kdv(data, GPS=True, KDV_type='KDV', bandwidth=bandwidth_s, row_pixels=row_pixels, col_pixels=col_pixels)
-    kdv_data.compute()
+    if mask is not None:
+        kdv_result = computeMaskedKDV(data, row_pixels, col_pixels, bandwidth_s, mask, bound=bound)
+    else:
+        kdv_result = computeKDV(data, row_pixels, col_pixels, bandwidth_s, bound=bound, sparse=True)
     end = time.time()
     duration = end - start
     feedback.setProgress(70)
@@ -291,18 +335,7 @@ def processKDV(lyr, fldLon, fldLat, row_pixels, col_pixels, bandwidth_s, ramp_na
     # Start generate KDV raster layer
     feedback.pushInfo('Start generate KDV raster layer')
     start = time.time()
-    kdv_data.result.rename(columns={"lon": "x", "lat": "y", "val": "value"}, inplace=True)
-    # Sorted according to first y minus then x increasing (from top left corner, top to bottom left to right)
-    result = kdv_data.result.sort_values(by=["y", "x"], ascending=[False, True])
-    path = savePath + "/Heatmap"
-    result.to_csv(path + ".xyz", index=False, header=False, sep=" ")
-    opts = gdal.TranslateOptions(
-            outputSRS="EPSG:4326"
-        )
-    temp = gdal.Translate(path + ".tif", path + ".xyz", options=opts)
-    temp = None
-    os.remove(path + '.xyz')
-    fn = path + '.tif'
+    fn = writeRaster(kdv_result, savePath + "/Heatmap.tif")
     rlayer = QgsRasterLayer(fn, 'Heatmap')
     end = time.time()
     duration = end - start
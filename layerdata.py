@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Helpers to read only the features and attributes an algorithm needs from a
+ vector layer, letting the data provider do the filtering.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import pandas as pd
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsExpression,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsProject,
+    QgsRectangle,
+    QgsUnitTypes
+)
+from .bounds import expandBound
+
+
+def rangeExpression(field, lower=None, upper=None):
+    """
+    Filter expression selecting features whose field lies in [lower, upper].
+    Either bound may be None. Returns None when there is nothing to filter.
+    """
+    ref = QgsExpression.quotedColumnRef(field)
+    clauses = []
+    if lower is not None:
+        clauses.append('{} >= {}'.format(ref, repr(lower)))
+    if upper is not None:
+        clauses.append('{} <= {}'.format(ref, repr(upper)))
+    return ' AND '.join(clauses) if clauses else None
+
+
+def expandExtent(extent, crs, meters):
+    """
+    Grow extent, given in crs, by meters on every side. Geographic CRSs are
+    expanded by the number of degrees the distance spans at the extent's
+    latitude furthest from the equator.
+    """
+    if crs.isGeographic():
+        return QgsRectangle(*expandBound((extent.xMinimum(), extent.yMinimum(),
+                                          extent.xMaximum(), extent.yMaximum()), meters))
+    d = meters * QgsUnitTypes.fromUnitToUnitFactor(QgsUnitTypes.DistanceMeters, crs.mapUnits())
+    return QgsRectangle(extent.xMinimum() - d, extent.yMinimum() - d,
+                        extent.xMaximum() + d, extent.yMaximum() + d)
+
+
+def featureRequest(lyr, fields, expression=None, extent=None):
+    """
+    Request fetching only the given attribute fields of the features that
+    match expression and fall inside extent (in the layer CRS). Geometry is
+    only fetched when an extent must be tested against it.
+    """
+    request = QgsFeatureRequest()
+    request.setSubsetOfAttributes(fields, lyr.fields())
+    if expression:
+        request.setFilterExpression(expression)
+    if extent is not None and not extent.isNull() and not extent.isEmpty():
+        request.setFilterRect(extent)
+    else:
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+    return request
+
+
+def layerToDataFrame(lyr, fields, names, request=None):
+    """
+    DataFrame of the given fields, renamed to names, of the features matched
+    by request (all features when None).
+    """
+    if request is None:
+        request = featureRequest(lyr, fields)
+    indexes = [lyr.fields().indexOf(field) for field in fields]
+    rows = []
+    for feat in lyr.getFeatures(request):
+        attributes = feat.attributes()
+        rows.append([attributes[i] for i in indexes])
+    return pd.DataFrame(rows, columns=names)
+
+
+def sourceGeometry(source, crs):
+    """
+    Union of the geometries of a feature source, transformed to crs, as a
+    shapely geometry (None when the source has no geometry).
+    """
+    import shapely
+
+    transform = QgsCoordinateTransform(source.sourceCrs(), crs, QgsProject.instance())
+    request = QgsFeatureRequest().setNoAttributes()
+    geometries = []
+    for feat in source.getFeatures(request):
+        geometry = QgsGeometry(feat.geometry())
+        if geometry.isEmpty():
+            continue
+        geometry.transform(transform)
+        geometries.append(geometry)
+    if not geometries:
+        return None
+    return shapely.from_wkb(bytes(QgsGeometry.unaryUnion(geometries).asWkb()))
+
+
+def sourceGeometries(source, extent=None):
+    """
+    Array of the shapely geometries of a feature source, in the source CRS.
+    Only features whose bounding box meets extent are read when it is given.
+    """
+    import shapely
+
+    request = QgsFeatureRequest().setNoAttributes()
+    if extent is not None:
+        request.setFilterRect(extent)
+    wkb = []
+    for feat in source.getFeatures(request):
+        geometry = feat.geometry()
+        if not geometry.isEmpty():
+            wkb.append(bytes(geometry.asWkb()))
+    return shapely.from_wkb(wkb)
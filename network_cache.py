@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Persistent store of prepared (consolidated, projected) road networks, so
+ NKDV runs over an area fetched before need no Overpass request. Nothing in
+ here imports QGIS.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from math import floor
+from .road_graph import RoadGraph
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    import msvcrt
+
+    fcntl = None
+
+# Fetched bounding boxes are grown to a grid of tiles of this size (degrees),
+# so neighbouring requests share cached networks
+TILE_DEGREES = 0.05
+# Default size limit of a store
+MAX_BYTES = 1024 ** 3
+
+
+def tile_range(lat_min, lon_min, lat_max, lon_max, tile=TILE_DEGREES):
+    """Inclusive (col_min, row_min, col_max, row_max) range of the tiles covering a bounding box."""
+    return (floor(lon_min / tile), floor(lat_min / tile), floor(lon_max / tile), floor(lat_max / tile))
+
+
+def tile_bbox(tiles, tile=TILE_DEGREES):
+    """(lat_min, lon_min, lat_max, lon_max) of a tile range."""
+    col_min, row_min, col_max, row_max = tiles
+    return tuple(round(x * tile, 9) for x in (row_min, col_min, row_max + 1, col_max + 1))
+
+
+def crop_graph(road, lat_min, lon_min, lat_max, lon_max):
+    """
+    Sub-network of a RoadGraph with the edges touching a bounding box, as an
+    Overpass bounding box query keeps whole the ways touching it.
+    """
+    inside = road.nodes_inside(lon_min, lat_min, lon_max, lat_max)
+    return road.subgraph(inside, inside[road.u] | inside[road.v])
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    Hold an exclusive lock on a lock file, across the threads and processes
+    sharing it. The system drops the lock if its holder dies.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            # Lock the first byte; LK_LOCK gives up after 10 seconds, so keep waiting
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _temp_path(path):
+    """Temporary file to write path through, unique to the process and thread."""
+    return '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+class NetworkCache:
+    """
+    Size-bounded store of prepared road networks in a folder, keyed by the
+    tile range they were fetched for and a profile naming how they were
+    prepared. A request is answered from any stored network whose tiles
+    cover it, cropped to the request; otherwise the network of the request's
+    tiles is fetched and stored. The least recently used networks are
+    evicted once the store grows past max_bytes. Several processes may
+    share a store: its index is updated under a lock file.
+    """
+
+    def __init__(self, folder, max_bytes=MAX_BYTES, tile=TILE_DEGREES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.tile = tile
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, 'index.json')
+        self.lock_path = os.path.join(folder, 'index.lock')
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        # Write then rename, so concurrent readers never see a partial index
+        temp_path = _temp_path(self.index_path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+
+    def find(self, tiles, profile):
+        """Name of the smallest stored network of the profile covering the tile range, or None."""
+        best = None
+        for name, entry in self._read_index().items():
+            col_min, row_min, col_max, row_max = entry['tiles']
+            if entry['profile'] != profile or not os.path.exists(os.path.join(self.folder, name)):
+                continue
+            if col_min <= tiles[0] and row_min <= tiles[1] and col_max >= tiles[2] and row_max >= tiles[3]:
+                area = (col_max - col_min + 1) * (row_max - row_min + 1)
+                if best is None or area < best[0]:
+                    best = (area, name)
+        return best and best[1]
+
+    def get(self, lat_min, lon_min, lat_max, lon_max, fetch, profile='highway'):
+        """
+        RoadGraph covering a bounding box. fetch(lat_min, lon_min, lat_max,
+        lon_max) prepares the network of a bounding box on a cache miss.
+        """
+        tiles = tile_range(lat_min, lon_min, lat_max, lon_max, self.tile)
+        name = self.find(tiles, profile)
+        road = None
+        if name is not None:
+            try:
+                road = RoadGraph.load(os.path.join(self.folder, name))
+                self._touch(name)
+            except (OSError, KeyError, ValueError):
+                # Unreadable or written in an older format: fetch it again
+                pass
+        if road is None:
+            road = fetch(*tile_bbox(tiles, self.tile))
+            self.put(tiles, profile, road)
+        return crop_graph(road, lat_min, lon_min, lat_max, lon_max)
+
+    def put(self, tiles, profile, road):
+        """Store the RoadGraph fetched for a tile range and evict down to max_bytes."""
+        name = '{}_{}_{}_{}_{}.npz'.format(profile, *tiles)
+        path = os.path.join(self.folder, name)
+        # Threads and processes fetching the same tiles each write their own file first
+        temp_path = _temp_path(path)
+        with open(temp_path, 'wb') as f:
+            road.save(f)
+        with _file_lock(self.lock_path):
+            # Renamed under the lock, so no other eviction removes it before it is indexed
+            os.replace(temp_path, path)
+            # Read under the lock, so entries other processes stored are kept and counted
+            index = self._read_index()
+            index[name] = {'profile': profile, 'tiles': list(tiles), 'bytes': os.path.getsize(path),
+                           'used': time.time()}
+            self._evict(index, keep=name)
+            self._write_index(index)
+
+    def _touch(self, name):
+        with _file_lock(self.lock_path):
+            index = self._read_index()
+            if name in index:
+                index[name]['used'] = time.time()
+                self._write_index(index)
+
+    def _evict(self, index, keep=None):
+        total = sum(entry['bytes'] for entry in index.values())
+        for name in sorted(index, key=lambda n: index[n]['used']):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= index.pop(name)['bytes']
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
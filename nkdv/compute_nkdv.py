@@ -1,6 +1,7 @@
 import ctypes
 import os
 import platform
+import threading
 
 
 def load_library(libname, loader_path):
@@ -46,21 +47,37 @@ def load_library(libname, loader_path):
 
 dll_names = ['nkdv.dll', 'nkdv_mac.so', 'nkdv_mac_M1.so']
 
-for dll_name in dll_names:
-    try:
-        library_path = os.path.abspath(os.path.join(os.path.dirname(__file__), dll_name))
-        nkdv_C_library = load_library(dll_name, library_path)
-        break
-    except:
-        pass
-nkdv = nkdv_C_library.nkdv
-nkdv.argtypes = (ctypes.c_int,ctypes.POINTER(ctypes.c_char_p))
-nkdv.restype = ctypes.c_char_p
+nkdv_C_library = None
+# NKDV_ENGINE=python forces the Python engine, e.g. to compare it with the native one. Both return
+# the unnormalized kernel sum of every lixel, with the native kernel types 1 (triangular), 2
+# (Epanechnikov) and 3 (quartic); the native type 0, an unbounded Gaussian, has no Python
+# counterpart (see tests/test_sparse_nkdv.py)
+if os.environ.get('NKDV_ENGINE', '').lower() != 'python':
+    for dll_name in dll_names:
+        try:
+            library_path = os.path.abspath(os.path.join(os.path.dirname(__file__), dll_name))
+            nkdv_C_library = load_library(dll_name, library_path)
+            break
+        except:
+            pass
 
-def compute_nkdv(args):
-    args = (ctypes.c_char_p * len(args))(*args)    
-    result = nkdv(len(args),args).decode('utf-8')
-    return result
+if nkdv_C_library is not None:
+    nkdv = nkdv_C_library.nkdv
+    nkdv.argtypes = (ctypes.c_int,ctypes.POINTER(ctypes.c_char_p))
+    nkdv.restype = ctypes.c_char_p
+
+    # The library is not known to be thread-safe, so threads (e.g. the clusters
+    # of run_nkdv) call it one at a time
+    nkdv_lock = threading.Lock()
+
+    def compute_nkdv(args):
+        args = (ctypes.c_char_p * len(args))(*args)    
+        with nkdv_lock:
+            result = nkdv(len(args),args).decode('utf-8')
+        return result
+else:
+    # No native library for this platform (e.g. Linux)
+    from .sparse_nkdv import compute_nkdv
 
 
 
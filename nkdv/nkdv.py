@@ -1,7 +1,37 @@
-from .compute_nkdv import compute_nkdv
+import os
+import tempfile
+from io import StringIO
+import numpy as np
+import pandas as pd
+from .compute_nkdv import compute_nkdv, nkdv_C_library
+
+
+def write_network(path, indptr, indices, lengths, point_ptr, points):
+    """
+    Write CSR network arrays in the text format the native engine reads:
+    'n m', then 'u v length k d1 .. dk' per edge, building the whole text
+    before one write.
+    """
+    indptr = np.asarray(indptr)
+    point_ptr = np.asarray(point_ptr)
+    num_nodes = len(indptr) - 1
+    counts = np.diff(point_ptr)
+    u = np.repeat(np.arange(num_nodes), np.diff(indptr))
+    heads = map('{} {} {!r} {}'.format, u.tolist(), np.asarray(indices).tolist(),
+                np.asarray(lengths, dtype=float).tolist(), counts.tolist())
+    values = list(map(repr, np.asarray(points, dtype=float).tolist()))
+    ends = (point_ptr - point_ptr[0]).tolist()
+    lines = [head + ' ' + ' '.join(values[ends[i]:ends[i + 1]]) if ends[i + 1] > ends[i] else head
+             for i, head in enumerate(heads)]
+    lines.append('')
+    with open(path, 'w') as fp:
+        fp.write('%d %d\n' % (num_nodes, len(indices)))
+        fp.write('\n'.join(lines))
+
 
 class NKDV:
-    def __init__(self, data_name=None,out_name =None,method=3,lixel_reg_length=1,kernel_type=2,bandwidth=1):
+    def __init__(self, data_name=None,out_name =None,method=3,lixel_reg_length=1,kernel_type=2,bandwidth=1,
+                 num_threads=None):
         self.data_name = data_name
         if out_name is None:
             self.out_name = 'results/%s_M%d_K%d'%(data_name, method, kernel_type)
@@ -11,6 +41,8 @@ class NKDV:
         self.lixel_reg_length = lixel_reg_length
         self.kernel_type = kernel_type
         self.bandwidth = bandwidth
+        # Threads of the Python engine, all cores by default
+        self.num_threads = num_threads
             
     def set_data(self,data_name):
         self.data_name=data_name
@@ -18,7 +50,7 @@ class NKDV:
         #     self.data = f.readlines()
         pass
         
-    def set_args(self):
+    def set_args(self, bandwidth=None):
         self.args =[
             0,
             self.data_name,
@@ -26,18 +58,53 @@ class NKDV:
             self.method,
             self.lixel_reg_length,
             self.kernel_type,
-            self.bandwidth
+            self.bandwidth if bandwidth is None else bandwidth
         ]
         
         self.args = [str(x).encode('ascii') for x in self.args]
     
         
-    def compute(self):
+    def compute(self, bandwidth=None):
         if self.data_name==None:
             print('Please set data file with set_data')
             return ''
-        self.set_args()
+        self.set_args(bandwidth)
         self.result = compute_nkdv(self.args)
         return self.result
 
+    def compute_csr(self, indptr, indices, lengths, point_ptr, points, data_name=None):
+        '''
+        Compute from in-memory arrays instead of a network file:
+        indptr, indices, lengths = CSR graph, the edges of node u being
+            indices[indptr[u]:indptr[u+1]] with their lengths
+        point_ptr, points = sorted point offsets from u along every edge,
+            edge i holding points[point_ptr[i]:point_ptr[i+1]]
+        Returns the lixel densities as a float array, lixels ordered by edge
+        and then from u. When bandwidth is a sequence, returns a (lixels,
+        bandwidths) array: the Python engine computes every bandwidth in one
+        traversal, the native engine runs once per bandwidth on the same file.
+        The native engine still reads a network file, which is written to
+        data_name (a temporary file by default).
+        '''
+        if nkdv_C_library is None:
+            from .sparse_nkdv import Network, compute_density
+            net = Network.fromCSR(indptr, indices, lengths, point_ptr, points, self.lixel_reg_length)
+            self.result = compute_density(net, self.kernel_type, self.bandwidth, self.num_threads)
+            return self.result
+        temporary = data_name is None
+        if temporary:
+            fd, data_name = tempfile.mkstemp(prefix='nkdv_', suffix='.txt')
+            os.close(fd)
+        try:
+            write_network(data_name, indptr, indices, lengths, point_ptr, points)
+            self.set_data(data_name)
+            results = [self.compute(float(bandwidth)) for bandwidth in np.atleast_1d(self.bandwidth)]
+        finally:
+            if temporary:
+                os.remove(data_name)
+        results = [pd.read_csv(StringIO(result), sep=' ', skiprows=1, header=None).iloc[:, 3].to_numpy(float)
+                   for result in results]
+        self.result = np.column_stack(results) if np.ndim(self.bandwidth) else results[0]
+        return self.result
+
 
@@ -0,0 +1,105 @@
+"""
+Partitioned NKDV: the edges of a network are split into regions of about
+equal weight by recursive coordinate bisection, and every region is
+computed in its own process on a subnetwork holding its edges and a halo.
+
+The halo is every edge incident to a node within one bandwidth of network
+distance of the region, found with one bounded multi-source Dijkstra. Any
+path shorter than the bandwidth from a lixel of the region to a data
+point then lies in the subnetwork, so the region's lixel densities equal
+those over the whole network; the densities of halo lixels are dropped.
+Halos never cross connected components, so separate components cost
+nothing extra.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from .nkdv import NKDV
+from .sparse_nkdv import _ranges, _symmetric_min
+
+
+def bisect_edges(x, y, weight, parts):
+    """
+    Split edges with positions x, y into parts groups of about equal total
+    weight, by recursively halving along the wider axis.
+    """
+    groups = [(np.arange(len(x)), parts)]
+    regions = []
+    while groups:
+        ids, parts = groups.pop()
+        if parts == 1 or len(ids) < 2:
+            regions.append(ids)
+            continue
+        axis = x if np.ptp(x[ids]) >= np.ptp(y[ids]) else y
+        ids = ids[np.argsort(axis[ids], kind='stable')]
+        total = np.cumsum(weight[ids])
+        left = parts // 2
+        split = min(max(np.searchsorted(total, total[-1] * left / parts), 1), len(ids) - 1)
+        groups.append((ids[split:], parts - left))
+        groups.append((ids[:split], left))
+    return regions
+
+
+def _compute_region(indptr, indices, lengths, point_ptr, points, bandwidth, lixel_length, kernel_type):
+    nkdv = NKDV(bandwidth=bandwidth, lixel_reg_length=lixel_length, method=3, kernel_type=kernel_type,
+                num_threads=1)
+    return nkdv.compute_csr(indptr, indices, lengths, point_ptr, points)
+
+
+def compute_partitioned(indptr, indices, lengths, point_ptr, points, x, y, bandwidth, lixel_length,
+                        kernel_type=2, processes=2):
+    """
+    Lixel densities of a CSR network (see NKDV.compute_csr) with node
+    coordinates x, y, computed as processes regions in as many worker
+    processes. Returns the same array as NKDV.compute_csr.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=float)
+    point_ptr = np.asarray(point_ptr, dtype=np.int64)
+    points = np.asarray(points, dtype=float)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n = len(indptr) - 1
+    u = np.repeat(np.arange(n), np.diff(indptr))
+
+    counts = np.where(lengths > 0, np.ceil(lengths / lixel_length), 0).astype(np.int64)
+    lixel_start = np.concatenate(([0], np.cumsum(counts)))
+    shape = (lixel_start[-1],) + np.shape(bandwidth)
+    density = np.zeros(shape)
+
+    on_edge = np.diff(point_ptr)
+    keep = u != indices
+    adjacency = _symmetric_min(u[keep], indices[keep], lengths[keep], n)
+    limit = float(np.max(bandwidth))
+    regions = bisect_edges((x[u] + x[indices]) / 2, (y[u] + y[indices]) / 2, on_edge + 1, processes)
+
+    jobs = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for core in regions:
+            # Nodes within one bandwidth of the region, and every edge touching them
+            sources = np.unique(np.concatenate((u[core], indices[core])))
+            if not len(sources):
+                continue
+            reached = np.isfinite(dijkstra(adjacency, directed=False, indices=sources, limit=limit, min_only=True))
+            edges = np.flatnonzero(reached[u] | reached[indices])
+            if not on_edge[edges].any():
+                # No data point within reach: the region's densities stay 0
+                continue
+            nodes = np.zeros(n, dtype=bool)
+            nodes[u[edges]] = True
+            nodes[indices[edges]] = True
+            ids = np.cumsum(nodes) - 1
+            sub_indptr = np.searchsorted(ids[u[edges]], np.arange(nodes.sum() + 1))
+            sub_point_ptr = np.concatenate(([0], np.cumsum(on_edge[edges])))
+            sub_points = points[_ranges(point_ptr[edges], point_ptr[edges + 1])]
+            future = executor.submit(_compute_region, sub_indptr, ids[indices[edges]], lengths[edges],
+                                     sub_point_ptr, sub_points, bandwidth, lixel_length, kernel_type)
+            jobs.append((np.sort(core), edges, future))
+
+        for core, edges, future in jobs:
+            # Lixels of the region's own edges, in the subnetwork's and in the whole network's order
+            sub_start = np.concatenate(([0], np.cumsum(counts[edges])))
+            position = np.searchsorted(edges, core)
+            density[_ranges(lixel_start[core], lixel_start[core + 1])] = \
+                future.result()[_ranges(sub_start[position], sub_start[position + 1])]
+    return density
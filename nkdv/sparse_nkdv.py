@@ -0,0 +1,216 @@
+"""
+Pure Python network KDV engine, used where no native NKDV library is
+available (Linux). It reads the same network file and returns the same
+result text as the native engine, so it can stand in for compute_nkdv.
+
+Density is exact: every lixel gets the sum of the kernel over the data
+points within the bandwidth along the network. Rather than searching from
+every lixel, one bounded Dijkstra (scipy.sparse.csgraph) is run from both
+end nodes of every edge that carries data points, and the network distance
+from each point to each lixel centre is then assembled with numpy. Edges
+are processed in chunks on a thread pool, each returning the density of
+the lixels it reaches only. Several bandwidths share one traversal,
+bounded by the largest of them.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Sources per bounded Dijkstra call; bounds the (sources x nodes) distance matrix
+CHUNK_SIZE = 64
+# Largest (sources x nodes) distance matrix of one Dijkstra call
+MAX_DISTANCES = 1 << 22
+
+
+def kernel(kernel_type, d, bandwidth):
+    """
+    Kernel weight of network distances d < bandwidth, unnormalized and
+    numbered as by the native kernel_value.
+    """
+    u = d / bandwidth
+    if kernel_type == 1:  # triangular
+        return 1 - u
+    if kernel_type == 2:  # Epanechnikov
+        return 1 - u * u
+    if kernel_type == 3:  # quartic
+        return (1 - u * u) ** 2
+    raise ValueError('Unknown kernel type {}'.format(kernel_type))
+
+
+class Network:
+    """
+    Edge arrays of a network, the sorted point offsets along every edge
+    (edge i holds points[point_ptr[i]:point_ptr[i + 1]]) and the lixels
+    along every edge.
+    """
+
+    def __init__(self, num_nodes, u, v, length, point_ptr, points, lixel_length):
+        n, m = num_nodes, len(u)
+        self.num_nodes = n
+        self.u = u = np.asarray(u, dtype=np.int64)
+        self.v = v = np.asarray(v, dtype=np.int64)
+        self.length = length = np.asarray(length, dtype=float)
+        self.point_ptr = np.asarray(point_ptr, dtype=np.int64)
+        self.points = np.asarray(points, dtype=float)
+
+        # Lixels of lixel_length along every edge, the last one shorter
+        counts = np.ceil(length / lixel_length).astype(np.int64)
+        counts[length <= 0] = 0
+        self.lixel_start = np.concatenate(([0], np.cumsum(counts)))
+        self.lixel_edge = np.repeat(np.arange(m), counts)
+        offset = np.arange(self.lixel_start[-1]) - self.lixel_start[self.lixel_edge]
+        lixel_end = np.minimum((offset + 1) * lixel_length, length[self.lixel_edge])
+        self.lixel_pos = (offset * lixel_length + lixel_end) / 2
+
+        # Node adjacency (shortest parallel edge) and node -> incident edges
+        keep = u != v
+        self.adjacency = _symmetric_min(u[keep], v[keep], length[keep], n)
+        ends = np.concatenate((u, v))
+        order = np.argsort(ends, kind='stable')
+        self.incident = np.concatenate((np.arange(m), np.arange(m)))[order]
+        self.incident_ptr = np.searchsorted(ends[order], np.arange(n + 1))
+
+    @classmethod
+    def fromFile(cls, path, lixel_length):
+        """Network of a text network file ('n m' header, then 'u v length k d1 .. dk' per edge)."""
+        with open(path) as f:
+            n, m = (int(x) for x in f.readline().split())
+            u = np.empty(m, dtype=np.int64)
+            v = np.empty(m, dtype=np.int64)
+            length = np.empty(m)
+            counts = np.zeros(m, dtype=np.int64)
+            points = []
+            for i, line in enumerate(f):
+                if i >= m:
+                    break
+                fields = line.split()
+                u[i], v[i], length[i], counts[i] = int(fields[0]), int(fields[1]), float(fields[2]), int(fields[3])
+                points.extend(fields[4:])
+        point_ptr = np.concatenate(([0], np.cumsum(counts)))
+        return cls(n, u, v, length, point_ptr, np.array(points, dtype=float), lixel_length)
+
+    @classmethod
+    def fromCSR(cls, indptr, indices, lengths, point_ptr, points, lixel_length):
+        """Network of CSR arrays: the edges of node u are indices[indptr[u]:indptr[u + 1]]."""
+        indptr = np.asarray(indptr, dtype=np.int64)
+        u = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return cls(len(indptr) - 1, u, indices, lengths, point_ptr, points, lixel_length)
+
+
+def _symmetric_min(u, v, length, n):
+    """Undirected adjacency keeping the shortest of parallel edges."""
+    rows = np.concatenate((u, v))
+    cols = np.concatenate((v, u))
+    weights = np.concatenate((length, length))
+    order = np.lexsort((weights, cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    # csgraph treats explicit zeros as missing edges
+    weights = np.maximum(weights[first], 1e-9)
+    return csr_matrix((weights, (rows[first], cols[first])), shape=(n, n))
+
+
+def _ranges(starts, ends):
+    """Concatenation of range(start, end) for every start, end pair."""
+    counts = ends - starts
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def _reachable_lixels(net, distances):
+    """Lixels on the edges incident to the nodes reached in any row of distances."""
+    nodes = np.flatnonzero(np.isfinite(distances).any(axis=0))
+    edges = np.unique(net.incident[_ranges(net.incident_ptr[nodes], net.incident_ptr[nodes + 1])])
+    return _ranges(net.lixel_start[edges], net.lixel_start[edges + 1])
+
+
+def _density_chunk(net, edges, kernel_type, bandwidths):
+    """
+    Density the points on edges add to the lixels they reach, as the sorted
+    lixel indices and a (lixels, bandwidths) array of their densities.
+    """
+    sources = np.concatenate((net.u[edges], net.v[edges]))
+    distances = dijkstra(net.adjacency, directed=False, indices=sources, limit=bandwidths.max())
+    k = len(edges)
+    parts, values = [], []
+    for j, e in enumerate(edges):
+        s = net.points[net.point_ptr[e]:net.point_ptr[e + 1]]
+        da, db = distances[j], distances[k + j]
+        lixels = _reachable_lixels(net, distances[[j, k + j]])
+        if not len(lixels):
+            continue
+        le = net.lixel_edge[lixels]
+        t = net.lixel_pos[lixels]
+        length = net.length[le]
+        lu, lv = net.u[le], net.v[le]
+        # Distance from each end node of edge e to each lixel centre
+        to_a = np.minimum(da[lu] + t, da[lv] + length - t)
+        to_b = np.minimum(db[lu] + t, db[lv] + length - t)
+        d = np.minimum(s[:, None] + to_a, (net.length[e] - s)[:, None] + to_b)
+        same = le == e
+        if same.any():
+            d[:, same] = np.minimum(d[:, same], np.abs(s[:, None] - t[same]))
+        # Keep the distances within each bandwidth, from the largest down
+        column = np.broadcast_to(np.arange(len(lixels)), d.shape)
+        value = np.zeros((len(lixels), len(bandwidths)))
+        for i in np.argsort(bandwidths)[::-1]:
+            near = d < bandwidths[i]
+            d, column = d[near], column[near]
+            value[:, i] = np.bincount(column, kernel(kernel_type, d, bandwidths[i]), len(lixels))
+        parts.append(lixels)
+        values.append(value)
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(bandwidths)))
+    # Sum the densities of lixels reached from several edges
+    lixels, inverse = np.unique(np.concatenate(parts), return_inverse=True)
+    values = np.concatenate(values)
+    density = np.column_stack([np.bincount(inverse, values[:, i], len(lixels)) for i in range(len(bandwidths))])
+    return lixels, density
+
+
+def compute_density(net, kernel_type=2, bandwidth=1000, num_threads=None):
+    """
+    Density of every lixel of a Network, in edge order. With a sequence of
+    bandwidths, a (lixels, bandwidths) array of the density for each.
+    """
+    bandwidths = np.atleast_1d(np.asarray(bandwidth, dtype=float))
+    edges = np.flatnonzero(np.diff(net.point_ptr))
+    # Fewer sources per Dijkstra call on large networks, bounding its distance matrix
+    chunk_size = int(np.clip(MAX_DISTANCES // (2 * max(net.num_nodes, 1)), 1, CHUNK_SIZE))
+    chunks = (edges[i:i + chunk_size] for i in range(0, len(edges), chunk_size))
+    density = np.zeros((len(net.lixel_edge), len(bandwidths)))
+    workers = num_threads or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Keep a few chunks per worker in flight, so finished parts are summed
+        # as they arrive rather than all held at once
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(_density_chunk, net, chunk, kernel_type, bandwidths))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lixels, part = future.result()
+                    density[lixels] += part
+        for future in pending:
+            lixels, part = future.result()
+            density[lixels] += part
+    return density if np.ndim(bandwidth) else density[:, 0]
+
+
+def format_result(net, density):
+    """Result text in the native engine's layout: a count line, then 'u v position value' per lixel."""
+    le = net.lixel_edge
+    lines = ['{} {} {!r} {!r}'.format(u, v, p, d)
+             for u, v, p, d in zip(net.u[le].tolist(), net.v[le].tolist(), net.lixel_pos.tolist(),
+                                   density.tolist())]
+    return '{}\n'.format(len(lines)) + '\n'.join(lines) + '\n'
+
+
+def compute_nkdv(args):
+    """Drop-in for the native compute_nkdv, taking the same encoded argument list."""
+    args = [a.decode('ascii') for a in args]
+    data_name, lixel_length, kernel_type, bandwidth = args[1], float(args[4]), int(args[5]), float(args[6])
+    net = Network.fromFile(data_name, lixel_length)
+    return format_result(net, compute_density(net, kernel_type, bandwidth))
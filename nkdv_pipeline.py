@@ -0,0 +1,704 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Road network preparation and NKDV stages shared by the processing algorithm
+ and the headless batch runner. Nothing in here imports QGIS.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import bz2
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+from shapely.strtree import STRtree
+from .bounds import METERS_PER_DEGREE, expandBound
+from .network_cache import NetworkCache
+from .road_graph import RoadGraph, line_arrays, lines_from_arrays, select_points
+from .stage_cache import StageCache, stage_key
+from .utils.overpass import API
+from .utils import osmnx as ox
+from .utils.osmnx.downloader import _get_osm_filter
+
+# Points snapped per chunk, bounding the memory of each nearest-edge query
+SNAP_CHUNK_SIZE = 500000
+# Overpass filter of every highway, and the osmnx network type presets
+HIGHWAY_FILTER = '["highway"]'
+NETWORK_TYPES = ('drive', 'drive_service', 'walk', 'bike', 'all', 'all_private')
+
+
+def add_kd_value(gdf, value_se):
+    columns_list = gdf.columns.tolist()
+    columns_list.append('value')
+    gdf = gdf.reindex(columns=columns_list)
+    gdf['value'] = value_se
+    return gdf
+
+
+def value_column(bandwidth):
+    """Name of the density column of one of several bandwidths, e.g. value_500."""
+    bandwidth = float(bandwidth)
+    return 'value_{}'.format(int(bandwidth) if bandwidth.is_integer() else str(bandwidth).replace('.', '_'))
+
+
+def add_kd_values(gdf, values, bandwidth):
+    """
+    Add the densities computed for a bandwidth as the 'value' column, or
+    those of a sequence of bandwidths as one value_<bandwidth> column each.
+    """
+    if np.ndim(bandwidth) == 0:
+        return add_kd_value(gdf, values)
+    return gdf.assign(**{value_column(b): values[:, i] for i, b in enumerate(bandwidth)})
+
+
+def merge(edges_df, dis_df, nodes_num, folder_path):
+    # df1 is edge dataframe and df2 is distance dataframe
+    from .nkdv.nkdv import write_network
+
+    indptr, indices, lengths, point_ptr, points, order = network_csr(edges_df, dis_df, nodes_num)
+    write_network(folder_path + '/graph_output', indptr, indices, lengths, point_ptr, points)
+
+
+def network_csr(edges_df, dis_df, nodes_num):
+    """
+    Arrays for NKDV.compute_csr from the edge and point distance frames,
+    with the edges sorted by (u_id, v_id) as in graph_output: indptr,
+    indices, lengths, point_ptr and points, plus order, the edges_df row
+    of every sorted edge.
+    """
+    u = edges_df['u_id'].to_numpy(np.int64)
+    v = edges_df['v_id'].to_numpy(np.int64)
+    order = np.lexsort((v, u))
+    u, v = u[order], v[order]
+    lengths = edges_df['length'].to_numpy(float)[order]
+    indptr = np.searchsorted(u, np.arange(nodes_num + 1))
+
+    # Edge of every point, by looking its (u_id, v_id) up in the sorted edges
+    keys = u * nodes_num + v
+    point_keys = dis_df['u_id'].to_numpy(np.int64) * nodes_num + dis_df['v_id'].to_numpy(np.int64)
+    edge = np.minimum(np.searchsorted(keys, point_keys), len(keys) - 1)
+    found = keys[edge] == point_keys
+    edge = edge[found]
+    distance = dis_df['distance'].to_numpy(float)[found]
+    point_order = np.lexsort((distance, edge))
+    point_ptr = np.searchsorted(edge[point_order], np.arange(len(keys) + 1))
+    return indptr, v, lengths, point_ptr, distance[point_order], order
+
+
+def _snap(tree, geometries, xs, ys):
+    points = shapely.points(xs, ys)
+    edge = tree.query_nearest(points, all_matches=False)[1]
+    return edge, shapely.line_locate_point(geometries[edge], points)
+
+
+def _init_snap_worker(wkb):
+    global _worker_geometries, _worker_tree
+    _worker_geometries = shapely.from_wkb(wkb)
+    _worker_tree = STRtree(_worker_geometries)
+
+
+def _snap_worker(chunk):
+    return _snap(_worker_tree, _worker_geometries, *chunk)
+
+
+def snap_points(geometries, xs, ys, processes=1, chunk_size=SNAP_CHUNK_SIZE, tree=None):
+    """
+    Index of the nearest of the line geometries to every (xs, ys) point, in
+    the same CRS, and the distance along that line to the point's
+    projection onto it. Points are snapped in chunks, spread over worker
+    processes when processes > 1. An STRtree already built over the
+    geometries is reused in-process.
+    """
+    chunks = [(xs[i:i + chunk_size], ys[i:i + chunk_size]) for i in range(0, len(xs), chunk_size)]
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_snap_worker,
+                                 initargs=(shapely.to_wkb(geometries),)) as executor:
+            results = list(executor.map(_snap_worker, chunks))
+    else:
+        if tree is None:
+            tree = STRtree(geometries)
+        results = [_snap(tree, geometries, *chunk) for chunk in chunks]
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def snap_to_network(road, coords, processes=1):
+    """
+    Snap (lon, lat) points onto the nearest edges of a RoadGraph. Returns
+    their edge and their distance from its u node along it.
+    """
+    transformer = Transformer.from_crs('epsg:4326', road.crs, always_xy=True)
+    xs, ys = transformer.transform(coords[:, 0], coords[:, 1])
+    # The road graph's STRtree is built once and reused by later runs on it
+    return snap_points(road.geometries, np.asarray(xs), np.asarray(ys), processes, tree=road.tree)
+
+
+def _tee(chunks, path):
+    """Pass chunks through, writing a bz2 compressed copy of them to path."""
+    with bz2.open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+
+def network_filter(network_type=None, custom_filter=None):
+    """
+    Overpass filter of the ways of a road network: custom_filter (such as
+    '["highway"~"primary|secondary|tertiary"]') when given, else the osmnx
+    preset of a network_type (see NETWORK_TYPES), else every highway.
+    """
+    if custom_filter:
+        return custom_filter
+    if network_type:
+        return _get_osm_filter(network_type)
+    return HIGHWAY_FILTER
+
+
+def download_network(lat_min, lon_min, lat_max, lon_max, folder_path, endpoint=None, save_xml=False,
+                     osm_filter=HIGHWAY_FILTER, simplify=False):
+    """
+    Download the ways matching osm_filter (see network_filter) that touch the
+    bounding box, with their nodes, from Overpass (the public server unless
+    endpoint names another interpreter URL) and return them as a projected,
+    consolidated RoadGraph, simplified first with simplify (see
+    prepare_network). The response is parsed as it arrives; with
+    save_xml a compressed copy is kept as network.osm.bz2 in folder_path,
+    readable by read_network.
+    """
+    # g1 = ox.graph_from_bbox(lat_max, lat_min, lon_max, lon_min, simplify=True, network_type='drive')
+    # Only the ways are selected; their nodes come with the recursion
+    query = """
+    (
+    way""" + osm_filter + "(" + str(lat_min) + ',' + str(lon_min) + ',' + str(lat_max) + ',' + str(lon_max) + """);
+    );
+    (._;>;);
+    out body;
+        """
+    api = API(endpoint=endpoint) if endpoint else API()
+    chunks = api.stream(query, verbosity='body')
+    if save_xml:
+        chunks = _tee(chunks, os.path.join(folder_path, 'network.osm.bz2'))
+    return prepare_network(ox.graph_from_xml_stream(chunks, simplify=False), simplify)
+
+
+def read_network(extract, lat_min, lon_min, lat_max, lon_max, simplify=False):
+    """
+    Highway network of the bounding box read from a local .osm, .osm.bz2 or
+    .osm.pbf extract (.pbf needs pyosmium), prepared as by download_network.
+    """
+    return prepare_network(ox.graph_from_extract(extract, lat_max, lat_min, lon_max, lon_min, simplify=False),
+                           simplify)
+
+
+def simplify_network(graph):
+    """
+    Unsimplified OSM graph with its chains of nodes between intersections
+    merged into single edges along the same coordinates (see osmnx
+    simplify_graph). The roads stay apart as the kernel needs them: a chain
+    that would become a self-loop keeps two of its nodes, and chains that
+    would join the same two nodes as another road keep one. Rings without
+    any intersection are kept as they are.
+    """
+    simple = ox.simplify_graph(graph, remove_rings=False, track_merged=True)
+
+    # The nodes passed by every road between two nodes, alike in both directions
+    roads = {}
+    for u, v, merged in simple.edges(data='merged_edges'):
+        interior = frozenset(b for a, b in merged[:-1]) if merged else frozenset()
+        roads.setdefault(frozenset((u, v)), set()).add(interior)
+    kept = set()
+    for ends, interiors in roads.items():
+        if len(ends) == 1 or len(interiors) > 1:
+            for interior in interiors:
+                if not interior:
+                    continue
+                nodes = sorted(interior)
+                if len(ends) == 1:
+                    kept.update((nodes[len(nodes) // 3], nodes[2 * len(nodes) // 3]))
+                else:
+                    kept.add(nodes[len(nodes) // 2])
+
+    # Split the edges of those chains at the kept nodes
+    split = []
+    for u, v, k, data in simple.edges(keys=True, data=True):
+        merged = data.pop('merged_edges', None)
+        if merged and kept.intersection(b for a, b in merged[:-1]):
+            split.append((u, v, k, data, merged))
+    simple.add_nodes_from((n, graph.nodes[n]) for n in kept)
+    for u, v, k, data, merged in split:
+        simple.remove_edge(u, v, k)
+        path = [u] + [b for a, b in merged]
+        cuts = [0] + [i for i in range(1, len(path) - 1) if path[i] in kept] + [len(path) - 1]
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            nodes = path[start:end + 1]
+            part = dict(data, length=sum(next(iter(graph[a][b].values()))['length']
+                                         for a, b in zip(nodes[:-1], nodes[1:])))
+            part['geometry'] = shapely.linestrings([(graph.nodes[n]['x'], graph.nodes[n]['y']) for n in nodes])
+            simple.add_edge(nodes[0], nodes[-1], **part)
+    return simple
+
+
+def prepare_network(graph, simplify=False):
+    """
+    Projected, consolidated RoadGraph of an unsimplified OSM graph, first
+    simplified by simplify_network with simplify.
+    """
+    if simplify:
+        graph = simplify_network(graph)
+    return RoadGraph.from_osmnx(ox.consolidate_intersections(ox.project_graph(graph), tolerance=0.5,
+                                                             rebuild_graph=True))
+
+
+def network_from_lines(lines, tolerance=0.5):
+    """
+    RoadGraph of road centrelines (a GeoSeries in any CRS), projected to UTM
+    like an OSM network. Lines are noded where their endpoints fall in the
+    same tolerance-sized grid cell, and their ends are snapped onto the
+    shared node. Of parallel lines between two nodes the shortest is kept.
+    """
+    lines = ox.project_gdf(gpd.GeoDataFrame(geometry=lines).to_crs('epsg:4326')).geometry
+    geometries = shapely.get_parts(lines.values)
+    geometries = geometries[~shapely.is_empty(geometries)]
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    counts = np.bincount(index, minlength=len(geometries))
+    last = np.cumsum(counts) - 1
+    ends = np.concatenate((last - counts + 1, last))
+
+    # Hash the endpoints to grid cells; every occupied cell is a node placed
+    # at the mean of its endpoints
+    cells = np.floor(coords[ends] / tolerance).astype(np.int64)
+    cells, node = np.unique(cells, axis=0, return_inverse=True)
+    node = node.reshape(-1)
+    n = len(cells)
+    weight = np.bincount(node, minlength=n)
+    x = np.bincount(node, coords[ends, 0], n) / weight
+    y = np.bincount(node, coords[ends, 1], n) / weight
+    coords[ends, 0], coords[ends, 1] = x[node], y[node]
+    geometries = shapely.linestrings(coords, indices=index)
+
+    m = len(geometries)
+    u, v = node[:m], node[m:]
+    length = shapely.length(geometries)
+    low, high = np.minimum(u, v), np.maximum(u, v)
+    order = np.lexsort((length, high, low))
+    first = np.ones(m, dtype=bool)
+    first[1:] = (low[order][1:] != low[order][:-1]) | (high[order][1:] != high[order][:-1])
+    keep = order[first & (length[order] > 0)]
+    return RoadGraph.from_edges(x, y, u[keep], v[keep], geometries[keep], lines.crs)
+
+
+def load_network(lat_min, lon_min, lat_max, lon_max, folder_path, network_cache=None, endpoint=None,
+                 extract=None, osm_filter=HIGHWAY_FILTER, simplify=False):
+    """
+    Network of the bounding box: read from the local OSM extract when one is
+    given (every highway, whatever osm_filter), otherwise as returned by
+    download_network, answered from the NetworkCache in the network_cache
+    folder when one is given.
+    """
+    if extract is not None:
+        return read_network(extract, lat_min, lon_min, lat_max, lon_max, simplify)
+    if network_cache is None:
+        return download_network(lat_min, lon_min, lat_max, lon_max, folder_path, endpoint, osm_filter=osm_filter,
+                                simplify=simplify)
+    cache = NetworkCache(network_cache)
+    # Networks of other filters, or simplified, are stored apart
+    profile = 'highway' if osm_filter == HIGHWAY_FILTER else 'filter-' + stage_key(osm_filter)
+    if simplify:
+        profile += '-simplified'
+    return cache.get(lat_min, lon_min, lat_max, lon_max,
+                     lambda *bbox: download_network(*bbox, folder_path, endpoint, osm_filter=osm_filter,
+                                                    simplify=simplify), profile)
+
+
+def split_lines(lines, lixel_length):
+    """
+    Split every line of an array into lixels of lixel_length, with a shorter
+    remainder at the end of each line, as consecutive substrings. Returns
+    the array of lixels, line by line.
+    """
+    length = shapely.length(lines)
+    counts = np.where(length > 0, np.ceil(length / lixel_length), 0).astype(np.int64)
+    lixel_start = np.concatenate(([0], np.cumsum(counts)))
+
+    # Break points at 0, lixel_length, ..., length along every split line
+    breaks = np.where(counts > 0, counts + 1, 0)
+    break_line = np.repeat(np.arange(len(lines)), breaks)
+    k = np.arange(breaks.sum()) - np.repeat(np.cumsum(breaks) - breaks, breaks)
+    break_xy = shapely.get_coordinates(
+        shapely.line_interpolate_point(lines[break_line], np.minimum(k * lixel_length, length[break_line])))
+
+    # Interior vertices, with their distance along their line
+    xy, vertex_line = shapely.get_coordinates(lines, return_index=True)
+    step = np.hypot(*np.diff(xy, axis=0).T)
+    step[vertex_line[1:] != vertex_line[:-1]] = 0
+    along = np.concatenate(([0], np.cumsum(step)))
+    along -= along[np.searchsorted(vertex_line, vertex_line)]
+    vertex_k = np.floor(along / lixel_length)
+    # Vertices on a break point (up to rounding) are left to the break point
+    eps = 1e-9 * lixel_length
+    inside = ((along - vertex_k * lixel_length > eps)
+              & (np.minimum((vertex_k + 1) * lixel_length, length[vertex_line]) - along > eps))
+    vertex_k = np.minimum(vertex_k[inside].astype(np.int64), counts[vertex_line[inside]] - 1)
+
+    # Every break point starts the lixel after it and ends the one before it;
+    # sort all points into their lixel by distance along it
+    starts = k < counts[break_line]
+    ends = k > 0
+    lixel = np.concatenate((lixel_start[break_line][starts] + k[starts],
+                            lixel_start[vertex_line[inside]] + vertex_k,
+                            lixel_start[break_line][ends] + k[ends] - 1))
+    position = np.concatenate((np.full(starts.sum(), -np.inf), along[inside], np.full(ends.sum(), np.inf)))
+    order = np.lexsort((position, lixel))
+    points = np.concatenate((break_xy[starts], xy[inside], break_xy[ends]))[order]
+    return shapely.linestrings(points, indices=lixel[order])
+
+
+def network_source(endpoint=None, extract=None, lines=None, osm_filter=HIGHWAY_FILTER, simplify=False):
+    """
+    StageCache key of where the network of a run comes from: the road lines
+    it is built from, or the extract file (by path, size and time) or
+    Overpass endpoint and filter it is read from, and whether it is
+    simplified.
+    """
+    if lines is not None:
+        return stage_key('lines', lines.crs.to_wkt(), shapely.to_wkb(lines.values))
+    if extract is not None:
+        stat = os.stat(extract)
+        return stage_key('extract', os.path.abspath(extract), stat.st_size, stat.st_mtime_ns, simplify)
+    return stage_key('overpass', endpoint, osm_filter, simplify)
+
+
+def cached_network(stages, source, bound, build):
+    """
+    RoadGraph of the StageCache read from source for a (lon_min, lat_min,
+    lon_max, lat_max) bound covering the given one, or else built by build()
+    and stored. Returns the road graph and whether it was read.
+    """
+    arrays = stages.load_network(source, bound)
+    if arrays is not None:
+        return RoadGraph.from_arrays(arrays), True
+    road = build()
+    stages.save_network(source, bound, **road.arrays())
+    return road, False
+
+
+def cached_point_offsets(stages, road, coords, processes=1):
+    """
+    Offsets of the (lon, lat) points snapped onto the road graph (see
+    RoadGraph.point_offsets), from the StageCache or else computed and
+    stored. Returns point_ptr, points and whether they were read.
+    """
+    key = stage_key(np.asarray(coords, dtype=float))
+    arrays = stages.load('points', key)
+    if arrays is not None:
+        return arrays['point_ptr'], arrays['points'], True
+    point_ptr, points = road.point_offsets(*snap_to_network(road, coords, processes))
+    stages.save('points', key, point_ptr=point_ptr, points=points)
+    return point_ptr, points, False
+
+
+def prune_network(road, point_ptr, points, bound, bandwidth=None):
+    """
+    Boolean mask of the edges of a road graph that can affect the densities
+    of a run, given the offsets of its points along every edge (see
+    RoadGraph.point_offsets): the edges with points or with an end inside
+    the (lon_min, lat_min, lon_max, lat_max) bound, in components that carry
+    points and, with a bandwidth, within that network distance of a point.
+    Components are only dropped when scipy is installed.
+    """
+    inside = road.nodes_inside(*bound)
+    keep = inside[road.u] | inside[road.v] | (np.diff(point_ptr) > 0)
+    cropped = road.subgraph(np.zeros(road.num_nodes, dtype=bool), keep)
+    crop_ptr, crop_points = select_points(point_ptr, points, keep)
+    on_edge = np.diff(crop_ptr) > 0
+
+    try:
+        component = cropped.components()
+    except ImportError:
+        if bandwidth is not None:
+            raise
+        # The native engine runs without scipy: only crop the network then
+        return keep
+    carries = np.zeros(cropped.num_nodes, dtype=bool)
+    carries[component[cropped.u[on_edge]]] = True
+    near = carries[component[cropped.u]]
+    if bandwidth is not None:
+        distance = cropped.point_distances(crop_ptr, crop_points, bandwidth)
+        near &= on_edge | np.isfinite(distance[cropped.u]) | np.isfinite(distance[cropped.indices])
+    keep[np.flatnonzero(keep)[~near]] = False
+    return keep
+
+
+def cached_lixels(stages, road, lixel_length, pruned=None):
+    """
+    Lixels of lixel_length along every edge of the road graph, in the
+    kernel's edge order, as a GeoDataFrame in its CRS: from the StageCache
+    or else split and stored. A road graph pruned from the StageCache's
+    network is named by the mask of its edges. Returns the lixels and
+    whether they were read.
+    """
+    key = stage_key(float(lixel_length), pruned)
+    arrays = stages.load('lixels', key)
+    if arrays is not None:
+        lixels = lines_from_arrays(arrays['coords'], arrays['offsets'])
+    else:
+        lixels = split_lines(road.geometries, lixel_length)
+        coords, offsets = line_arrays(lixels)
+        stages.save('lixels', key, coords=coords, offsets=offsets)
+    return gpd.GeoDataFrame(geometry=lixels, crs=road.crs), arrays is not None
+
+
+def _nkdv_region(coor_list, folder_path, feedback, bandwidth, lixel_length, processes, network_cache, endpoint,
+                 extract, network, reuse_stages, kernel_processes, prune_beyond_bandwidth, osm_filter, simplify,
+                 zero_on_error=False):
+    """
+    Lixel GeoDataFrame with the densities of the points of one region, see
+    run_nkdv. With zero_on_error, a failing kernel is reported and leaves
+    the lixels with zero density.
+    """
+    from .nkdv import NKDV
+
+    data_df = pd.DataFrame(coor_list, columns=['lon', 'lat'])
+
+    feedback.pushInfo('Start downloading map')
+    start = time.time()
+    bound = data_df['lon'].min(), data_df['lat'].min(), data_df['lon'].max(), data_df['lat'].max()
+    # Roads up to a bandwidth away from the points still carry density
+    bound = expandBound(bound, np.max(bandwidth))
+    source = network_source(endpoint, extract, network, osm_filter, simplify)
+    stages = StageCache(os.path.join(folder_path, 'stages') if reuse_stages else None)
+    if network is not None:
+        def build():
+            area = gpd.GeoSeries([shapely.box(*bound)], crs='epsg:4326').to_crs(network.crs).iloc[0]
+            return network_from_lines(network[network.intersects(area)])
+    else:
+        def build():
+            return load_network(bound[1], bound[0], bound[3], bound[2], folder_path, network_cache, endpoint, extract,
+                                osm_filter, simplify)
+    road, cached = cached_network(stages, source, bound, build)
+    if cached:
+        feedback.pushInfo('Read the prepared network from the cache folder')
+    feedback.pushInfo('End downloading map, duration:{}s'.format(time.time() - start))
+
+    feedback.pushInfo('Start projecting points to the road')
+    start = time.time()
+    point_ptr, points, cached = cached_point_offsets(stages, road, np.array(coor_list), processes)
+    if cached:
+        feedback.pushInfo('Read the projected points from the cache folder')
+    feedback.pushInfo('End projecting points to the road, duration:{}s'.format(time.time() - start))
+
+    feedback.pushInfo('Start pruning roads')
+    start = time.time()
+    keep = prune_network(road, point_ptr, points, bound, np.max(bandwidth) if prune_beyond_bandwidth else None)
+    point_ptr, points = select_points(point_ptr, points, keep)
+    road = road.subgraph(np.zeros(road.num_nodes, dtype=bool), keep)
+    feedback.pushInfo('Kept {} of {} roads'.format(road.num_edges, len(keep)))
+    feedback.pushInfo('End pruning roads, duration:{}s'.format(time.time() - start))
+
+    feedback.pushInfo('Start splitting roads')
+    start = time.time()
+    lixels, cached = cached_lixels(stages, road, lixel_length, keep)
+    if cached:
+        feedback.pushInfo('Read the lixels from the cache folder')
+    feedback.pushInfo('End splitting roads, duration:{}s'.format(time.time() - start))
+
+    feedback.pushInfo('Start processing NKDV')
+    start = time.time()
+    try:
+        if kernel_processes > 1:
+            from .nkdv.partition import compute_partitioned
+
+            values = compute_partitioned(road.indptr, road.indices, road.length, point_ptr, points, road.x, road.y,
+                                         bandwidth, lixel_length, processes=kernel_processes)
+        else:
+            example = NKDV(bandwidth=bandwidth, lixel_reg_length=lixel_length, method=3)
+            values = example.compute_csr(road.indptr, road.indices, road.length, point_ptr, points,
+                                         folder_path + '/graph_output')
+    except Exception:
+        if not zero_on_error:
+            raise
+        feedback.pushInfo(traceback.format_exc())
+        feedback.pushInfo('NKDV failed, the lixels are written with zero density')
+        values = np.zeros((len(lixels),) + np.shape(bandwidth))
+    feedback.pushInfo('End processing NKDV, duration:{}s'.format(time.time() - start))
+
+    return add_kd_values(lixels, values, bandwidth)
+
+
+class _ClusterFeedback:
+    """Feedback of one cluster of points, prefixing its messages with the cluster."""
+
+    def __init__(self, feedback, prefix):
+        self.feedback = feedback
+        self.prefix = prefix
+
+    def pushInfo(self, message):
+        self.feedback.pushInfo(self.prefix + message)
+
+
+def _overlapping_components(bounds):
+    """
+    Component label of every (lon_min, lat_min, lon_max, lat_max) bound,
+    bounds that meet, directly or through others, sharing one.
+    """
+    boxes = shapely.box(*bounds.T)
+    first, second = STRtree(boxes).query(boxes, predicate='intersects')
+    # Union-find over the meeting pairs
+    parent = np.arange(len(bounds))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(first.tolist(), second.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    roots = np.array([find(i) for i in range(len(bounds))])
+    return np.unique(roots, return_inverse=True)[1].ravel()
+
+
+def cluster_points(coords, gap, bandwidth=0):
+    """
+    Cluster label of every (lon, lat) point, numbered from the largest
+    cluster. Points within gap meters of each other share a cluster, as do
+    clusters whose bounding boxes grown by bandwidth meet, so the networks
+    of two clusters never carry density from each other's points. Points
+    are gridded in cells of gap meters and neighbouring cells are joined,
+    which may join points up to about three gaps apart.
+    """
+    coords = np.asarray(coords, dtype=float)
+    size = gap / METERS_PER_DEGREE
+    # Longitude cells are sized at the latitude furthest from the equator, never too small
+    lon_size = size / np.cos(np.radians(min(np.abs(coords[:, 1]).max(), 89.0)))
+    cells, cell = np.unique(np.floor(coords / (lon_size, size)).astype(np.int64), axis=0, return_inverse=True)
+    index = {(cx, cy): i for i, (cx, cy) in enumerate(cells.tolist())}
+    label = np.full(len(cells), -1)
+    count = 0
+    for first in range(len(cells)):
+        if label[first] >= 0:
+            continue
+        label[first] = count
+        stack = [first]
+        while stack:
+            cx, cy = cells[stack.pop()]
+            for neighbour in ((cx + dx, cy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                j = index.get(neighbour)
+                if j is not None and label[j] < 0:
+                    label[j] = count
+                    stack.append(j)
+        count += 1
+    labels = label[cell.ravel()]
+
+    # Join clusters until the bounds of their networks are apart; a joined
+    # cluster's bound may meet further clusters, hence the rounds
+    while True:
+        labels = np.unique(labels, return_inverse=True)[1].ravel()
+        corners = pd.DataFrame(coords).groupby(labels)
+        low, high = corners.min().to_numpy(), corners.max().to_numpy()
+        bounds = np.array([expandBound((*a, *b), bandwidth) for a, b in zip(low, high)])
+        joined = _overlapping_components(bounds)
+        if joined.max() + 1 == len(bounds):
+            break
+        labels = joined[labels]
+
+    _, labels, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    rank = np.empty(len(sizes), dtype=np.int64)
+    rank[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+    return rank[labels.ravel()]
+
+
+def run_nkdv(coor_list, folder_path, output_path, feedback, bandwidth=1000, lixel_length=5, processes=1,
+             network_cache=None, endpoint=None, extract=None, network=None, reuse_stages=True, kernel_processes=1,
+             prune_beyond_bandwidth=False, network_type=None, custom_filter=None, cluster_gap=None,
+             cluster_workers=1, simplify=False):
+    """
+    Headless NKDV: load the network around the points, grown by the
+    bandwidth (see load_network; Overpass returns only the ways of the
+    network_type or custom_filter, see network_filter), or build it from the
+    lines of the network GeoSeries within that area, project the points onto
+    it (on processes worker processes), prune it to the roads that can carry
+    density (see prune_network; with prune_beyond_bandwidth, also the roads
+    beyond one bandwidth of network distance from every point), split it into
+    lixels, run the kernel and write the lixels with their 'value' to
+    output_path (any vector format geopandas can write). Returns the lixel
+    GeoDataFrame. A sequence of bandwidths is computed in one kernel pass and
+    written as one value_<bandwidth> column each. With kernel_processes > 1
+    the network is split into as many regions, computed in parallel (see
+    nkdv.partition). With reuse_stages, the network, snapped points and
+    lixels are kept in folder_path/stages and read back by runs with the
+    same inputs. With simplify, an OpenStreetMap network has the nodes along
+    its roads merged away first (see simplify_network).
+
+    With a cluster_gap (meters), points are first grouped by cluster_points
+    and every cluster gets its own network, computed in folder_path/cluster_<i>
+    on cluster_workers threads, so the area between far apart clusters is
+    never downloaded. The lixels of all clusters are written together, in
+    the CRS of the largest cluster. A failing cluster is reported on
+    feedback and does not stop the others: if its kernel fails its lixels
+    are written with zero density, if its network fails it is left out. The
+    first error is raised only when every cluster fails.
+    """
+    osm_filter = network_filter(network_type, custom_filter)
+    # The native kernel writes its network file there
+    os.makedirs(folder_path, exist_ok=True)
+    coords = np.asarray(coor_list, dtype=float)
+    if cluster_gap:
+        labels = cluster_points(coords, cluster_gap, np.max(bandwidth))
+    else:
+        labels = np.zeros(len(coords), dtype=np.int64)
+
+    clusters = labels.max() + 1
+
+    def region(i, region_folder, region_feedback):
+        return _nkdv_region(coords[labels == i], region_folder, region_feedback, bandwidth, lixel_length, processes,
+                            network_cache, endpoint, extract, network, reuse_stages, kernel_processes,
+                            prune_beyond_bandwidth, osm_filter, simplify, zero_on_error=clusters > 1)
+
+    if clusters == 1:
+        lixels = region(0, folder_path, feedback)
+    else:
+        feedback.pushInfo('Split the points into {} clusters'.format(clusters))
+        # Threads, as most of a cluster's time is spent downloading
+        with ThreadPoolExecutor(max_workers=cluster_workers) as executor:
+            futures = []
+            for i in range(clusters):
+                region_folder = os.path.join(folder_path, 'cluster_{}'.format(i))
+                os.makedirs(region_folder, exist_ok=True)
+                futures.append(executor.submit(region, i, region_folder,
+                                               _ClusterFeedback(feedback, '[cluster {}] '.format(i))))
+            parts, errors = [], []
+            for i, future in enumerate(futures):
+                try:
+                    parts.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+                    region_feedback = _ClusterFeedback(feedback, '[cluster {}] '.format(i))
+                    region_feedback.pushInfo(traceback.format_exc())
+                    region_feedback.pushInfo('Its network failed, the cluster is left out')
+        if not parts:
+            raise errors[0]
+        crs = parts[0].crs
+        lixels = gpd.GeoDataFrame(pd.concat([part.to_crs(crs) for part in parts], ignore_index=True), crs=crs)
+    lixels.to_file(output_path)
+    return lixels
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Array-backed road network shared by the NKDV stages (snapping, lixels,
+ kernel), in place of networkx graphs. Nothing in here imports QGIS.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS, Transformer
+from shapely.strtree import STRtree
+
+# scipy is needed for the network searches of pruning
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components, dijkstra
+except ImportError:  # pragma: no cover
+    csr_matrix = None
+
+
+def _ranges(starts, ends):
+    """Concatenation of range(start, end) for every start, end pair."""
+    counts = ends - starts
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def select_points(point_ptr, points, edges):
+    """
+    Point offsets along every edge (see RoadGraph.point_offsets) of the edges
+    selected by a boolean mask, as in the subgraph of those edges.
+    """
+    edges = np.flatnonzero(edges)
+    return (np.concatenate(([0], np.cumsum(np.diff(point_ptr)[edges]))),
+            np.asarray(points)[_ranges(point_ptr[edges], point_ptr[edges + 1])])
+
+
+def line_arrays(lines):
+    """Coordinates of an array of lines and the offsets of every line into them."""
+    coords, line = shapely.get_coordinates(lines, return_index=True)
+    return coords, np.searchsorted(line, np.arange(len(lines) + 1))
+
+
+def lines_from_arrays(coords, offsets):
+    """Array of lines from their coordinates and offsets, as returned by line_arrays."""
+    return shapely.linestrings(coords, indices=np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)))
+
+
+class RoadGraph:
+    """
+    Undirected road network in arrays. Nodes have x, y coordinates in a
+    projected crs. Edges are held as CSR adjacency sorted by (u, v) with
+    u <= v: the edges of node u run to indices[indptr[u]:indptr[u + 1]].
+    Edge i has length[i] and runs along coords[coord_ptr[i]:coord_ptr[i + 1]],
+    starting at its u node. The edge order is the kernel's edge order.
+    """
+
+    def __init__(self, x, y, indptr, indices, length, coords, coord_ptr, crs):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.length = np.asarray(length, dtype=float)
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.coord_ptr = np.asarray(coord_ptr, dtype=np.int64)
+        self.crs = CRS.from_user_input(crs)
+        self._geometries = None
+        self._tree = None
+
+    @property
+    def num_nodes(self):
+        return len(self.x)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @property
+    def u(self):
+        return np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+
+    @property
+    def v(self):
+        return self.indices
+
+    @property
+    def geometries(self):
+        """LineString of every edge, built on first use."""
+        if self._geometries is None:
+            self._geometries = lines_from_arrays(self.coords, self.coord_ptr)
+        return self._geometries
+
+    @property
+    def tree(self):
+        """STRtree of the edge geometries, built on first use."""
+        if self._tree is None:
+            self._tree = STRtree(self.geometries)
+        return self._tree
+
+    @classmethod
+    def from_edges(cls, x, y, u, v, geometries, crs):
+        """
+        Road graph of node coordinates and edges (u, v, geometry) with every
+        geometry starting at its u node, in any order and orientation.
+        """
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        geometries = np.asarray(geometries, dtype=object)
+        geometries = np.where(u > v, shapely.reverse(geometries), geometries)
+        u, v = np.minimum(u, v), np.maximum(u, v)
+        order = np.lexsort((v, u))
+        u, v, geometries = u[order], v[order], geometries[order]
+        coords, coord_ptr = line_arrays(geometries)
+        indptr = np.searchsorted(u, np.arange(len(x) + 1))
+        road = cls(x, y, indptr, v, shapely.length(geometries), coords, coord_ptr, crs)
+        road._geometries = geometries
+        return road
+
+    @classmethod
+    def from_osmnx(cls, graph):
+        """
+        Road graph of a projected osmnx MultiDiGraph. Of the edges between
+        two nodes, in either direction, the one kept is the one networkx keeps
+        when the graph is made undirected and simple (to_undirected, then
+        nx.Graph): the last written key of the pair, with the data of that
+        key's last edge. Its geometry is reversed unless it starts at the x
+        of the pair's first node.
+        """
+        nodes = list(graph.nodes(data=True))
+        position = {n: i for i, (n, data) in enumerate(nodes)}
+        x = np.array([data['x'] for n, data in nodes], dtype=float)
+        y = np.array([data['y'] for n, data in nodes], dtype=float)
+
+        edges = list(graph.edges(keys=True, data='geometry'))
+        a = np.array([position[e[0]] for e in edges], dtype=np.int64)
+        b = np.array([position[e[1]] for e in edges], dtype=np.int64)
+        occurrences = pd.DataFrame({'u': np.minimum(a, b), 'v': np.maximum(a, b),
+                                    'key': [e[2] for e in edges]})
+        occurrences['i'] = np.arange(len(edges))
+        keys = occurrences.groupby(['u', 'v', 'key'], sort=False)['i'].agg(['min', 'max']).reset_index()
+        chosen = keys.loc[keys.groupby(['u', 'v'], sort=False)['min'].idxmax()]
+        u, v = chosen['u'].to_numpy(), chosen['v'].to_numpy()
+        geometries = np.array([edges[i][3] for i in chosen['max'].to_numpy()], dtype=object)
+
+        start = shapely.get_x(shapely.get_point(geometries, 0))
+        geometries = np.where(np.abs(start - x[u]) > 0.00001, shapely.reverse(geometries), geometries)
+        return cls.from_edges(x, y, u, v, geometries, graph.graph['crs'])
+
+    def nodes_inside(self, lon_min, lat_min, lon_max, lat_max):
+        """Boolean mask of the nodes inside a WGS84 bounding box."""
+        transformer = Transformer.from_crs('epsg:4326', self.crs, always_xy=True)
+        area = shapely.transform(shapely.segmentize(shapely.box(lon_min, lat_min, lon_max, lat_max), 0.001),
+                                 lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+        return shapely.contains_xy(area, self.x, self.y)
+
+    def point_offsets(self, edge, distance):
+        """
+        Points given by their edge and distance from its u node, as the sorted
+        offsets along every edge: edge i holds points[point_ptr[i]:point_ptr[i + 1]].
+        """
+        order = np.lexsort((distance, edge))
+        point_ptr = np.searchsorted(np.asarray(edge)[order], np.arange(self.num_edges + 1))
+        return point_ptr, np.asarray(distance, dtype=float)[order]
+
+    def subgraph(self, nodes, edges):
+        """
+        Road graph of the edges selected by a boolean mask, their nodes and the
+        nodes selected by a boolean mask, renumbered in their original order.
+        """
+        nodes = np.asarray(nodes, dtype=bool).copy()
+        edges = np.flatnonzero(edges)
+        u, v = self.u[edges], self.indices[edges]
+        nodes[u] = True
+        nodes[v] = True
+        ids = np.cumsum(nodes) - 1
+        coord = _ranges(self.coord_ptr[edges], self.coord_ptr[edges + 1])
+        indptr = np.searchsorted(ids[u], np.arange(nodes.sum() + 1))
+        coord_ptr = np.concatenate(([0], np.cumsum(np.diff(self.coord_ptr)[edges])))
+        return RoadGraph(self.x[nodes], self.y[nodes], indptr, ids[v], self.length[edges], self.coords[coord],
+                         coord_ptr, self.crs)
+
+    def _adjacency(self, extra_rows=(), extra_cols=(), extra_weights=(), extra_nodes=0):
+        if csr_matrix is None:  # pragma: no cover
+            raise ImportError('scipy must be installed to search the road network')
+        u, v = self.u, self.indices
+        keep = u != v
+        rows = np.concatenate((u[keep], v[keep], extra_rows))
+        cols = np.concatenate((v[keep], u[keep], extra_cols))
+        # csr_matrix would sum parallel entries and csgraph drops explicit
+        # zeros, so keep the shortest of parallel entries and clamp zeros
+        weights = np.maximum(np.concatenate((self.length[keep], self.length[keep], extra_weights)), 1e-9)
+        order = np.lexsort((weights, cols, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        n = self.num_nodes + extra_nodes
+        return csr_matrix((weights[first], (rows[first], cols[first])), shape=(n, n))
+
+    def components(self):
+        """Connected component label of every node."""
+        return connected_components(self._adjacency(), directed=False)[1]
+
+    def point_distances(self, point_ptr, points, limit):
+        """
+        Network distance from every node to the nearest of the points given
+        by their offsets along every edge (see point_offsets), inf where it is
+        limit or more.
+        """
+        edges = np.flatnonzero(np.diff(point_ptr))
+        first = points[point_ptr[edges]]
+        last = points[point_ptr[edges + 1] - 1]
+        # A virtual node linked to the ends of every edge with points, at the
+        # distance of the nearest point on it
+        n = self.num_nodes
+        source = np.full(2 * len(edges), n)
+        ends = np.concatenate((self.u[edges], self.indices[edges]))
+        weights = np.concatenate((first, self.length[edges] - last))
+        adjacency = self._adjacency(np.concatenate((source, ends)), np.concatenate((ends, source)),
+                                    np.concatenate((weights, weights)), 1)
+        return dijkstra(adjacency, directed=False, indices=n, limit=limit)[:n]
+
+    def arrays(self):
+        """The road graph as a dict of arrays, for np.savez."""
+        return {'x': self.x, 'y': self.y, 'indptr': self.indptr, 'indices': self.indices, 'length': self.length,
+                'coords': self.coords, 'coord_ptr': self.coord_ptr, 'crs': np.array(self.crs.to_wkt())}
+
+    @classmethod
+    def from_arrays(cls, data):
+        """Road graph of a mapping of arrays returned by arrays (or an np.load of them)."""
+        return cls(data['x'], data['y'], data['indptr'], data['indices'], data['length'], data['coords'],
+                   data['coord_ptr'], str(data['crs']))
+
+    def save(self, path):
+        """Save to a compressed .npz file."""
+        np.savez_compressed(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Road graph saved with save."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls.from_arrays(data)
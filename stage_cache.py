@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ Fast Density Analysis
+                                 A QGIS plugin
+ A fast kernel density visualization plugin for geospatial analytics
+ ***************************************************************************/
+ Prepared NKDV stages kept in the cache folder, so re-runs that change only
+ the bandwidth or the lixel length skip the stages they share. Nothing in
+ here imports QGIS.
+"""
+
+__author__ = 'LibKDV Group'
+__date__ = '2023-07-03'
+__copyright__ = '(C) 2023 by LibKDV Group'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import hashlib
+import os
+import zipfile
+import numpy as np
+
+
+def stage_key(*parts):
+    """
+    Short hex digest of the inputs of a stage: numbers, strings, None, tuples
+    of them and numpy arrays (object arrays of bytes, such as WKB, included).
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype == object:
+            for item in part:
+                digest.update(item)
+                digest.update(b'\0')
+        elif isinstance(part, np.ndarray):
+            digest.update('{}{}'.format(part.dtype, part.shape).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'\1')
+    return digest.hexdigest()[:16]
+
+
+def _covers(outer, inner):
+    """Whether a (lon_min, lat_min, lon_max, lat_max) bound contains another."""
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+class StageCache:
+    """
+    Stages prepared for one road network in a folder: its graph, the offsets
+    of snapped points and its lixels, each an uncompressed .npz file named by
+    the network's key, the stage and a key of the stage's other inputs. The
+    network is found by its source (see load_network) and its key then names
+    the other stages. When another network is stored, the stages of the
+    previous one are removed. With folder None nothing is stored and every
+    stage is computed.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.network_key = None
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def _path(self, stage, key):
+        name = '_'.join(part for part in (self.network_key, stage, key) if part)
+        return os.path.join(self.folder, name + '.npz')
+
+    def load_network(self, source, bound):
+        """
+        Arrays of the stored network read from source (a key of where it comes
+        from) for a (lon_min, lat_min, lon_max, lat_max) bound covering the
+        given one, or None.
+        """
+        if self.folder is None:
+            return None
+        for name in os.listdir(self.folder):
+            if not name.endswith('_graph.npz'):
+                continue
+            self.network_key = name[:-len('_graph.npz')]
+            arrays = self.load('graph')
+            if arrays is not None and str(arrays['source']) == source and _covers(arrays['bound'], bound):
+                return arrays
+        self.network_key = None
+        return None
+
+    def save_network(self, source, bound, **arrays):
+        """Store the arrays of the network read from source for a bound, as the folder's network."""
+        self.network_key = stage_key(source, tuple(float(b) for b in bound))
+        if self.folder is None:
+            return
+        self._remove_other_networks()
+        self.save('graph', source=np.array(source), bound=np.array(bound, dtype=float), **arrays)
+
+    def load(self, stage, key=''):
+        """Arrays stored for a stage and key, or None."""
+        if self.folder is None:
+            return None
+        try:
+            with np.load(self._path(stage, key), allow_pickle=False) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # Missing, or left partial by an interrupted run
+            return None
+
+    def save(self, stage, key='', **arrays):
+        """Store the arrays of a stage and key."""
+        if self.folder is None:
+            return
+        path = self._path(stage, key)
+        # Write then rename, so a run never reads a partial file
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+
+    def _remove_other_networks(self):
+        for name in os.listdir(self.folder):
+            if name.endswith('.npz') and not name.startswith(self.network_key + '_'):
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
@@ -30,6 +30,7 @@ from qgis.core import (
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterField,
     QgsProcessingParameterDateTime,
+    QgsProcessingParameterExtent,
     QgsMessageLog,
     Qgis,
     QgsProject,
@@ -37,10 +38,9 @@ from qgis.core import (
     QgsStyle
 )
 from qgis.PyQt.QtGui import QIcon
-from .libkdv import kdv
+from .heatmap import computeSTKDV, iterSTRasters
 from .rasterstyle import applyPseudocolor
-import pandas as pd
-from osgeo import gdal
+from .layerdata import expandExtent, featureRequest, layerToDataFrame, rangeExpression
 from datetime import datetime
 import time
 
@@ -59,6 +59,7 @@ class STKDVAlgorithm(QgsProcessingAlgorithm):
     TEMPORALBANDWIDTH = 'TEMPORALBANDWIDTH'
     STARTTIME = 'STARTTIME'
     ENDTIME = 'ENDTIME'
+    EXTENT = 'EXTENT'
     RAMPNAME = 'RAMPNAME'
     INVERT = 'INVERT'
     INTERPOLATION = 'INTERPOLATION'
@@ -157,6 +158,13 @@ class STKDVAlgorithm(QgsProcessingAlgorithm):
                 'End'
             )
         )
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                'Study area extent',
+                optional=True
+            )
+        )
         if Qgis.QGIS_VERSION_INT >= 32200:
             param = QgsProcessingParameterString(
                 self.RAMPNAME,
@@ -247,8 +255,11 @@ class STKDVAlgorithm(QgsProcessingAlgorithm):
         startTime = self.parameterAsDateTime(parameters, self.STARTTIME, context)
         endTime = self.parameterAsDateTime(parameters, self.ENDTIME, context)
 
-        startTime = startTime.toString("yyyy-MM-dd hh:mm:ss")
-        endTime = endTime.toString("yyyy-MM-dd hh:mm:ss")
+        st = startTime.toSecsSinceEpoch()
+        et = endTime.toSecsSinceEpoch()
+        extent = None
+        if parameters.get(self.EXTENT):
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context, lyr.crs())
 
         if Qgis.QGIS_VERSION_INT >= 32200:
             ramp_name = self.parameterAsString(parameters, self.RAMPNAME, context)
@@ -259,7 +270,7 @@ class STKDVAlgorithm(QgsProcessingAlgorithm):
         mode = self.parameterAsInt(parameters, self.MODE, context)
         num_classes = self.parameterAsInt(parameters, self.CLASSES, context)
         rlayers = processSTKDV(lyr, fldLat, fldLon, fldTime, row_pixels, col_pixels, t_pixels, bandwidth_s, bandwidth_t,
-                               startTime, endTime, ramp_name, invert, interp, mode, num_classes, feedback)
+                               st, et, ramp_name, invert, interp, mode, num_classes, feedback, extent)
 
         return {self.OUTPUT: rlayers}
 
@@ -297,7 +308,7 @@ class STKDVAlgorithm(QgsProcessingAlgorithm):
 
 
 def processSTKDV(lyr, fldLat, fldLon, fldTime, row_pixels, col_pixels, t_pixels, bandwidth_s, bandwidth_t,
-                 startTime, endTime, ramp_name, invert, interp, mode, num_classes, feedback):
+                 st, et, ramp_name, invert, interp, mode, num_classes, feedback, extent=None):
     currentTime = datetime.now()
     timeStr = currentTime.strftime('%Y-%m-%d %H-%M-%S')
     prjPath = QgsProject.instance().homePath()
@@ -314,17 +325,11 @@ def processSTKDV(lyr, fldLat, fldLon, fldTime, row_pixels, col_pixels, t_pixels,
     # Start aggregate features
     feedback.pushInfo('Start aggregate features')
     start = time.time()
-    data = pd.DataFrame([feat.attributes() for feat in lyr.getFeatures()],
-                        columns=[field.name() for field in lyr.fields()])
-    data = data.loc[:, [fldLat, fldLon, fldTime]]
-    data.rename(columns={fldLat: 'lat', fldLon: 'lon', fldTime: 't'}, inplace=True)
-    dt = datetime.strptime(startTime, '%Y-%m-%d %H:%M:%S')
-    st = dt.timestamp()
-    dt = datetime.strptime(endTime, '%Y-%m-%d %H:%M:%S')
-    et = dt.timestamp()
-    # Select the data in the time period
-    condition = (data['t'] >= st) & (data['t'] <= et)
-    filtered_data = data[condition]
+    # Only read the features in the time period (and near the extent) from the provider
+    if extent is not None:
+        extent = expandExtent(extent, lyr.crs(), bandwidth_s)
+    request = featureRequest(lyr, [fldLat, fldLon, fldTime], rangeExpression(fldTime, st, et), extent)
+    filtered_data = layerToDataFrame(lyr, [fldLat, fldLon, fldTime], ['lat', 'lon', 't'], request)
     if filtered_data.empty:
         return {'Empty.'}
     end = time.time()
@@ -338,9 +343,7 @@ def processSTKDV(lyr, fldLat, fldLon, fldTime, row_pixels, col_pixels, t_pixels,
     # Start STKDV
     feedback.pushInfo('Start STKDV')
     start = time.time()
-    kdv_data = kdv(filtered_data, GPS=True, KDV_type='STKDV', bandwidth=bandwidth_s, bandwidth_t=bandwidth_t,
-                   row_pixels=row_pixels, col_pixels=col_pixels, t_pixels=t_pixels)
-    kdv_data.compute()
+    kdv_result = computeSTKDV(filtered_data, row_pixels, col_pixels, t_pixels, bandwidth_s, bandwidth_t)
     end = time.time()
     duration = end - start
     feedback.setProgress(70)
@@ -352,43 +355,12 @@ def processSTKDV(lyr, fldLat, fldLon, fldTime, row_pixels, col_pixels, t_pixels,
     # Start generate STKDV raster layer
     feedback.pushInfo('Start generate STKDV raster layer')
     start = time.time()
-    kdv_data.result.rename(columns={"lon": "x", "lat": "y", "val": "value"}, inplace=True)
-    # Convert time column to datetime type
-    kdv_data.result['t'] = pd.to_datetime(kdv_data.result['t'], unit='s')
-    
-    # Group by time - fix the groupby operation
-    grouped = kdv_data.result.groupby('t')
-    
-    # Get value range for scaling
-    min_val = kdv_data.result['value'].min()
-    max_val = kdv_data.result['value'].max()
-    scale_params = [[min_val, max_val]]
-    
-    
-    # Iterate through each group and generate a STKDV Heatmap for each group
+    # Iterate through each time slice and generate a STKDV Heatmap for each of them
     rlayers = []
     i = 0
-    for dt, group in grouped:
+    for dt, fn in iterSTRasters(kdv_result, savePath):
         if feedback.isCanceled():
             return {}
-
-        
-        # Delete Time Column
-        group = group.drop('t', axis=1)
-        # Sorted according to first y minus then x increasing (from top left corner, top to bottom left to right)
-        result = group.sort_values(by=["y", "x"], ascending=[False, True])
-        
-        path = savePath + "/STHeatmap " + dt.strftime("%Y-%m-%d %H-%M-%S")
-        result.to_csv(path + ".xyz", index=False, header=False, sep=" ")
-        
-        opts = gdal.TranslateOptions(
-            outputSRS="EPSG:4326",
-            scaleParams=scale_params
-        )
-        temp = gdal.Translate(path + ".tif", path + ".xyz", options=opts)
-        temp = None
-        os.remove(path + ".xyz")
-        fn = path + ".tif"
         rlayer = QgsRasterLayer(fn, "STHeatmap" + dt.strftime("%Y-%m-%d %H-%M-%S"))
 
         applyPseudocolor(rlayer, ramp_name, invert, interp, mode, num_classes)
@@ -0,0 +1,16 @@
+"""
+Import the plugin folder as the fast_density_analysis package, as QGIS
+does, so tests can exercise the modules that need no QGIS.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'fast_density_analysis' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('fast_density_analysis', os.path.join(ROOT, '__init__.py'),
+                                                  submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['fast_density_analysis'] = package
+    spec.loader.exec_module(package)
@@ -0,0 +1,89 @@
+import json
+import pandas as pd
+import pytest
+from fast_density_analysis.batch import JOB_DEFAULTS, _timestamp, load_manifest, read_points, run_job
+
+
+@pytest.fixture
+def points_csv(tmp_path):
+    path = tmp_path / 'points.csv'
+    pd.DataFrame({
+        'x': [114.01, 114.02, 114.2, None],
+        'y': [22.01, 22.02, 22.2, 22.03],
+        'when': ['2020-01-01 00:00:00', '2020-01-01 12:00:00', '2020-01-02 00:00:00', '2020-01-03 00:00:00'],
+        'other': [1, 2, 3, 4],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_read_points_renames_and_drops_missing(points_csv):
+    data = read_points(points_csv, 'x', 'y')
+    assert list(data.columns) == ['lon', 'lat']
+    assert len(data) == 3
+
+
+def test_read_points_times_are_utc_epoch_seconds(points_csv):
+    data = read_points(points_csv, 'x', 'y', 'when')
+    assert data['t'].tolist() == [1577836800, 1577880000, 1577923200]
+
+
+def test_read_points_bbox(points_csv):
+    data = read_points(points_csv, 'x', 'y', bbox=(114.0, 22.0, 114.05, 22.05))
+    assert data['lon'].tolist() == [114.01, 114.02]
+
+
+def test_time_bounds_match_data_times(points_csv):
+    data = read_points(points_csv, 'x', 'y', 'when')
+    assert _timestamp('2020-01-01 12:00:00') == data['t'].iloc[1]
+    assert _timestamp(None) is None
+    assert _timestamp(5) == 5
+
+
+def test_manifest_defaults_apply_to_every_job(tmp_path):
+    path = tmp_path / 'jobs.json'
+    path.write_text(json.dumps({
+        'defaults': {'bandwidth': 250, 'lon': 'x'},
+        'jobs': [{'type': 'KDV', 'input': 'a.csv', 'output': 'a.tif'},
+                 {'type': 'KDV', 'input': 'b.csv', 'output': 'b.tif', 'bandwidth': 500}],
+    }))
+    jobs = load_manifest(str(path))
+    assert [job['bandwidth'] for job in jobs] == [250, 500]
+    assert all(job['lon'] == 'x' for job in jobs)
+
+
+def test_manifest_list(tmp_path):
+    path = tmp_path / 'jobs.json'
+    path.write_text(json.dumps([{'type': 'NKDV', 'input': 'a.csv', 'output': 'a.gpkg'}]))
+    assert load_manifest(str(path)) == [{'type': 'NKDV', 'input': 'a.csv', 'output': 'a.gpkg'}]
+
+
+def test_job_defaults_cover_every_option():
+    assert JOB_DEFAULTS['bandwidth'] == 1000
+    assert JOB_DEFAULTS['lixel_length'] == 20
+    assert JOB_DEFAULTS['cluster_workers'] == 1
+    assert JOB_DEFAULTS['extent'] is None and JOB_DEFAULTS['mask'] is None
+
+
+def test_run_job_reports_errors_instead_of_raising(tmp_path):
+    result = run_job({'type': 'heatmap', 'input': 'a.csv', 'output': 'a.tif'})
+    assert result['outputs'] == []
+    assert result['error'].startswith('ValueError: Unknown job type')
+
+    result = run_job({'type': 'NKDV', 'input': str(tmp_path / 'missing.csv'), 'output': 'a.gpkg'})
+    assert result['error'] is not None
+
+
+def test_read_points_bbox_of_projected_file(tmp_path):
+    import geopandas as gpd
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    lon, lat = rng.uniform(114.0, 114.1, 100), rng.uniform(22.0, 22.1, 100)
+    path = str(tmp_path / 'points.gpkg')
+    gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs='epsg:4326').to_crs('epsg:3857').to_file(path)
+
+    assert len(read_points(path)) == 100
+    data = read_points(path, bbox=(114.0, 22.0, 114.05, 22.05))
+    inside = (lon <= 114.05) & (lat <= 22.05)
+    assert len(data) == inside.sum() > 0
+    assert np.allclose(np.sort(data['lon']), np.sort(lon[inside]))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fast_density_analysis.heatmap import SparseRaster, computeKDV
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'lon': rng.uniform(114.0, 114.1, 2000), 'lat': rng.uniform(22.0, 22.1, 2000)})
+
+
+def test_sparse_raster_round_trip():
+    raster = SparseRaster((114.0, 22.0, 114.3, 22.2), 4, 3, [0, 3, 1], [0, 2, 1], [1.0, 0.5, 0.25])
+    dense = raster.toDense()
+    assert dense.shape == (3, 4)
+    assert dense[0, 0] == 1.0 and dense[2, 3] == 0.5 and dense[1, 1] == 0.25
+    assert dense.sum() == 1.75
+
+    frame = raster.toFrame()
+    assert frame['lon'].tolist() == pytest.approx([114.0, 114.3, 114.1])
+    assert frame['lat'].tolist() == pytest.approx([22.2, 22.0, 22.1])
+    again = SparseRaster.fromResult(frame, raster.bound, raster.width, raster.height)
+    assert np.array_equal(again.toDense(), dense)
+
+
+def test_sparse_raster_fill():
+    raster = SparseRaster((0, 0, 1, 1), 2, 2, [0], [0], [0.0], fill=np.nan)
+    dense = raster.toDense()
+    assert dense[0, 0] == 0 and np.isnan(dense[1, 1])
+    assert len(raster.toFrame()) == 1
+    assert len(raster.toFrame(everyPixel=True)) == 4
+
+
+def test_sparse_raster_geotransform():
+    raster = SparseRaster((114.0, 22.0, 114.3, 22.2), 4, 3, [], [], [])
+    assert raster.geoTransform == pytest.approx((113.95, 0.1, 0.0, 22.25, 0.0, -0.1))
+
+
+def test_sparse_kdv_matches_dense(points):
+    dense = computeKDV(points, 40, 30, 500, bound=(114.0, 22.0, 114.1, 22.1))
+    sparse = computeKDV(points, 40, 30, 500, bound=(114.0, 22.0, 114.1, 22.1), sparse=True)
+    assert len(sparse.values) == (dense['val'] != 0).sum()
+    frame = sparse.toFrame()
+    merged = pd.merge(frame.round(9), dense.round(9), on=['lon', 'lat'])
+    assert len(merged) == len(frame)
+    assert np.allclose(merged['val_x'], merged['val_y'], atol=1e-6)
+
+
+def test_write_sparse_tiff(tmp_path):
+    gdal = pytest.importorskip('osgeo.gdal')
+    from fast_density_analysis.heatmap import writeRaster
+
+    raster = SparseRaster((114.0, 22.0, 114.3, 22.2), 300, 200, [0, 299], [0, 199], [1.0, 0.5])
+    path = writeRaster(raster, str(tmp_path / 'heatmap.tif'))
+    band = gdal.Open(path).GetRasterBand(1)
+    assert np.array_equal(band.ReadAsArray(), raster.toDense())
+
+
+def test_masked_kdv_matches_unmasked_inside_mask(points):
+    shapely = pytest.importorskip('shapely')
+    from fast_density_analysis.heatmap import computeMaskedKDV
+
+    mask = shapely.Point(114.05, 22.05).buffer(0.04)
+    bound = mask.bounds
+    masked = computeMaskedKDV(points, 50, 40, 500, mask, strip_pixels=7)
+    full = computeKDV(points, 50, 40, 500, bound=bound, sparse=True).toDense()
+    dense = masked.toDense()
+    inside = ~np.isnan(dense)
+    assert inside.sum() == len(masked.values) > 0
+    # Strips are stitched on one scale, so inside the mask the result is the
+    # unmasked heatmap rescaled to its maximum there
+    assert np.allclose(dense[inside], full[inside] / full[inside].max(), atol=1e-5)
+
+
+def test_masked_kdv_without_density(points):
+    shapely = pytest.importorskip('shapely')
+    from fast_density_analysis.heatmap import computeMaskedKDV
+
+    mask = shapely.Point(114.05, 22.05).buffer(0.04)
+    # No points, or one point a bandwidth away from every pixel of its strips
+    for data in (points.iloc[:0], pd.DataFrame({'lon': [114.0], 'lat': [22.0]})):
+        masked = computeMaskedKDV(data, 20, 20, 300, mask)
+        assert len(masked.values) > 0 and not masked.values.any()
@@ -0,0 +1,155 @@
+import http.server
+import multiprocessing
+import re
+import threading
+import urllib.parse
+
+import numpy as np
+import pytest
+
+from fast_density_analysis import nkdv_pipeline
+from fast_density_analysis.network_cache import NetworkCache, crop_graph, tile_bbox, tile_range
+from fast_density_analysis.road_graph import RoadGraph
+
+# Spacing (degrees) of the streets the stand-in server returns
+STEP = 0.01
+
+
+def grid_xml(lat_min, lon_min, lat_max, lon_max):
+    """OSM XML of the streets of a STEP grid within a bounding box."""
+    rows = np.arange(np.ceil(lat_min / STEP), np.floor(lat_max / STEP) + 1).astype(int)
+    cols = np.arange(np.ceil(lon_min / STEP), np.floor(lon_max / STEP) + 1).astype(int)
+    node_id = {(r, c): i + 1 for i, (r, c) in enumerate((r, c) for r in rows for c in cols)}
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">']
+    for (r, c), i in node_id.items():
+        parts.append('<node id="{}" lat="{:.7f}" lon="{:.7f}"/>'.format(i, r * STEP, c * STEP))
+    streets = [[(r, c) for c in cols] for r in rows] + [[(r, c) for r in rows] for c in cols]
+    for way_id, street in enumerate(streets, 1):
+        if len(street) < 2:
+            continue
+        parts.append('<way id="{}">'.format(way_id))
+        parts.extend('<nd ref="{}"/>'.format(node_id[node]) for node in street)
+        parts.append('<tag k="highway" v="residential"/></way>')
+    parts.append('</osm>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+class StandInOverpass(http.server.ThreadingHTTPServer):
+    """Overpass interpreter answering every bounding box query with grid_xml, counting the queries."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), OverpassHandler)
+        self.bboxes = []
+        self.endpoint = 'http://127.0.0.1:{}/api/interpreter'.format(self.server_address[1])
+
+
+class OverpassHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        query = urllib.parse.parse_qs(body)['data'][0]
+        bbox = tuple(float(x) for x in re.search(r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)', query).groups())
+        self.server.bboxes.append(bbox)
+        content = grid_xml(*bbox)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/osm3s+xml')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def overpass():
+    server = StandInOverpass()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def load(tmp_path, overpass, bbox):
+    lat_min, lon_min, lat_max, lon_max = bbox
+    return nkdv_pipeline.load_network(lat_min, lon_min, lat_max, lon_max, str(tmp_path / 'run'),
+                                      network_cache=str(tmp_path / 'cache'), endpoint=overpass.endpoint)
+
+
+def test_overlapping_bounds_fetch_only_missing_tiles(tmp_path, overpass):
+    first = load(tmp_path, overpass, (22.31, 114.16, 22.34, 114.19))
+    assert overpass.bboxes == [tile_bbox(tile_range(22.31, 114.16, 22.34, 114.19))]
+    assert first.num_edges > 0
+
+    # Within the fetched tiles: answered from the cache, by this or another store on the folder
+    load(tmp_path, overpass, (22.32, 114.17, 22.33, 114.18))
+    load(tmp_path, overpass, (22.31, 114.16, 22.34, 114.19))
+    assert len(overpass.bboxes) == 1
+
+    # Reaching beyond them: fetched once, then cached too
+    load(tmp_path, overpass, (22.33, 114.18, 22.36, 114.21))
+    load(tmp_path, overpass, (22.33, 114.18, 22.36, 114.21))
+    assert len(overpass.bboxes) == 2
+
+
+def test_cached_network_matches_fetched(tmp_path, overpass):
+    bbox = (22.31, 114.16, 22.34, 114.19)
+    fetched = load(tmp_path, overpass, bbox)
+    cached = load(tmp_path, overpass, bbox)
+
+    assert len(overpass.bboxes) == 1
+    np.testing.assert_array_equal(cached.u, fetched.u)
+    np.testing.assert_array_equal(cached.v, fetched.v)
+    np.testing.assert_allclose(cached.length, fetched.length)
+
+
+def test_crop_graph_keeps_edges_touching_bbox(tmp_path, overpass):
+    road = load(tmp_path, overpass, (22.30, 114.10, 22.35, 114.15))
+    cropped = crop_graph(road, 22.3151, 114.1151, 22.3349, 114.1349)
+
+    assert 0 < cropped.num_edges < road.num_edges
+
+
+def test_evicts_least_recently_used(tmp_path, overpass):
+    cache = NetworkCache(str(tmp_path / 'cache'))
+
+    def fetch(*bbox):
+        return RoadGraph.load(str(tmp_path / 'road.npz'))
+
+    load(tmp_path, overpass, (22.31, 114.16, 22.34, 114.19)).save(str(tmp_path / 'road.npz'))
+    cache.get(22.31, 114.26, 22.34, 114.29, fetch)
+    cache.get(22.31, 114.36, 22.34, 114.39, fetch)
+    index = cache._read_index()
+    # Room for the last two networks only
+    cache.max_bytes = sum(sorted(entry['bytes'] for entry in index.values())[-2:])
+    cache.get(22.31, 114.46, 22.34, 114.49, fetch)
+
+    names = set(cache._read_index())
+    assert len(names) == 2
+    assert all(name.endswith('.npz') for name in names)
+    assert set(p.name for p in (tmp_path / 'cache').glob('*.npz')) == names
+
+
+def _put_tiles(folder, road_path, cols):
+    cache = NetworkCache(folder)
+    road = RoadGraph.load(road_path)
+    for col in cols:
+        cache.put((col, 0, col, 0), 'highway', road)
+
+
+def test_processes_sharing_a_store_keep_every_entry(tmp_path, overpass):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('needs fork to share the imported package with the workers')
+    road_path = str(tmp_path / 'road.npz')
+    load(tmp_path, overpass, (22.31, 114.16, 22.34, 114.19)).save(road_path)
+    folder = str(tmp_path / 'shared')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_put_tiles, args=(folder, road_path, range(k * 20, k * 20 + 20)))
+               for k in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert len(NetworkCache(folder)._read_index()) == 80
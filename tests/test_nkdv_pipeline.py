@@ -0,0 +1,74 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from fast_density_analysis import nkdv_pipeline
+from fast_density_analysis.nkdv import NKDV
+
+
+class Feedback:
+    def __init__(self):
+        self.messages = []
+
+    def pushInfo(self, message):
+        self.messages.append(message)
+
+
+def grid(lon, lat, n=5, step=0.002):
+    """Road lines of an n x n grid of streets step degrees apart."""
+    lines = []
+    for k in range(n):
+        lines.append(shapely.LineString([(lon, lat + k * step), (lon + (n - 1) * step, lat + k * step)]))
+        lines.append(shapely.LineString([(lon + k * step, lat), (lon + k * step, lat + (n - 1) * step)]))
+    return lines
+
+
+# Two clusters of points some 50 km apart
+POINTS = [(114.003, 22.303), (114.004, 22.304), (114.503, 22.303), (114.505, 22.305)]
+
+
+def run(tmp_path, network, feedback):
+    return nkdv_pipeline.run_nkdv(POINTS, str(tmp_path / 'run'), str(tmp_path / 'out.gpkg'), feedback,
+                                  bandwidth=300, lixel_length=50, network=network, reuse_stages=False,
+                                  cluster_gap=2000, cluster_workers=2)
+
+
+def test_cluster_without_roads_is_left_out(tmp_path):
+    network = gpd.GeoSeries(grid(114.0, 22.3), crs='epsg:4326')
+    feedback = Feedback()
+
+    lixels = run(tmp_path, network, feedback)
+
+    assert len(lixels) > 0 and lixels['value'].max() > 0
+    assert any(m.startswith('[cluster 1] ') and 'left out' in m for m in feedback.messages)
+    assert len(gpd.read_file(tmp_path / 'out.gpkg')) == len(lixels)
+
+
+def test_failing_kernel_writes_zero_density(tmp_path, monkeypatch):
+    network = gpd.GeoSeries(grid(114.0, 22.3) + grid(114.5, 22.3), crs='epsg:4326')
+    compute_csr = NKDV.compute_csr
+
+    def failing_compute_csr(self, *args):
+        if 'cluster_1' in args[-1]:
+            raise RuntimeError('kernel failed')
+        return compute_csr(self, *args)
+
+    monkeypatch.setattr(NKDV, 'compute_csr', failing_compute_csr)
+    feedback = Feedback()
+
+    lixels = run(tmp_path, network, feedback)
+
+    # The grids are apart, so the lixels east of the middle are cluster 1's
+    east = lixels.to_crs('epsg:4326').bounds['minx'].to_numpy() > 114.25
+    assert east.any() and (~east).any()
+    np.testing.assert_array_equal(lixels['value'].to_numpy()[east], 0)
+    assert lixels['value'].to_numpy()[~east].max() > 0
+    assert any(m.startswith('[cluster 1] ') and 'zero density' in m for m in feedback.messages)
+
+
+def test_every_cluster_failing_raises(tmp_path):
+    network = gpd.GeoSeries(grid(120.0, 30.0), crs='epsg:4326')
+
+    with pytest.raises(ValueError):
+        run(tmp_path, network, Feedback())
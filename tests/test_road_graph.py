@@ -0,0 +1,114 @@
+import networkx as nx
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from fast_density_analysis.road_graph import RoadGraph
+
+CRS = 'epsg:32650'
+
+
+def square():
+    """
+    Roads 0-1-2-3 along three sides of a 100 m square, a bent road 0-2
+    across it and a separate road 4-5, given in no order nor orientation.
+    """
+    x = [0.0, 100.0, 100.0, 0.0, 500.0, 600.0]
+    y = [0.0, 0.0, 100.0, 100.0, 0.0, 0.0]
+    u = [1, 2, 3, 2, 5]
+    v = [0, 1, 2, 0, 4]
+    geometries = [shapely.LineString([(x[a], y[a]), (x[b], y[b])]) for a, b in zip(u, v)]
+    # 0-2 bends through (0, 50)
+    geometries[3] = shapely.LineString([(100, 100), (0, 50), (0, 0)])
+    return RoadGraph.from_edges(x, y, u, v, geometries, CRS)
+
+
+def test_from_edges_sorts_and_orients_edges():
+    road = square()
+
+    np.testing.assert_array_equal(road.u, [0, 0, 1, 2, 4])
+    np.testing.assert_array_equal(road.v, [1, 2, 2, 3, 5])
+    # Every geometry starts at its u node
+    start = shapely.get_coordinates(shapely.get_point(road.geometries, 0))
+    np.testing.assert_allclose(start, np.column_stack((road.x[road.u], road.y[road.u])))
+    np.testing.assert_allclose(road.length, [100, 50 + np.hypot(100, 50), 100, 100, 100])
+    np.testing.assert_allclose(road.coords[road.coord_ptr[1]:road.coord_ptr[2]], [(0, 0), (0, 50), (100, 100)])
+
+
+def test_subgraph_renumbers_nodes_and_keeps_geometry():
+    road = square()
+    nodes = np.zeros(road.num_nodes, dtype=bool)
+    nodes[4] = True
+    sub = road.subgraph(nodes, [False, True, False, True, False])
+
+    # Nodes 0, 2, 3 of the edges and node 4, in their order
+    np.testing.assert_array_equal(sub.x, [0, 100, 0, 500])
+    np.testing.assert_array_equal(sub.u, [0, 1])
+    np.testing.assert_array_equal(sub.v, [1, 2])
+    np.testing.assert_allclose(sub.length, road.length[[1, 3]])
+    assert shapely.equals(sub.geometries, road.geometries[[1, 3]]).all()
+
+
+def test_point_offsets_are_sorted_per_edge():
+    road = square()
+    point_ptr, points = road.point_offsets([3, 0, 3, 0, 2], [70.0, 20.0, 10.0, 5.0, 50.0])
+
+    np.testing.assert_array_equal(point_ptr, [0, 2, 2, 3, 5, 5])
+    np.testing.assert_array_equal(points, [5, 20, 50, 10, 70])
+
+
+def test_point_distances_and_components():
+    road = square()
+    # One point 20 m from node 0 along 0-1
+    point_ptr, points = road.point_offsets([0], [20.0])
+
+    distances = road.point_distances(point_ptr, points, limit=300)
+
+    # Node 2 is nearer through 1 (80 + 100) than along the bent road from 0
+    np.testing.assert_allclose(distances[:4], [20, 80, 180, 280])
+    assert np.isinf(distances[4:]).all()
+    labels = road.components()
+    assert len(set(labels[:4])) == 1 and labels[4] == labels[5] != labels[0]
+
+    assert np.isinf(road.point_distances(point_ptr, points, limit=100)[[2, 3]]).all()
+
+
+def test_nodes_inside_wgs84_bbox():
+    road = square()
+    lon, lat = Transformer.from_crs(CRS, 'epsg:4326', always_xy=True).transform([50, 550], [50, 50])
+
+    inside = road.nodes_inside(lon[0] - 0.001, lat[0] - 0.001, lon[0] + 0.001, lat[0] + 0.001)
+
+    np.testing.assert_array_equal(inside, [True, True, True, True, False, False])
+
+
+def test_save_load_round_trip(tmp_path):
+    road = square()
+    road.save(str(tmp_path / 'road.npz'))
+    loaded = RoadGraph.load(str(tmp_path / 'road.npz'))
+
+    for name in ('x', 'y', 'indptr', 'indices', 'length', 'coords', 'coord_ptr'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(road, name))
+    assert loaded.crs == road.crs
+    assert shapely.equals(loaded.geometries, road.geometries).all()
+
+
+def test_from_osmnx_keeps_the_edge_networkx_keeps():
+    graph = nx.MultiDiGraph(crs=CRS)
+    for n, (x, y) in {10: (0, 0), 20: (100, 0), 30: (100, 100)}.items():
+        graph.add_node(n, x=x, y=y)
+    straight = shapely.LineString([(0, 0), (100, 0)])
+    bent = shapely.LineString([(100, 0), (50, 30), (0, 0)])
+    graph.add_edge(10, 20, 0, geometry=straight)
+    graph.add_edge(20, 10, 0, geometry=straight.reverse())
+    graph.add_edge(20, 10, 1, geometry=bent)
+    graph.add_edge(20, 30, 0, geometry=shapely.LineString([(100, 0), (100, 100)]))
+
+    road = RoadGraph.from_osmnx(graph)
+
+    simple = nx.Graph(graph.to_undirected())
+    assert road.num_edges == simple.number_of_edges() == 2
+    # Oriented from node 10, the first node
+    kept = simple.edges[10, 20]['geometry']
+    assert shapely.equals(road.geometries[0], kept)
+    np.testing.assert_allclose(road.coords[road.coord_ptr[0]], (0, 0))
@@ -0,0 +1,80 @@
+"""
+The Python NKDV engine against the native method-3 engine.
+
+The native library does not run on the platforms the tests run on, so the
+expected densities are worked out by hand with the native kernel_value:
+with d the network distance and b the bandwidth, type 1 is 1 - d/b, type 2
+is 1 - d^2/b^2 and type 3 is (1 - d^2/b^2)^2, all 0 from d >= b, and the
+native engine writes the unnormalized sum over the points for every lixel.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+from fast_density_analysis.nkdv.sparse_nkdv import Network, compute_density, compute_nkdv, format_result
+
+NATIVE_KERNELS = {
+    1: lambda d, b: 1 - d / b,
+    2: lambda d, b: 1 - d ** 2 / b ** 2,
+    3: lambda d, b: (1 - d ** 2 / b ** 2) ** 2,
+}
+
+
+def _expected(distances, kernel_type, bandwidth):
+    d = np.asarray(distances, dtype=float)
+    return np.where(d < bandwidth, NATIVE_KERNELS[kernel_type](d, bandwidth), 0.0)
+
+
+@pytest.fixture
+def triangle():
+    # Edges 0-1 (100 m), 1-2 (50 m) and 2-0 (40 m), in the edge order of the
+    # native network file, with one point 30 m from node 0 along edge 0-1
+    return Network(3, [0, 1, 2], [1, 2, 0], [100.0, 50.0, 40.0], [0, 1, 1, 1], [30.0], 25)
+
+
+def test_lixels_follow_the_native_layout(triangle):
+    assert triangle.lixel_edge.tolist() == [0, 0, 0, 0, 1, 1, 2, 2]
+    assert triangle.lixel_pos.tolist() == [12.5, 37.5, 62.5, 87.5, 12.5, 37.5, 12.5, 32.5]
+
+
+@pytest.mark.parametrize('kernel_type', [1, 2, 3])
+def test_density_matches_native_kernels(triangle, kernel_type):
+    bandwidth = 120.0
+    # Along edge 0-1 directly, along 1-2 through node 1 (70 + t) or through
+    # nodes 0 and 2 (30 + 40 + 50 - t), along 2-0 through node 0 (30 + 40 - t)
+    distances = [17.5, 7.5, 32.5, 57.5, 70 + 12.5, 30 + 40 + 50 - 37.5, 30 + 40 - 12.5, 30 + 40 - 32.5]
+    density = compute_density(triangle, kernel_type, bandwidth)
+    assert np.allclose(density, _expected(distances, kernel_type, bandwidth))
+
+
+def test_several_bandwidths_match_separate_runs(triangle):
+    both = compute_density(triangle, 2, [40.0, 80.0])
+    assert both.shape == (8, 2)
+    assert np.allclose(both[:, 0], compute_density(triangle, 2, 40.0))
+    assert np.allclose(both[:, 1], compute_density(triangle, 2, 80.0))
+
+
+def test_points_add_up(triangle):
+    twice = Network(3, [0, 1, 2], [1, 2, 0], [100.0, 50.0, 40.0], [0, 2, 2, 2], [30.0, 30.0], 25)
+    assert np.allclose(compute_density(twice, 2, 80.0), 2 * compute_density(triangle, 2, 80.0))
+
+
+def test_gaussian_kernel_is_not_supported(triangle):
+    # The native type 0 is an unbounded Gaussian, which a search bounded by
+    # the bandwidth cannot compute
+    with pytest.raises(ValueError):
+        compute_density(triangle, 0, 80.0)
+
+
+def test_compute_nkdv_reads_and_writes_the_native_formats(tmp_path, triangle):
+    path = tmp_path / 'network.txt'
+    path.write_text('3 3\n0 1 100 1 30\n1 2 50 0\n2 0 40 0\n')
+    args = [str(a).encode('ascii') for a in (0, path, 'out', 3, 25, 2, 80)]
+    result = compute_nkdv(args)
+    assert result == format_result(triangle, compute_density(triangle, 2, 80.0))
+    lines = result.splitlines()
+    assert lines[0] == '8'
+    u, v, position, value = lines[1].split()
+    assert (u, v, float(position)) == ('0', '1', 12.5)
+    assert float(value) == pytest.approx(1 - 17.5 ** 2 / 80 ** 2)
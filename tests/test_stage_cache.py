@@ -0,0 +1,89 @@
+import numpy as np
+import shapely
+
+from fast_density_analysis import nkdv_pipeline
+from fast_density_analysis.road_graph import RoadGraph
+from fast_density_analysis.stage_cache import StageCache, stage_key
+
+BOUND = (114.0, 22.0, 114.1, 22.1)
+
+
+def test_stage_key_follows_inputs():
+    points = np.array([[114.0, 22.0], [114.1, 22.1]])
+
+    assert stage_key('overpass', None, 5.0) == stage_key('overpass', None, 5.0)
+    assert stage_key('overpass', None, 5.0) != stage_key('overpass', None, 5)
+    assert stage_key(points) == stage_key(points.copy())
+    assert stage_key(points) != stage_key(points.astype(np.float32))
+    assert stage_key(points) != stage_key(points.reshape(-1))
+    wkb = shapely.to_wkb(shapely.points(points))
+    assert stage_key(wkb) == stage_key(wkb.copy())
+    assert stage_key(wkb) != stage_key(wkb[::-1])
+
+
+def test_stages_round_trip(tmp_path):
+    stages = StageCache(str(tmp_path))
+    stages.save_network('source', BOUND, x=np.arange(3.0))
+    stages.save('points', 'key', point_ptr=np.array([0, 2]), points=np.array([1.0, 2.0]))
+
+    again = StageCache(str(tmp_path))
+    network = again.load_network('source', BOUND)
+    np.testing.assert_array_equal(network['x'], np.arange(3.0))
+    np.testing.assert_array_equal(again.load('points', 'key')['points'], [1.0, 2.0])
+    assert again.load('points', 'other') is None
+
+
+def test_network_found_by_source_and_covering_bound(tmp_path):
+    stages = StageCache(str(tmp_path))
+    stages.save_network('source', BOUND, x=np.arange(3.0))
+
+    assert StageCache(str(tmp_path)).load_network('source', (114.02, 22.02, 114.08, 22.08)) is not None
+    assert StageCache(str(tmp_path)).load_network('source', (113.9, 22.0, 114.1, 22.1)) is None
+    assert StageCache(str(tmp_path)).load_network('other', BOUND) is None
+
+
+def test_new_network_removes_stages_of_the_previous(tmp_path):
+    stages = StageCache(str(tmp_path))
+    stages.save_network('source', BOUND, x=np.arange(3.0))
+    stages.save('lixels', 'key', offsets=np.arange(2))
+    stages.save_network('source', (115.0, 22.0, 115.1, 22.1), x=np.arange(4.0))
+
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert names == [stages.network_key + '_graph.npz']
+    assert StageCache(str(tmp_path)).load_network('source', BOUND) is None
+
+
+def test_partial_stage_is_recomputed(tmp_path):
+    stages = StageCache(str(tmp_path))
+    stages.save_network('source', BOUND, x=np.arange(3.0))
+    stages.save('points', 'key', points=np.arange(1000.0))
+    path = tmp_path / '{}_points_key.npz'.format(stages.network_key)
+    path.write_bytes(path.read_bytes()[:100])
+
+    assert stages.load('points', 'key') is None
+
+
+def test_without_folder_every_stage_is_computed():
+    stages = StageCache(None)
+    stages.save_network('source', BOUND, x=np.arange(3.0))
+    stages.save('points', 'key', points=np.arange(3.0))
+
+    assert stages.load_network('source', BOUND) is None
+    assert stages.load('points', 'key') is None
+
+
+def test_cached_network_builds_once(tmp_path):
+    road = RoadGraph.from_edges([0.0, 100.0], [0.0, 0.0], [0], [1], [shapely.LineString([(0, 0), (100, 0)])],
+                                'epsg:32650')
+    builds = []
+
+    def build():
+        builds.append(1)
+        return road
+
+    first, cached = nkdv_pipeline.cached_network(StageCache(str(tmp_path)), 'source', BOUND, build)
+    assert not cached
+    second, cached = nkdv_pipeline.cached_network(StageCache(str(tmp_path)), 'source', BOUND, build)
+    assert cached and len(builds) == 1
+    np.testing.assert_array_equal(second.coords, first.coords)
+    assert second.crs == first.crs
@@ -2,6 +2,7 @@
 
 from .bearing import add_edge_bearings
 from .bearing import orientation_entropy
+from .distance import edge_index
 from .distance import k_shortest_paths
 from .distance import nearest_edges
 from .distance import nearest_nodes
@@ -21,10 +22,12 @@ from .geometries import geometries_from_polygon
 from .geometries import geometries_from_xml
 from .graph import graph_from_address
 from .graph import graph_from_bbox
+from .graph import graph_from_extract
 from .graph import graph_from_place
 from .graph import graph_from_point
 from .graph import graph_from_polygon
 from .graph import graph_from_xml
+from .graph import graph_from_xml_stream
 from .io import load_graphml
 from .io import save_graph_geopackage
 from .io import save_graph_shapefile
@@ -2,12 +2,13 @@
 
 import itertools
 import multiprocessing as mp
+import weakref
 from warnings import warn
 
 import networkx as nx
 import numpy as np
 import pandas as pd
-from shapely.geometry import Point
+import shapely
 from shapely.strtree import STRtree
 
 from . import projection
@@ -29,6 +30,9 @@ except ImportError:  # pragma: no cover
 
 EARTH_RADIUS_M = 6_371_009
 
+# edge indexes built so far, by graph
+_edge_indexes = weakref.WeakKeyDictionary()
+
 
 def great_circle_vec(lat1, lng1, lat2, lng2, earth_radius=EARTH_RADIUS_M):
     """
@@ -170,6 +174,190 @@ def add_edge_lengths(G, precision=None, edges=None):
     return G
 
 
+def graph_version(G):
+    """
+    Return a cheap fingerprint of a graph's structure.
+
+    An edge index built for a graph is reused as long as the graph's node and
+    edge counts have not changed. Editing geometries in place does not change
+    the fingerprint: call `edge_index` with `rebuild=True` after doing so.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+
+    Returns
+    -------
+    version : tuple
+        (number of nodes, number of edges)
+    """
+    return (G.number_of_nodes(), G.number_of_edges())
+
+
+class EdgeIndex:
+    """
+    Spatial index of a graph's edges and nodes.
+
+    Holds the edge (u, v, key) labels and geometries with an STRtree over
+    them, and the node IDs and coordinates with a k-d tree or ball tree. The
+    edge and node halves are each built on first use, so node searches never
+    touch the edges and vice versa. Get it with `edge_index`, which caches it
+    per graph.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        graph to index, read for its edges or nodes when first needed
+    """
+
+    def __init__(self, G):
+        self._edges = None
+        self._geometries = None
+        self._tree = None
+        self._nodes = None
+        self._node_xy = None
+        self._node_tree = None
+        self.projected = projection.is_projected(G.graph["crs"])
+        self.version = graph_version(G)
+        # weak, as indexes are cached by graph and must not keep it alive
+        self._graph = weakref.ref(G)
+
+    def _source_graph(self):
+        G = self._graph()
+        if G is None:  # pragma: no cover
+            raise ValueError("The graph of this index no longer exists")
+        return G
+
+    @property
+    def edges(self):
+        """(u, v, key) label of every edge."""
+        if self._edges is None:
+            self._read_edges()
+        return self._edges
+
+    @property
+    def geometries(self):
+        """shapely geometry of every edge."""
+        if self._geometries is None:
+            self._read_edges()
+        return self._geometries
+
+    def _read_edges(self):
+        geoms = utils_graph.graph_to_gdfs(self._source_graph(), nodes=False)["geometry"]
+        self._edges = geoms.index
+        self._geometries = np.asarray(geoms.values, dtype=object)
+
+    @property
+    def tree(self):
+        """STRtree of the edge geometries."""
+        if self._tree is None:
+            self._tree = STRtree(self.geometries)
+        return self._tree
+
+    @property
+    def nodes(self):
+        """ID of every node."""
+        if self._nodes is None:
+            self._read_nodes()
+        return self._nodes
+
+    @property
+    def node_xy(self):
+        """(n, 2) array of node x, y coordinates."""
+        if self._node_xy is None:
+            self._read_nodes()
+        return self._node_xy
+
+    def _read_nodes(self):
+        nodes = utils_graph.graph_to_gdfs(self._source_graph(), edges=False, node_geometry=False)[["x", "y"]]
+        self._nodes = nodes.index
+        self._node_xy = nodes.to_numpy(dtype=float)
+
+    @property
+    def node_tree(self):
+        """k-d tree (projected) or haversine ball tree (unprojected) of the nodes."""
+        if self._node_tree is None:
+            if self.projected:
+                if cKDTree is None:  # pragma: no cover
+                    raise ImportError("scipy must be installed to search a projected graph")
+                self._node_tree = cKDTree(self.node_xy)
+            else:
+                if BallTree is None:  # pragma: no cover
+                    raise ImportError("scikit-learn must be installed to search an unprojected graph")
+                # haversine requires lat, lng coords in radians
+                self._node_tree = BallTree(np.deg2rad(self.node_xy[:, ::-1]), metric="haversine")
+        return self._node_tree
+
+    def query_edges(self, X, Y):
+        """
+        Find the position of the nearest edge to each point.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            points' x coordinates, in same CRS/units as the graph
+        Y : numpy.ndarray
+            points' y coordinates, in same CRS/units as the graph
+
+        Returns
+        -------
+        pos, dist : tuple
+            positions into `edges` and `geometries`, and distances
+        """
+        points = shapely.points(X, Y)
+        pos, dist = self.tree.query_nearest(points, all_matches=False, return_distance=True)
+        return pos[1], dist
+
+    def query_nodes(self, X, Y):
+        """
+        Find the position of the nearest node to each point.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            points' x coordinates, in same CRS/units as the graph
+        Y : numpy.ndarray
+            points' y coordinates, in same CRS/units as the graph
+
+        Returns
+        -------
+        pos, dist : tuple
+            positions into `nodes`, and distances (meters if unprojected)
+        """
+        if self.projected:
+            dist, pos = self.node_tree.query(np.array([X, Y]).T, k=1)
+            return pos, dist
+        dist, pos = self.node_tree.query(np.deg2rad(np.array([Y, X]).T), k=1)
+        return pos[:, 0], dist[:, 0] * EARTH_RADIUS_M  # convert radians -> meters
+
+
+def edge_index(G, rebuild=False):
+    """
+    Get the spatial index of a graph's edges and nodes.
+
+    The index is built on first use and cached for the graph's lifetime, so
+    repeated nearest node/edge searches on the same graph reuse it. It is
+    rebuilt when the graph's `graph_version` changes or `rebuild` is True.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+    rebuild : bool
+        if True, discard any cached index
+
+    Returns
+    -------
+    EdgeIndex
+    """
+    index = None if rebuild else _edge_indexes.get(G)
+    if index is None or index.version != graph_version(G):
+        index = EdgeIndex(G)
+        _edge_indexes[G] = index
+    return index
+
+
 def nearest_nodes(G, X, Y, return_dist=False):
     """
     Find the nearest node to a point or to each of several points.
@@ -212,25 +400,10 @@ def nearest_nodes(G, X, Y, return_dist=False):
 
     if np.isnan(X).any() or np.isnan(Y).any():  # pragma: no cover
         raise ValueError("`X` and `Y` cannot contain nulls")
-    nodes = utils_graph.graph_to_gdfs(G, edges=False, node_geometry=False)[["x", "y"]]
-
-    if projection.is_projected(G.graph["crs"]):
-        # if projected, use k-d tree for euclidean nearest-neighbor search
-        if cKDTree is None:  # pragma: no cover
-            raise ImportError("scipy must be installed to search a projected graph")
-        dist, pos = cKDTree(nodes).query(np.array([X, Y]).T, k=1)
-        nn = nodes.index[pos]
-
-    else:
-        # if unprojected, use ball tree for haversine nearest-neighbor search
-        if BallTree is None:  # pragma: no cover
-            raise ImportError("scikit-learn must be installed to search an unprojected graph")
-        # haversine requires lat, lng coords in radians
-        nodes_rad = np.deg2rad(nodes[["y", "x"]])
-        points_rad = np.deg2rad(np.array([Y, X]).T)
-        dist, pos = BallTree(nodes_rad, metric="haversine").query(points_rad, k=1)
-        dist = dist[:, 0] * EARTH_RADIUS_M  # convert radians -> meters
-        nn = nodes.index[pos[:, 0]]
+    # k-d tree (projected) or haversine ball tree (unprojected), cached per graph
+    index = edge_index(G)
+    pos, dist = index.query_nodes(np.asarray(X), np.asarray(Y))
+    nn = index.nodes[pos]
 
     # convert results to correct types for return
     nn = nn.tolist()
@@ -297,24 +470,16 @@ def nearest_edges(G, X, Y, interpolate=None, return_dist=False):
 
     if np.isnan(X).any() or np.isnan(Y).any():  # pragma: no cover
         raise ValueError("`X` and `Y` cannot contain nulls")
-    geoms = utils_graph.graph_to_gdfs(G, nodes=False)["geometry"]
-
     # if no interpolation distance was provided
     if interpolate is None:
-        # build the r-tree spatial index by position for subsequent iloc
-        rtree = STRtree(geoms)
-
-        # use r-tree to find each point's nearest neighbor and distance
-        points = [Point(xy) for xy in zip(X, Y)]
-        pos, dist = rtree.query_nearest(points, all_matches=False, return_distance=True)
-
-        # if user passed X/Y lists, the 2nd subarray contains geom indices
-        if len(pos.shape) > 1:
-            pos = pos[1]
-        ne = geoms.iloc[pos].index
+        # use the graph's cached r-tree to find each point's nearest neighbor
+        index = edge_index(G)
+        pos, dist = index.query_edges(np.asarray(X), np.asarray(Y))
+        ne = index.edges[pos]
 
     # otherwise, if interpolation distance was provided
     else:
+        geoms = utils_graph.graph_to_gdfs(G, nodes=False)["geometry"]
         # interpolate points along edges to index with k-d tree or ball tree
         uvk_xy = []
         for uvk, geom in zip(geoms.index, geoms.values):
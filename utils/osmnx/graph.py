@@ -4,6 +4,7 @@ import itertools
 from warnings import warn
 
 import networkx as nx
+import numpy as np
 from shapely.geometry import MultiPolygon
 from shapely.geometry import Polygon
 
@@ -511,11 +512,11 @@ def graph_from_xml(filepath, bidirectional=False, simplify=True, retain_all=Fals
     -------
     G : networkx.MultiDiGraph
     """
-    # transmogrify file of OSM XML data into JSON
-    response_jsons = [osm_xml._overpass_json_from_file(filepath)]
+    # stream the file of OSM XML data into compact arrays
+    osm = osm_xml._osm_arrays_from_file(filepath)
 
-    # create graph using this response JSON
-    G = _create_graph(response_jsons, bidirectional=bidirectional, retain_all=retain_all)
+    # create graph using these arrays
+    G = _create_graph_from_arrays(osm, bidirectional=bidirectional, retain_all=retain_all)
 
     # simplify the graph topology as the last step
     if simplify:
@@ -525,6 +526,82 @@ def graph_from_xml(filepath, bidirectional=False, simplify=True, retain_all=Fals
     return G
 
 
+def graph_from_xml_stream(chunks, bidirectional=False, simplify=True, retain_all=False):
+    """
+    Create a graph from OSM XML data parsed incrementally as it arrives.
+
+    Parameters
+    ----------
+    chunks : iterable
+        bytes chunks of an OSM XML document, e.g. a streamed HTTP response
+    bidirectional : bool
+        if True, create bi-directional edges for one-way streets
+    simplify : bool
+        if True, simplify graph topology with the `simplify_graph` function
+    retain_all : bool
+        if True, return the entire graph even if it is not connected.
+        otherwise, retain only the largest weakly connected component.
+
+    Returns
+    -------
+    G : networkx.MultiDiGraph
+    """
+    osm = osm_xml._osm_arrays_from_chunks(chunks)
+    G = _create_graph_from_arrays(osm, bidirectional=bidirectional, retain_all=retain_all)
+
+    if simplify:
+        G = simplification.simplify_graph(G)
+
+    utils.log(f"graph_from_xml_stream returned graph with {len(G)} nodes and {len(G.edges)} edges")
+    return G
+
+
+def graph_from_extract(
+    filepath, north, south, east, west, tag="highway", bidirectional=False, simplify=True, retain_all=False
+):
+    """
+    Create a graph from the ways of a local OSM extract touching a bounding box.
+
+    Like an Overpass bounding box query, every way carrying `tag` with a node
+    inside the bounding box is kept whole. The extract is streamed in two
+    passes instead of being loaded, see `osm_xml._overpass_json_from_extract`.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to a .osm, .osm.bz2 or .osm.pbf extract (.pbf requires pyosmium)
+    north : float
+        northern latitude of bounding box
+    south : float
+        southern latitude of bounding box
+    east : float
+        eastern longitude of bounding box
+    west : float
+        western longitude of bounding box
+    tag : string
+        key of the tag ways must carry to be part of the graph
+    bidirectional : bool
+        if True, create bi-directional edges for one-way streets
+    simplify : bool
+        if True, simplify graph topology with the `simplify_graph` function
+    retain_all : bool
+        if True, return the entire graph even if it is not connected.
+        otherwise, retain only the largest weakly connected component.
+
+    Returns
+    -------
+    G : networkx.MultiDiGraph
+    """
+    response_jsons = [osm_xml._overpass_json_from_extract(filepath, north, south, east, west, tag)]
+    G = _create_graph(response_jsons, bidirectional=bidirectional, retain_all=retain_all)
+
+    if simplify:
+        G = simplification.simplify_graph(G)
+
+    utils.log(f"graph_from_extract returned graph with {len(G)} nodes and {len(G.edges)} edges")
+    return G
+
+
 def _create_graph(response_jsons, retain_all=False, bidirectional=False):
     """
     Create a networkx MultiDiGraph from Overpass API responses.
@@ -554,14 +631,6 @@ def _create_graph(response_jsons, retain_all=False, bidirectional=False):
         msg = "There are no data elements in the server response. Check log and query location/filters."
         raise EmptyOverpassResponse(msg)
 
-    # create the graph as a MultiDiGraph and set its meta-attributes
-    metadata = {
-        "created_date": utils.ts(),
-        "created_with": f"OSMnx {__version__}",
-        "crs": settings.default_crs,
-    }
-    G = nx.MultiDiGraph(**metadata)
-
     # extract nodes and paths from the downloaded osm data
     nodes = {}
     paths = {}
@@ -570,12 +639,88 @@ def _create_graph(response_jsons, retain_all=False, bidirectional=False):
         nodes.update(nodes_temp)
         paths.update(paths_temp)
 
+    return _build_graph(nodes.items(), paths.values(), retain_all, bidirectional)
+
+
+def _create_graph_from_arrays(osm, retain_all=False, bidirectional=False):
+    """
+    Create a networkx MultiDiGraph from OSM data streamed into arrays.
+
+    Parameters
+    ----------
+    osm : osm_xml._OSMArrayHandler
+        node and way arrays of the OSM data
+    retain_all : bool
+        if True, return the entire graph even if it is not connected.
+        otherwise, retain only the largest weakly connected component.
+    bidirectional : bool
+        if True, create bi-directional edges for one-way streets
+
+    Returns
+    -------
+    G : networkx.MultiDiGraph
+    """
+    utils.log("Creating graph from OSM data arrays...")
+
+    if not len(osm.node_ids) and not len(osm.way_ids):  # pragma: no cover
+        msg = "There are no data elements in the OSM data. Check the file and its filters."
+        raise EmptyOverpassResponse(msg)
+
+    node_tags = osm.node_tags
+    nodes = (
+        (node, dict({"y": lat, "x": lon}, **node_tags.get(node, {})))
+        for node, lat, lon in zip(osm.node_ids, osm.lats, osm.lons)
+    )
+
+    # drop consecutive duplicate node references, as _convert_path does
+    refs = np.frombuffer(osm.way_refs, dtype=np.int64)
+    keep = np.ones(len(refs), dtype=bool)
+    keep[1:] = refs[1:] != refs[:-1]
+    way_ptr = np.frombuffer(osm.way_ptr, dtype=np.int64)
+    keep[way_ptr[:-1][way_ptr[:-1] < len(refs)]] = True
+    kept_ptr = np.concatenate(([0], np.cumsum(keep)))[way_ptr]
+    refs = refs[keep].tolist()
+    paths = (
+        dict({"osmid": osmid, "nodes": refs[start:end]}, **tags)
+        for osmid, start, end, tags in zip(osm.way_ids, kept_ptr[:-1].tolist(), kept_ptr[1:].tolist(), osm.way_tags)
+    )
+
+    return _build_graph(nodes, paths, retain_all, bidirectional)
+
+
+def _build_graph(nodes, paths, retain_all, bidirectional):
+    """
+    Create a networkx MultiDiGraph from OSM nodes and paths.
+
+    Parameters
+    ----------
+    nodes : iterable
+        (osmid, attributes) pairs of the nodes
+    paths : iterable
+        path dicts of the ways, as returned by `_convert_path`
+    retain_all : bool
+        if True, return the entire graph even if it is not connected.
+        otherwise, retain only the largest weakly connected component.
+    bidirectional : bool
+        if True, create bi-directional edges for one-way streets
+
+    Returns
+    -------
+    G : networkx.MultiDiGraph
+    """
+    # create the graph as a MultiDiGraph and set its meta-attributes
+    metadata = {
+        "created_date": utils.ts(),
+        "created_with": f"OSMnx {__version__}",
+        "crs": settings.default_crs,
+    }
+    G = nx.MultiDiGraph(**metadata)
+
     # add each osm node to the graph
-    for node, data in nodes.items():
-        G.add_node(node, **data)
+    G.add_nodes_from(nodes)
 
     # add each osm way (ie, a path of edges) to the graph
-    _add_paths(G, paths.values(), bidirectional)
+    _add_paths(G, paths, bidirectional)
 
     # retain only the largest connected component if retain_all is False
     if not retain_all:
@@ -1,6 +1,7 @@
 """Read/write .osm formatted XML files."""
 import bz2
 import xml.sax
+from array import array
 from pathlib import Path
 from warnings import warn
 from xml.etree import ElementTree as etree
@@ -60,6 +61,113 @@ class _OSMContentHandler(xml.sax.handler.ContentHandler):
             self.object["elements"].append(self._element)
 
 
+class _OSMArrayHandler(xml.sax.handler.ContentHandler):
+    """
+    SAX content handler streaming OSM XML into compact arrays.
+
+    Unlike _OSMContentHandler, no per-element dicts are built: node ids and
+    coordinates and way ids and node references go straight into typed
+    arrays (way i references way_refs[way_ptr[i]:way_ptr[i + 1]]). Only the
+    tags in settings.useful_tags_node and settings.useful_tags_way are kept;
+    relations are skipped.
+    """
+
+    def __init__(self):
+        self.node_ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.node_tags = {}
+        self.way_ids = array("q")
+        self.way_ptr = array("q", [0])
+        self.way_refs = array("q")
+        self.way_tags = []
+        self._useful_node = frozenset(settings.useful_tags_node)
+        self._useful_way = frozenset(settings.useful_tags_way)
+        self._node = None
+        self._tags = None
+
+    def startElement(self, name, attrs):
+        if name == "nd":
+            if self._tags is not None:
+                self.way_refs.append(int(attrs["ref"]))
+
+        elif name == "node":
+            self._node = int(attrs["id"])
+            self.node_ids.append(self._node)
+            self.lats.append(float(attrs["lat"]))
+            self.lons.append(float(attrs["lon"]))
+
+        elif name == "tag":
+            key = attrs["k"]
+            if self._tags is not None:
+                if key in self._useful_way:
+                    self._tags[key] = attrs["v"]
+            elif self._node is not None and key in self._useful_node:
+                self.node_tags.setdefault(self._node, {})[key] = attrs["v"]
+
+        elif name == "way":
+            self.way_ids.append(int(attrs["id"]))
+            self._tags = {}
+
+    def endElement(self, name):
+        if name == "node":
+            self._node = None
+        elif name == "way":
+            self.way_ptr.append(len(self.way_refs))
+            self.way_tags.append(self._tags)
+            self._tags = None
+
+
+def _osm_arrays_from_file(filepath):
+    """
+    Stream OSM XML from file into compact arrays.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to file containing OSM XML data
+
+    Returns
+    -------
+    _OSMArrayHandler
+    """
+    with _opener(Path(filepath)) as f:
+        handler = _OSMArrayHandler()
+        xml.sax.parse(f, handler)
+        return handler
+
+
+def _osm_arrays_from_chunks(chunks):
+    """
+    Stream OSM XML arriving in chunks into compact arrays, parsing each chunk
+    as it comes.
+
+    Parameters
+    ----------
+    chunks : iterable
+        bytes chunks of an OSM XML document
+
+    Returns
+    -------
+    _OSMArrayHandler
+    """
+    handler = _OSMArrayHandler()
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return handler
+
+
+def _opener(filepath):
+    if filepath.suffix == ".bz2":
+        return bz2.BZ2File(filepath)
+    else:
+        # assume an unrecognized file extension is just XML
+        return filepath.open(mode="rb")
+
+
 def _overpass_json_from_file(filepath):
     """
     Read OSM XML from file and return Overpass-like JSON.
@@ -74,19 +182,164 @@ def _overpass_json_from_file(filepath):
     OSMContentHandler object
     """
 
-    def _opener(filepath):
-        if filepath.suffix == ".bz2":
-            return bz2.BZ2File(filepath)
-        else:
-            # assume an unrecognized file extension is just XML
-            return filepath.open(mode="rb")
-
     with _opener(Path(filepath)) as f:
         handler = _OSMContentHandler()
         xml.sax.parse(f, handler)
         return handler.object
 
 
+class _StopParsing(Exception):
+    """Raised by a SAX handler once it has seen everything it needs."""
+
+
+class _ExtractSelection:
+    """
+    Selection of the ways carrying a tag with at least one node inside a
+    bounding box, and of every node of those ways, built over two passes of
+    an OSM extract. Only the selection is held in memory.
+
+    The first pass records the ids of the nodes inside the bounding box and
+    then keeps the matching ways; it relies on nodes preceding ways, as they
+    do in sorted extracts. The second pass keeps the nodes of the kept ways.
+    """
+
+    def __init__(self, north, south, east, west, tag):
+        self.north, self.south, self.east, self.west = north, south, east, west
+        self.tag = tag
+        self.inside = set()
+        self.needed = set()
+        self.ways = []
+        self.nodes = []
+
+    def first_node(self, osmid, lat, lon):
+        if self.south <= lat <= self.north and self.west <= lon <= self.east:
+            self.inside.add(osmid)
+
+    def way(self, osmid, refs, tags):
+        if self.tag in tags and not self.inside.isdisjoint(refs):
+            self.ways.append({"type": "way", "id": osmid, "nodes": refs, "tags": tags})
+            self.needed.update(refs)
+
+    def second_node(self, osmid, lat, lon, tags):
+        self.nodes.append({"type": "node", "id": osmid, "lat": lat, "lon": lon, "tags": tags})
+
+    @property
+    def object(self):
+        return {"elements": self.nodes + self.ways}
+
+
+class _OSMExtractHandler(xml.sax.handler.ContentHandler):
+    """
+    SAX content handler feeding one pass of an OSM XML extract to an
+    _ExtractSelection. Tags are only collected for elements that may be kept.
+    """
+
+    def __init__(self, selection, first):
+        self._selection = selection
+        self._first = first
+        self._node = None
+        self._way = None
+
+    def startElement(self, name, attrs):
+        if name == "node":
+            osmid = int(attrs["id"])
+            if self._first:
+                self._selection.first_node(osmid, float(attrs["lat"]), float(attrs["lon"]))
+            elif osmid in self._selection.needed:
+                self._node = (osmid, float(attrs["lat"]), float(attrs["lon"]), {})
+
+        elif name == "way":
+            if not self._first:
+                # every node has been seen
+                raise _StopParsing
+            self._way = (int(attrs["id"]), [], {})
+
+        elif name == "nd" and self._way is not None:
+            self._way[1].append(int(attrs["ref"]))
+
+        elif name == "tag":
+            element = self._way if self._way is not None else self._node
+            if element is not None:
+                element[-1][attrs["k"]] = attrs["v"]
+
+    def endElement(self, name):
+        if name == "way" and self._way is not None:
+            self._selection.way(*self._way)
+            self._way = None
+        elif name == "node" and self._node is not None:
+            self._selection.second_node(*self._node)
+            self._node = None
+
+
+def _select_xml(filepath, selection):
+    for first in (True, False):
+        with _opener(filepath) as f:
+            try:
+                xml.sax.parse(f, _OSMExtractHandler(selection, first))
+            except _StopParsing:
+                pass
+
+
+def _select_pbf(filepath, selection):
+    try:
+        import osmium
+    except ImportError as e:  # pragma: no cover
+        msg = "Reading .pbf extracts requires the optional pyosmium package (pip install osmium)"
+        raise ImportError(msg) from e
+
+    class FirstPass(osmium.SimpleHandler):
+        def node(self, n):
+            selection.first_node(n.id, n.location.lat, n.location.lon)
+
+        def way(self, w):
+            if selection.tag in w.tags:
+                selection.way(w.id, [nd.ref for nd in w.nodes], {t.k: t.v for t in w.tags})
+
+    class SecondPass(osmium.SimpleHandler):
+        def node(self, n):
+            if n.id in selection.needed:
+                selection.second_node(n.id, n.location.lat, n.location.lon, {t.k: t.v for t in n.tags})
+
+    FirstPass().apply_file(str(filepath))
+    SecondPass().apply_file(str(filepath))
+
+
+def _overpass_json_from_extract(filepath, north, south, east, west, tag="highway"):
+    """
+    Read the ways tagged `tag` touching a bounding box, with all their nodes,
+    from a local OSM extract and return Overpass-like JSON.
+
+    The extract is streamed twice rather than loaded, so memory use follows
+    the size of the selection and not of the file.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        path to a .osm, .osm.bz2 or .osm.pbf extract (.pbf requires pyosmium)
+    north : float
+        northern latitude of bounding box
+    south : float
+        southern latitude of bounding box
+    east : float
+        eastern longitude of bounding box
+    west : float
+        western longitude of bounding box
+    tag : string
+        key of the tag selected ways must carry
+
+    Returns
+    -------
+    dict
+    """
+    filepath = Path(filepath)
+    selection = _ExtractSelection(north, south, east, west, tag)
+    if filepath.suffix == ".pbf":
+        _select_pbf(filepath, selection)
+    else:
+        _select_xml(filepath, selection)
+    return selection.object
+
+
 def save_graph_xml(
     data,
     filepath=None,
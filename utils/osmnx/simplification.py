@@ -4,6 +4,9 @@ import logging as lg
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
 from shapely.geometry import LineString
 from shapely.geometry import MultiPolygon
 from shapely.geometry import Point
@@ -13,6 +16,14 @@ from . import stats
 from . import utils
 from . import utils_graph
 
+# scipy is an optional dependency for clustering nodes with a KD-tree
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    from scipy.spatial import cKDTree
+except ImportError:  # pragma: no cover
+    cKDTree = None
+
 
 def _is_endpoint(G, node, strict=True):
     """
@@ -159,6 +170,57 @@ def _build_path(G, endpoint, endpoint_successor, endpoints):
     return path
 
 
+def _endpoints(G, strict=True):
+    """
+    Identify the nodes of a graph that are true endpoints of edges.
+
+    Applies the rules of `_is_endpoint` to every node at once: rules 1 to 3
+    are evaluated on arrays of the graph's edges, and only the nodes passing
+    them are checked for rule 4 in non-strict mode.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        input graph
+    strict : bool
+        if False, allow nodes to be end points even if they fail all other rules
+        but have edges with different OSM IDs
+
+    Returns
+    -------
+    endpoints : set
+    """
+    nodes = list(G.nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+    edges = np.array([(position[u], position[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    u, v = edges[:, 0], edges[:, 1]
+
+    out_degree = np.bincount(u, minlength=n)
+    in_degree = np.bincount(v, minlength=n)
+    degree = out_degree + in_degree
+    self_loop = np.bincount(u[u == v], minlength=n) > 0
+    # distinct (node, neighbor) pairs in either direction, coded as one integer
+    pairs = np.unique(np.concatenate((u * n + v, v * n + u)))
+    neighbors = np.bincount(pairs // n, minlength=n)
+
+    # rules 1, 2 and 3
+    is_endpoint = (
+        self_loop
+        | (out_degree == 0)
+        | (in_degree == 0)
+        | ~((neighbors == 2) & ((degree == 2) | (degree == 4)))
+    )
+    endpoints = {nodes[i] for i in np.flatnonzero(is_endpoint)}
+
+    # rule 4
+    if not strict:
+        endpoints.update(
+            nodes[i] for i in np.flatnonzero(~is_endpoint) if _is_endpoint(G, nodes[i], strict=False)
+        )
+    return endpoints
+
+
 def _get_paths_to_simplify(G, strict=True):
     """
     Generate all the paths to be simplified between endpoint nodes.
@@ -179,7 +241,7 @@ def _get_paths_to_simplify(G, strict=True):
     path_to_simplify : list
     """
     # first identify all the nodes that are endpoints
-    endpoints = set([n for n in G.nodes if _is_endpoint(G, n, strict=strict)])
+    endpoints = _endpoints(G, strict=strict)
     utils.log(f"Identified {len(endpoints)} edge endpoints")
 
     # for each endpoint node, look at each of its successor nodes
@@ -209,9 +271,10 @@ def _remove_rings(G):
     G : networkx.MultiDiGraph
         graph with self-contained rings removed
     """
+    endpoints = _endpoints(G)
     nodes_in_rings = set()
     for wcc in nx.weakly_connected_components(G):
-        if not any(_is_endpoint(G, n) for n in wcc):
+        if endpoints.isdisjoint(wcc):
             nodes_in_rings.update(wcc)
     G.remove_nodes_from(nodes_in_rings)
     return G
@@ -231,6 +294,10 @@ def simplify_graph(G, strict=True, remove_rings=True, track_merged=False):
     a `merged_edges` attribute that contains a list of all the (u, v) node
     pairs that were merged together.
 
+    The simplified graph is built anew from the nodes and edges it keeps
+    rather than by copying the input graph and removing nodes from it, and
+    the geometries of all simplified edges are created at once.
+
     Parameters
     ----------
     G : networkx.MultiDiGraph
@@ -260,12 +327,11 @@ def simplify_graph(G, strict=True, remove_rings=True, track_merged=False):
     # define edge segment attributes to sum upon edge simplification
     attrs_to_sum = {"length", "travel_time"}
 
-    # make a copy to not mutate original graph object caller passed in
-    G = G.copy()
     initial_node_count = len(G)
     initial_edge_count = len(G.edges)
-    all_nodes_to_remove = []
+    all_nodes_to_remove = set()
     all_edges_to_add = []
+    path_nodes = []
 
     # generate each path that needs to be simplified
     for path in _get_paths_to_simplify(G, strict=strict):
@@ -281,16 +347,15 @@ def simplify_graph(G, strict=True, remove_rings=True, track_merged=False):
             # there should rarely be multiple edges between interstitial nodes
             # usually happens if OSM has duplicate ways digitized for just one
             # street... we will keep only one of the edges (see below)
-            edge_count = G.number_of_edges(u, v)
-            if edge_count != 1:
-                utils.log(f"Found {edge_count} edges between {u} and {v} when simplifying")
+            edges = G[u][v]
+            if len(edges) != 1:
+                utils.log(f"Found {len(edges)} edges between {u} and {v} when simplifying")
 
             # get edge between these nodes: if multiple edges exist between
             # them (see above), we retain only one in the simplified graph
             # We can't assume that there exists an edge from u to v
-            # with key=0, so we get a list of all edges from u to v
-            # and just take the first one.
-            edge_data = list(G.get_edge_data(u, v).values())[0]
+            # with key=0, so we take the first of the edges from u to v
+            edge_data = next(iter(edges.values()))
             for attr in edge_data:
                 if attr in path_attributes:
                     # if this key already exists in the dict, append it to the
@@ -314,28 +379,41 @@ def simplify_graph(G, strict=True, remove_rings=True, track_merged=False):
                 # otherwise, if there are multiple values, keep one of each
                 path_attributes[attr] = list(set(path_attributes[attr]))
 
-        # construct the new consolidated edge's geometry for this path
-        path_attributes["geometry"] = LineString(
-            [Point((G.nodes[node]["x"], G.nodes[node]["y"])) for node in path]
-        )
-
         if track_merged:
             # add the merged edges as a new attribute of the simplified edge
             path_attributes["merged_edges"] = merged_edges
 
         # add the nodes and edge to their lists for processing at the end
-        all_nodes_to_remove.extend(path[1:-1])
-        all_edges_to_add.append(
-            {"origin": path[0], "destination": path[-1], "attr_dict": path_attributes}
+        all_nodes_to_remove.update(path[1:-1])
+        all_edges_to_add.append((path[0], path[-1], path_attributes))
+        path_nodes.append(path)
+
+    # construct the new consolidated edges' geometries from their paths' nodes
+    if path_nodes:
+        coords = np.array(
+            [(G.nodes[node]["x"], G.nodes[node]["y"]) for path in path_nodes for node in path], dtype=float
         )
-
-    # for each edge to add in the list we assembled, create a new edge between
-    # the origin and destination
-    for edge in all_edges_to_add:
-        G.add_edge(edge["origin"], edge["destination"], **edge["attr_dict"])
-
-    # finally remove all the interstitial nodes between the new edges
-    G.remove_nodes_from(set(all_nodes_to_remove))
+        indices = np.repeat(np.arange(len(path_nodes)), [len(path) for path in path_nodes])
+        for (_, _, path_attributes), geometry in zip(all_edges_to_add, shapely.linestrings(coords, indices=indices)):
+            path_attributes["geometry"] = geometry
+
+    # build the simplified graph from the nodes and edges it keeps, in their
+    # order, then create an edge between the origin and destination of each
+    # path: as if the paths' edges were added to a copy of the graph and the
+    # interstitial nodes removed
+    H = nx.MultiDiGraph(**G.graph)
+    H.add_nodes_from((n, data) for n, data in G.nodes(data=True) if n not in all_nodes_to_remove)
+    H.add_edges_from(
+        (u, v, k, data)
+        for u, v, k, data in G.edges(keys=True, data=True)
+        if u not in all_nodes_to_remove and v not in all_nodes_to_remove
+    )
+    for origin, destination, path_attributes in all_edges_to_add:
+        # a path may end at another path's interstitial node, whose removal
+        # would remove the edge again
+        if origin not in all_nodes_to_remove and destination not in all_nodes_to_remove:
+            H.add_edge(origin, destination, **path_attributes)
+    G = H
 
     if remove_rings:
         G = _remove_rings(G)
@@ -352,7 +430,7 @@ def simplify_graph(G, strict=True, remove_rings=True, track_merged=False):
 
 
 def consolidate_intersections(
-    G, tolerance=10, rebuild_graph=True, dead_ends=False, reconnect_edges=True
+    G, tolerance=10, rebuild_graph=True, dead_ends=False, reconnect_edges=True, method=None
 ):
     """
     Consolidate intersections comprising clusters of nearby nodes.
@@ -404,6 +482,13 @@ def consolidate_intersections(
         edge length attributes; if False, returned graph has no edges (which
         is faster if you just need topologically consolidated intersection
         counts).
+    method : string {"kdtree", "buffer"} or None
+        ignored if rebuild_graph is not True. how to find the clusters of
+        nodes whose buffers overlap: "buffer" buffers every node and dissolves
+        the buffers with a unary union; "kdtree" finds the node pairs within
+        2 * tolerance with a KD-tree and clusters their connected components,
+        which gives the same clusters and scales to millions of nodes. if
+        None, use "kdtree" when scipy is installed, otherwise "buffer".
 
     Returns
     -------
@@ -427,7 +512,7 @@ def consolidate_intersections(
             # cannot rebuild a graph with no nodes or no edges, just return it
             return G
         else:
-            return _consolidate_intersections_rebuild_graph(G, tolerance, reconnect_edges)
+            return _consolidate_intersections_rebuild_graph(G, tolerance, reconnect_edges, method)
 
     else:
         if not G:
@@ -464,7 +549,55 @@ def _merge_nodes_geometric(G, tolerance):
     return gpd.GeoSeries(merged.geoms, crs=G.graph["crs"])
 
 
-def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=True):
+def _cluster_nodes_kdtree(G, tolerance):
+    """
+    Cluster nodes whose buffers overlap, without building the buffers.
+
+    Two buffers of radius tolerance overlap when their nodes lie within
+    2 * tolerance of each other, so the polygons `_merge_nodes_geometric`
+    dissolves are the connected components of the pairs of such nodes. The
+    pairs come from a KD-tree, the components from a sparse graph search.
+    Only the clusters of several nodes are buffered, to place them at the
+    centroid of their dissolved buffers.
+
+    Parameters
+    ----------
+    G : networkx.MultiDiGraph
+        a projected graph
+    tolerance : float
+        buffer radius (in graph's geometry's units)
+
+    Returns
+    -------
+    gdf : pandas.DataFrame
+        indexed by node, with the cluster label and the cluster centroid's x
+        and y, in graph node order
+    """
+    if cKDTree is None:  # pragma: no cover
+        raise ImportError("scipy must be installed to cluster nodes with a KD-tree")
+
+    nodes = pd.Index(list(G.nodes), name="osmid")
+    xy = np.array([(data["x"], data["y"]) for _, data in G.nodes(data=True)], dtype=float).reshape(-1, 2)
+    pairs = cKDTree(xy).query_pairs(2 * tolerance, output_type="ndarray")
+    n = len(xy)
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, cluster = connected_components(adjacency, directed=False)
+
+    x, y = xy[:, 0].copy(), xy[:, 1].copy()
+    sizes = np.bincount(cluster)
+    merged = np.flatnonzero(sizes[cluster] > 1)
+    merged = merged[np.argsort(cluster[merged], kind="stable")]
+    buffers = shapely.buffer(shapely.points(xy[merged]), tolerance)
+    groups = np.split(np.arange(len(merged)), np.flatnonzero(np.diff(cluster[merged])) + 1) if len(merged) else []
+    for group in groups:
+        centroid = shapely.union_all(buffers[group]).centroid
+        x[merged[group]] = centroid.x
+        y[merged[group]] = centroid.y
+
+    return pd.DataFrame({"cluster": cluster, "x": x, "y": y}, index=nodes)
+
+
+def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=True, method=None):
     """
     Consolidate intersections comprising clusters of nearby nodes.
 
@@ -493,6 +626,8 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
         edge length attributes; if False, returned graph has no edges (which
         is faster if you just need topologically consolidated intersection
         counts).
+    method : string {"kdtree", "buffer"} or None
+        how to find the clusters of nodes, see `consolidate_intersections`
 
     Returns
     -------
@@ -500,28 +635,38 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
         a rebuilt graph with consolidated intersections and reconnected
         edge geometries
     """
-    # STEP 1
-    # buffer nodes to passed-in distance and merge overlaps. turn merged nodes
-    # into gdf and get centroids of each cluster as x, y
-    node_clusters = gpd.GeoDataFrame(geometry=_merge_nodes_geometric(G, tolerance))
-    centroids = node_clusters.centroid
-    node_clusters["x"] = centroids.x
-    node_clusters["y"] = centroids.y
-
-    # STEP 2
-    # attach each node to its cluster of merged nodes. first get the original
-    # graph's node points then spatial join to give each node the label of
-    # cluster it's within
-    node_points = utils_graph.graph_to_gdfs(G, edges=False)[["geometry"]]
-    gdf = gpd.sjoin(node_points, node_clusters, how="left", predicate="within")
-    gdf = gdf.drop(columns="geometry").rename(columns={"index_right": "cluster"})
+    if method is None:
+        method = "buffer" if cKDTree is None else "kdtree"
+    if method == "kdtree":
+        # STEPS 1 AND 2
+        # cluster nodes within 2 * tolerance of each other and get centroids
+        # of each cluster's merged buffers as x, y
+        gdf = _cluster_nodes_kdtree(G, tolerance)
+
+    else:
+        # STEP 1
+        # buffer nodes to passed-in distance and merge overlaps. turn merged nodes
+        # into gdf and get centroids of each cluster as x, y
+        node_clusters = gpd.GeoDataFrame(geometry=_merge_nodes_geometric(G, tolerance))
+        centroids = node_clusters.centroid
+        node_clusters["x"] = centroids.x
+        node_clusters["y"] = centroids.y
+
+        # STEP 2
+        # attach each node to its cluster of merged nodes. first get the original
+        # graph's node points then spatial join to give each node the label of
+        # cluster it's within
+        node_points = utils_graph.graph_to_gdfs(G, edges=False)[["geometry"]]
+        gdf = gpd.sjoin(node_points, node_clusters, how="left", predicate="within")
+        gdf = gdf.drop(columns="geometry").rename(columns={"index_right": "cluster"})
 
     # STEP 3
     # if a cluster contains multiple components (i.e., it's not connected)
     # move each component to its own cluster (otherwise you will connect
     # nodes together that are not truly connected, e.g., nearby deadends or
-    # surface streets with bridge).
-    groups = gdf.groupby("cluster")
+    # surface streets with bridge). single-node clusters are skipped up front.
+    sizes = gdf["cluster"].value_counts()
+    groups = gdf[gdf["cluster"].isin(sizes.index[sizes > 1])].groupby("cluster")
     for cluster_label, nodes_subset in groups:
         if len(nodes_subset) > 1:
             # identify all the (weakly connected) component in cluster
@@ -532,7 +677,9 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
                 for wcc in wccs:
                     # set subcluster xy to the centroid of just these nodes
                     idx = list(wcc)
-                    subcluster_centroid = node_points.loc[idx].unary_union.centroid
+                    subcluster_centroid = shapely.union_all(
+                        shapely.points([(G.nodes[n]["x"], G.nodes[n]["y"]) for n in idx])
+                    ).centroid
                     gdf.loc[idx, "x"] = subcluster_centroid.x
                     gdf.loc[idx, "y"] = subcluster_centroid.y
                     # move to subcluster by appending suffix to cluster label
@@ -549,10 +696,16 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
 
     # STEP 5
     # create a new node for each cluster of merged nodes
-    # regroup now that we potentially have new cluster labels from step 3
-    groups = gdf.groupby("cluster")
-    for cluster_label, nodes_subset in groups:
-        osmids = nodes_subset.index.to_list()
+    # regroup now that we potentially have new cluster labels from step 3.
+    # clusters are walked in label order, their nodes in graph order
+    labels = gdf["cluster"].to_numpy()
+    order = np.argsort(labels, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+    node_ids = gdf.index.to_list()
+    xs = gdf["x"].to_numpy()
+    ys = gdf["y"].to_numpy()
+    for cluster_label, idx in enumerate(groups):
+        osmids = [node_ids[i] for i in idx]
         if len(osmids) == 1:
             # if cluster is a single node, add that node to new graph
             osmid = osmids[0]
@@ -563,8 +716,8 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
             H.add_node(
                 cluster_label,
                 osmid_original=str(osmids),
-                x=nodes_subset["x"].iloc[0],
-                y=nodes_subset["y"].iloc[0],
+                x=xs[idx[0]],
+                y=ys[idx[0]],
             )
 
     # calculate street_count attribute for all nodes lacking it
@@ -579,10 +732,11 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
 
     # STEP 6
     # create new edge from cluster to cluster for each edge in original graph
-    gdf_edges = utils_graph.graph_to_gdfs(G, nodes=False)
+    gdf_edges = None
+    clusters = gdf["cluster"].to_dict()
     for u, v, k, data in G.edges(keys=True, data=True):
-        u2 = gdf.loc[u, "cluster"]
-        v2 = gdf.loc[v, "cluster"]
+        u2 = clusters[u]
+        v2 = clusters[v]
 
         # only create the edge if we're not connecting the cluster
         # to itself, but always add original self-loops
@@ -590,16 +744,18 @@ def _consolidate_intersections_rebuild_graph(G, tolerance=10, reconnect_edges=Tr
             data["u_original"] = u
             data["v_original"] = v
             if "geometry" not in data:
+                if gdf_edges is None:
+                    gdf_edges = utils_graph.graph_to_gdfs(G, nodes=False)
                 data["geometry"] = gdf_edges.loc[(u, v, k), "geometry"]
             H.add_edge(u2, v2, **data)
 
     # STEP 7
     # for every group of merged nodes with more than 1 node in it, extend the
     # edge geometries to reach the new node point
-    for cluster_label, nodes_subset in groups:
+    for cluster_label, idx in enumerate(groups):
         # but only if there were multiple nodes merged together,
         # otherwise it's the same old edge as in original graph
-        if len(nodes_subset) > 1:
+        if len(idx) > 1:
             # get coords of merged nodes point centroid to prepend or
             # append to the old edge geom's coords
             x = H.nodes[cluster_label]["x"]
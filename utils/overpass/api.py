@@ -129,6 +129,35 @@ class API(object):
         # construct geojson
         return self._as_geojson(response["elements"])
 
+    def stream(self, query, verbosity="body", build=True, chunk_size=65536):
+        """Pass in an Overpass query in Overpass QL and iterate over the raw
+        chunks of its XML response as they arrive, without holding the whole
+        body in memory.
+
+        :param query: the Overpass QL query to send to the endpoint
+        :param verbosity: output verbosity, as for get
+        :param build: boolean to indicate whether to build the overpass query from a template (True)
+                          or allow the programmer to specify full query manually (False)
+        :param chunk_size: number of bytes to read at a time
+        """
+        if build:
+            full_query = self._construct_ql_query(query, responseformat="xml", verbosity=verbosity)
+        else:
+            full_query = query
+
+        if self.debug:
+            logging.getLogger().info(query)
+
+        r = self._get_from_overpass(full_query, stream=True)
+        with r:
+            content_type = r.headers.get("content-type")
+            if content_type not in ("text/xml", "application/xml", "application/osm3s+xml"):
+                raise UnknownOverpassError(
+                    "Expected an XML answer, received {type}".format(type=content_type)
+                )
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                yield chunk
+
     def search(self, feature_type, regex=False):
         """Search for something."""
         raise NotImplementedError()
@@ -155,7 +184,7 @@ class API(object):
             print(complete_query)
         return complete_query
 
-    def _get_from_overpass(self, query):
+    def _get_from_overpass(self, query, stream=False):
         payload = {"data": query}
 
         try:
@@ -165,6 +194,7 @@ class API(object):
                 timeout=self.timeout,
                 proxies=self.proxies,
                 headers=self.headers,
+                stream=stream,
             )
 
         except requests.exceptions.Timeout: